@@ -0,0 +1,77 @@
+"""
+Compare resolving menu buttons through a chain of lazy-gettext magic
+filters with the per-locale CommandIndex.
+
+    python -m benchmarks.commands --iterations 20000
+"""
+import argparse
+import datetime
+import timeit
+
+from aiogram import F
+from aiogram.types import Chat, Message
+from aiogram.utils.i18n import I18n
+from aiogram.utils.i18n import lazy_gettext as __
+
+from seminar_bot.commands import MENU_COMMANDS, CommandIndex
+
+
+def make_message(text: str) -> Message:
+    return Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=1, type="private"),
+        text=text,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+
+    i18n = I18n(path="locales", default_locale="ru", domain="messages")
+    index = CommandIndex(i18n)
+    chain = [
+        (action, F.text == __(msgid))
+        for action, msgid in MENU_COMMANDS.items()
+    ]
+
+    def resolve_chain(message: Message) -> str | None:
+        for action, magic in chain:
+            if magic.resolve(message):
+                return action
+        return None
+
+    def resolve_index(message: Message) -> str | None:
+        return index.resolve(i18n.current_locale, message.text)
+
+    with i18n.context():
+        for locale in i18n.available_locales:
+            with i18n.use_locale(locale):
+                print(f"[{locale}]")
+                texts = [
+                    i18n.gettext(msgid) for msgid in MENU_COMMANDS.values()
+                ]
+                # free text typed during the FSM misses every button
+                texts.append("Some free-form text")
+                for text in texts:
+                    message = make_message(text)
+                    assert resolve_chain(message) == resolve_index(message)
+                    chained = timeit.timeit(
+                        lambda: resolve_chain(message),
+                        number=args.iterations,
+                    )
+                    indexed = timeit.timeit(
+                        lambda: resolve_index(message),
+                        number=args.iterations,
+                    )
+                    print(
+                        f"  {text[:24]:<24} "
+                        f"chain {chained / args.iterations * 1e6:6.2f} us  "
+                        f"index {indexed / args.iterations * 1e6:5.2f} us"
+                    )
+
+
+if __name__ == "__main__":
+    main()
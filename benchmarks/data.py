@@ -0,0 +1,61 @@
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from seminar_bot.catalog import add_event
+from seminar_bot.db import Event, User
+
+DATES = ("5 марта", "6 марта")
+SAMPLE_EVENT = dict(
+    slug="benchmark",
+    title={"ru": "Семинар", "uz": "Seminar"},
+    dates=[
+        ("5 марта", {"ru": "5 марта", "uz": "5 mart"}),
+        ("6 марта", {"ru": "6 марта", "uz": "6 mart"}),
+    ],
+    speakers=(
+        "Hosameldin Abdelhafez",
+        "Mohamed Ali",
+        "Gintaras Budginas",
+        "Tigran Aydinyan",
+        "Norbert Mischke",
+        "Slausgalvis Virginijus",
+    ),
+)
+
+
+async def sample_event(
+    session_factory: async_sessionmaker[AsyncSession],
+) -> int:
+    """The id of the benchmark event, added to the catalog if missing."""
+    async with session_factory() as session:
+        event_id = await session.scalar(
+            select(Event.id).where(Event.slug == SAMPLE_EVENT["slug"])
+        )
+        if event_id is None:
+            event_id = (await add_event(session, **SAMPLE_EVENT)).id
+            await session.commit()
+    return event_id
+
+
+async def fill_users(
+    session_factory: async_sessionmaker[AsyncSession],
+    rows: int,
+) -> None:
+    """Add synthetic registrations until tg_user has ``rows`` rows."""
+    event_id = await sample_event(session_factory)
+    async with session_factory() as session:
+        existing = await session.scalar(select(func.count(User.id)))
+        for start in range(existing, rows, 10_000):
+            session.add_all(
+                User(
+                    event_id=event_id,
+                    tg_id=i,
+                    name=f"User {i}",
+                    phone_number=f"+998{i:09d}",
+                    organization="Org",
+                    date=DATES[i % 2],
+                    hotel_info=i % 3 == 0,
+                )
+                for i in range(start, min(start + 10_000, rows))
+            )
+            await session.commit()
@@ -0,0 +1,136 @@
+"""
+Compare forwarding every question to the admin chat with the digest that
+merges near-duplicates.
+
+    python -m benchmarks.digest --questions 500 --topics 30
+
+Questions are paraphrases of ``--topics`` typical questions: different
+case and punctuation, swapped or dropped words, Latin spelling. The
+table shows how long clustering a window of them takes, how many clusters
+came out, how many of those mix topics and how many topics ended up in
+more than one, and how many admin-chat messages are sent either way with
+the time the group send limit needs for them.
+"""
+import argparse
+import random
+import time
+
+from seminar_bot.config import Config
+from seminar_bot.digest import (
+    BufferedQuestion,
+    cluster_questions,
+    digest_texts,
+)
+from seminar_bot.normalize import CYRILLIC_TO_LATIN
+
+# what attendees of a poultry seminar tend to ask
+TOPICS = (
+    "Какую вакцину от болезни Ньюкасла вы рекомендуете для бройлеров?",
+    "Сколько раз в день нужно кормить кур-несушек зимой?",
+    "Какая оптимальная температура в инкубаторе на последней неделе?",
+    "Почему у цыплят в первые дни высокий падёж?",
+    "Где можно скачать презентацию сегодняшнего доклада?",
+    "Когда будет следующий семинар и можно ли на него записаться?",
+    "Сколько стоит тонна комбикорма у вашего поставщика?",
+    "Как часто нужно менять подстилку в птичнике?",
+    "Какой световой режим лучше для повышения яйценоскости?",
+    "Чем лечить кокцидиоз, если антибиотики не помогают?",
+    "Нужна ли сертификация для продажи яиц в супермаркеты?",
+    "Как рассчитать вентиляцию для корпуса на 20 тысяч голов?",
+    "Какой кросс бройлеров быстрее набирает убойный вес?",
+    "Можно ли давать птице воду из скважины без очистки?",
+    "Есть ли субсидии на строительство нового птичника?",
+    "Как защитить ферму от птичьего гриппа весной?",
+    "Какие витамины добавлять в корм при тепловом стрессе?",
+    "Сколько квадратных метров нужно на одну несушку при напольном "
+    "содержании?",
+    "Как уменьшить запах аммиака в помещении?",
+    "Стоит ли переходить на клеточное содержание в маленьком хозяйстве?",
+    "Какие документы нужны для экспорта мяса птицы в Казахстан?",
+    "Чем опасен сальмонеллёз для людей, которые работают на ферме?",
+    "Как долго можно хранить инкубационное яйцо перед закладкой?",
+    "Почему куры начинают клевать друг друга?",
+    "Какая рентабельность у фермы на 5 тысяч несушек?",
+    "Проводите ли вы обучение для ветеринаров хозяйств?",
+    "Как выбрать поилки для цыплят первой недели?",
+    "Нужно ли отключать свет ночью в бройлерном корпусе?",
+    "Какой процент белка должен быть в стартовом корме?",
+    "Можно ли получить запись доклада на узбекском языке?",
+)
+
+
+def paraphrase(text: str, rng: random.Random) -> str:
+    words = text.rstrip("?").split()
+    if rng.random() < 0.3:
+        i = rng.randrange(len(words) - 1)
+        words[i], words[i + 1] = words[i + 1], words[i]
+    if rng.random() < 0.3 and len(words) > 4:
+        del words[rng.randrange(len(words))]
+    text = " ".join(words) + rng.choice(("?", "??", "", " ?"))
+    if rng.random() < 0.3:
+        text = text.lower()
+    if rng.random() < 0.2:
+        text = text.lower().translate(CYRILLIC_TO_LATIN)
+    return text
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=500)
+    parser.add_argument("--topics", type=int, default=len(TOPICS))
+    parser.add_argument("--similarity", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    asked = TOPICS[:args.topics]
+    questions, topic_of = [], {}
+    for user_tg_id in range(args.questions):
+        topic = rng.randrange(len(asked))
+        question = BufferedQuestion(
+            "Speaker", user_tg_id, paraphrase(asked[topic], rng)
+        )
+        questions.append(question)
+        topic_of[id(question)] = topic
+
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        clusters = cluster_questions(questions, args.similarity)
+        messages = digest_texts("Speaker", clusters)
+        timings.append(time.perf_counter() - started)
+    mixed = sum(
+        len({topic_of[id(question)] for question in cluster.questions}) > 1
+        for cluster in clusters
+    )
+    clusters_of: dict[int, set[int]] = {}
+    for number, cluster in enumerate(clusters):
+        for question in cluster.questions:
+            clusters_of.setdefault(topic_of[id(question)], set()).add(number)
+    split = sum(len(numbers) > 1 for numbers in clusters_of.values())
+    group_rate = Config.outbound_group_rate_per_minute
+
+    print(
+        f"{args.questions} questions on {len(asked)} topics, "
+        f"similarity {args.similarity}"
+    )
+    print(
+        f"clustering  {min(timings) * 1e3:8.1f} ms per window, "
+        f"{min(timings) / args.questions * 1e6:.0f} us per question"
+    )
+    print(
+        f"clusters    {len(clusters):8d}, mixing topics: {mixed}, "
+        f"topics split up: {split}"
+    )
+    print(
+        f"{'one by one':<12}{args.questions:5d} messages, "
+        f"{args.questions / group_rate:6.1f} min at the group limit"
+    )
+    print(
+        f"{'digest':<12}{len(messages):5d} messages, "
+        f"{len(messages) / group_rate:6.1f} min at the group limit"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Measure rows/sec and peak RSS of the tg_user export.
+
+    python -m benchmarks.export --rows 300000
+    python -m benchmarks.export --db-uri postgresql+asyncpg://.../bench
+
+The table is filled with synthetic users when it has fewer than --rows
+rows, so point --db-uri at a scratch database. Every run happens in a
+fresh process so the peak RSS of one doesn't hide another's. "buffered"
+loads the whole result before writing it, as a hand-written dump would.
+"""
+import argparse
+import asyncio
+import csv
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from benchmarks.data import fill_users, sample_event
+from seminar_bot.db import Base
+from seminar_bot.export import COLUMNS, export_query, iter_export
+
+
+async def buffered_csv(session_factory, path: str) -> None:
+    event_id = await sample_event(session_factory)
+    async with session_factory() as session:
+        rows = (
+            await session.execute(export_query(list(COLUMNS), event_id))
+        ).all()
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+
+
+async def streamed(session_factory, fmt: str, path: str) -> None:
+    event_id = await sample_event(session_factory)
+    chunks = iter_export(session_factory, fmt, list(COLUMNS), event_id)
+    with open(path, "wb") as f:
+        async for chunk in chunks:
+            f.write(chunk)
+
+
+async def export(db_uri: str, mode: str, path: str) -> None:
+    engine = create_async_engine(db_uri)
+    session_factory = async_sessionmaker(bind=engine)
+    if mode == "buffered":
+        await buffered_csv(session_factory, path)
+    else:
+        await streamed(session_factory, mode, path)
+    await engine.dispose()
+
+
+def child(db_uri: str, mode: str, results) -> None:
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    fd, path = tempfile.mkstemp(suffix=f".{mode}")
+    os.close(fd)
+    started = time.perf_counter()
+    asyncio.run(export(db_uri, mode, path))
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((elapsed, before, peak, os.path.getsize(path)))
+    os.unlink(path)
+
+
+async def prepare(db_uri: str, rows: int) -> None:
+    engine = create_async_engine(db_uri)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await fill_users(async_sessionmaker(bind=engine), rows)
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--db-uri", default="sqlite+aiosqlite:///export.sqlite3"
+    )
+    parser.add_argument("--rows", type=int, default=300_000)
+    args = parser.parse_args()
+    asyncio.run(prepare(args.db_uri, args.rows))
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'':<10}{'rows/s':>10}{'peak RSS':>12}{'export RSS':>12}"
+          f"{'size':>10}")
+    for mode in ("buffered", "csv", "xlsx"):
+        results = context.Queue()
+        process = context.Process(
+            target=child, args=(args.db_uri, mode, results)
+        )
+        process.start()
+        elapsed, before, peak, size = results.get()
+        process.join()
+        # ru_maxrss is in kilobytes on Linux
+        print(
+            f"{mode:<10}{args.rows / elapsed:>10.0f}"
+            f"{peak / 1024:>10.1f}MB{(peak - before) / 1024:>10.1f}MB"
+            f"{size / 1024 / 1024:>8.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Compare building reply keyboards per message with the locale cache.
+
+    python -m benchmarks.keyboards --iterations 20000
+"""
+import argparse
+import timeit
+
+from aiogram.utils.i18n import I18n
+
+from benchmarks.data import SAMPLE_EVENT
+from seminar_bot.catalog import CatalogDate, CatalogEvent
+from seminar_bot.forum import speakers_kb
+from seminar_bot.keyboards import (
+    cancel_kb,
+    contact_kb,
+    date_kb,
+    get_meu_kb,
+    hotel_kb,
+)
+
+EVENT = CatalogEvent(
+    id=1,
+    slug=SAMPLE_EVENT["slug"],
+    titles=SAMPLE_EVENT["title"],
+    active=True,
+    dates=tuple(
+        CatalogDate(SAMPLE_EVENT["slug"], key, labels)
+        for key, labels in SAMPLE_EVENT["dates"]
+    ),
+    speakers=SAMPLE_EVENT["speakers"],
+    plan_file_ids={},
+)
+# builder, arguments
+BUILDERS = (
+    (get_meu_kb, ()),
+    (cancel_kb, ()),
+    (contact_kb, ()),
+    (date_kb, (EVENT,)),
+    (hotel_kb, ()),
+    (speakers_kb, (EVENT,)),
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+
+    i18n = I18n(path="locales", default_locale="ru", domain="messages")
+    with i18n.context():
+        for locale in i18n.available_locales:
+            with i18n.use_locale(locale):
+                print(f"[{locale}]")
+                for builder, builder_args in BUILDERS:
+                    uncached = timeit.timeit(
+                        lambda: builder.__wrapped__(*builder_args),
+                        number=args.iterations,
+                    )
+                    cached = timeit.timeit(
+                        lambda: builder(*builder_args), number=args.iterations
+                    )
+                    per_call_uncached = uncached / args.iterations * 1e6
+                    per_call_cached = cached / args.iterations * 1e6
+                    print(
+                        f"  {builder.__name__:<12} "
+                        f"build {per_call_uncached:7.2f} us  "
+                        f"cached {per_call_cached:5.2f} us  "
+                        f"x{uncached / cached:.0f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Measure how long the entry modules take to import, with -X importtime.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeat 10 --budget seminar_bot.web=800
+
+Every import runs in a fresh interpreter started in an empty directory, so
+a module that reads config.ini or connects anywhere at import time fails
+instead of being measured. The median of --repeat runs is compared with
+the module's budget in milliseconds, and the heaviest packages it pulls
+in are listed. Modules must also stay clear of the packages listed in
+FORBIDDEN; the admin panel, for one, has no use for aiogram. The exit
+status is 1 when any module is over budget or imports a forbidden package.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# milliseconds, with room for a slower machine than the one that set them
+BUDGETS = {
+    "seminar_bot.main": 3000,
+    "seminar_bot.workers": 3000,
+    "seminar_bot.web": 1500,
+    "seminar_bot.export": 800,
+}
+FORBIDDEN = {
+    "seminar_bot.web": ("aiogram", "aiohttp"),
+    "seminar_bot.export": ("aiogram", "aiohttp"),
+}
+
+# loaded by the interpreter and the probe rather than the module
+NOT_MEASURED = {"site", "encodings", "json"}
+
+PROBE = """
+import json, sys
+import {module}
+print(json.dumps([name for name in {forbidden!r} if name in sys.modules]))
+"""
+
+
+def import_once(module: str, cwd: str) -> tuple[dict[str, int], list[str]]:
+    """
+    Import ``module`` in a new interpreter. Returns the cumulative import
+    time in microseconds of every module it loaded and the forbidden
+    packages that ended up in sys.modules.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(
+            module=module, forbidden=FORBIDDEN.get(module, ()),
+        )],
+        cwd=cwd,
+        env={**os.environ, "PYTHONPATH": ROOT},
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr}")
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line.split("|")
+        if total.strip().isdigit():
+            cumulative[name.strip()] = int(total)
+    return cumulative, json.loads(result.stdout)
+
+
+def measure(module: str, repeat: int, cwd: str) -> dict:
+    totals = []
+    packages: dict[str, list[int]] = defaultdict(list)
+    forbidden: set[str] = set()
+    skip = NOT_MEASURED | {module.split(".")[0]}
+    for _ in range(repeat):
+        cumulative, present = import_once(module, cwd)
+        totals.append(cumulative[module])
+        forbidden.update(present)
+        for name, total in cumulative.items():
+            if "." not in name and name not in skip:
+                packages[name].append(total)
+    return dict(
+        total_ms=statistics.median(totals) / 1000,
+        packages={
+            name: statistics.median(values) / 1000
+            for name, values in packages.items()
+        },
+        forbidden=sorted(forbidden),
+    )
+
+
+def parse_budget(value: str) -> tuple[str, float]:
+    module, _, ms = value.partition("=")
+    return module, float(ms)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "modules", nargs="*", default=list(BUDGETS),
+        help="modules to import (default: all with a budget)",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget", type=parse_budget, action="append", default=[],
+        metavar="MODULE=MS", help="override a module's budget",
+    )
+    parser.add_argument(
+        "--top", type=int, default=5,
+        help="heaviest packages listed per module",
+    )
+    args = parser.parse_args()
+    budgets = {**BUDGETS, **dict(args.budget)}
+
+    failed = False
+    with tempfile.TemporaryDirectory() as cwd:
+        for module in args.modules:
+            result = measure(module, args.repeat, cwd)
+            budget = budgets.get(module)
+            over = budget is not None and result["total_ms"] > budget
+            failed |= over or bool(result["forbidden"])
+            verdict = "OVER BUDGET" if over else "ok"
+            print(
+                f"{module:<24}{result['total_ms']:>8.0f} ms"
+                f"  budget {budget or '-'} ms  {verdict}"
+            )
+            heaviest = sorted(
+                result["packages"].items(), key=lambda item: -item[1]
+            )[:args.top]
+            for name, ms in heaviest:
+                print(f"    {name:<20}{ms:>8.0f} ms")
+            if result["forbidden"]:
+                print(f"    imports {', '.join(result['forbidden'])}, "
+                      f"which it must not")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+A Bot API session that answers locally, for driving the dispatcher
+without Telegram.
+"""
+import asyncio
+import datetime
+import itertools
+import time
+from collections import Counter
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import (
+    CopyMessage,
+    GetMe,
+    SendMediaGroup,
+    SendMessage,
+    SendPhoto,
+    TelegramMethod,
+)
+from aiogram.types import Chat, Message, MessageId, PhotoSize, Update, User
+
+BOT_USER = User(id=42, is_bot=True, first_name="Seminar bot")
+
+
+class StubSession(BaseSession):
+    """
+    Returns plausible results for the methods the bot uses and records
+    every request and every text message sent. ``latency`` seconds are
+    awaited per request to mimic the round trip to Telegram. Sessions
+    standing in for the same bot in several processes need disjoint
+    ``first_message_id`` ranges.
+    """
+
+    def __init__(self, latency: float = 0, first_message_id: int = 1_000_000):
+        super().__init__()
+        self.latency = latency
+        self.requests: Counter[str] = Counter()
+        self.messages: list[Message] = []
+        self._message_ids = itertools.count(first_message_id)
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, *args: Any, **kwargs: Any):
+        yield b""
+
+    def _message(self, chat_id: int, **kwargs: Any) -> Message:
+        return Message(
+            message_id=next(self._message_ids),
+            date=datetime.datetime.now(),
+            chat=Chat(id=chat_id, type="private" if chat_id > 0 else "group"),
+            from_user=BOT_USER,
+            **kwargs,
+        )
+
+    def _photo_message(self, chat_id: int) -> Message:
+        return self._message(chat_id, photo=[PhotoSize(
+            file_id=f"photo{next(self._message_ids)}",
+            file_unique_id="photo",
+            width=1280,
+            height=720,
+        )])
+
+    async def make_request(
+        self,
+        bot: Bot,
+        method: TelegramMethod,
+        timeout: int | None = None,
+    ) -> Any:
+        self.requests[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, SendMessage):
+            message = self._message(method.chat_id, text=method.text)
+            self.messages.append(message)
+            return message
+        if isinstance(method, CopyMessage):
+            return MessageId(message_id=next(self._message_ids))
+        if isinstance(method, SendPhoto):
+            return self._photo_message(method.chat_id)
+        if isinstance(method, SendMediaGroup):
+            return [self._photo_message(method.chat_id) for _ in method.media]
+        if isinstance(method, GetMe):
+            return BOT_USER
+        return True
+
+
+_update_ids = itertools.count(1)
+
+
+def message_update(
+    user_id: int,
+    text: str | None = None,
+    chat_id: int | None = None,
+    reply_to: dict | None = None,
+    contact: dict | None = None,
+) -> Update:
+    """An incoming message update from ``user_id``, in their private chat
+    unless ``chat_id`` is given."""
+    update_id = next(_update_ids)
+    chat_id = chat_id or user_id
+    message: dict[str, Any] = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {
+            "id": chat_id,
+            "type": "private" if chat_id > 0 else "supergroup",
+        },
+        "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+    }
+    if text is not None:
+        message["text"] = text
+    if reply_to is not None:
+        message["reply_to_message"] = reply_to
+    if contact is not None:
+        message["contact"] = contact
+    return Update.model_validate({"update_id": update_id, "message": message})
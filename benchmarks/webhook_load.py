@@ -0,0 +1,92 @@
+"""
+POST synthetic updates to a running webhook endpoint and report how fast
+they are acknowledged.
+
+    python -m benchmarks.webhook_load --url http://127.0.0.1:8080/webhook \\
+        --secret <webhook secret> --updates 5000 --concurrency 200
+"""
+import argparse
+import asyncio
+import itertools
+import statistics
+import time
+
+from aiohttp import ClientSession, TCPConnector
+
+_update_ids = itertools.count(1)
+
+
+def make_update(user_id: int, text: str) -> dict:
+    update_id = next(_update_ids)
+    user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+async def run(args: argparse.Namespace) -> None:
+    headers = {}
+    if args.secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = args.secret
+
+    queue: asyncio.Queue[dict] = asyncio.Queue()
+    for i in range(args.updates):
+        user_id = args.first_user_id + i % args.users
+        queue.put_nowait(make_update(user_id, args.text))
+
+    latencies: list[float] = []
+    errors = 0
+
+    async def worker(session: ClientSession) -> None:
+        nonlocal errors
+        while not queue.empty():
+            update = queue.get_nowait()
+            started = time.perf_counter()
+            async with session.post(
+                args.url, json=update, headers=headers
+            ) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    connector = TCPConnector(limit=args.concurrency)
+    async with ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(worker(session) for _ in range(args.concurrency))
+        )
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"updates:    {len(latencies)} ({errors} errors)")
+    print(f"elapsed:    {elapsed:.2f}s")
+    print(f"throughput: {len(latencies) / elapsed:.0f} updates/s")
+    print(
+        f"ack p50/p95/p99: {quantiles[49] * 1000:.1f}/"
+        f"{quantiles[94] * 1000:.1f}/{quantiles[98] * 1000:.1f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--first-user-id", type=int, default=10_000_000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--text", default="/start")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
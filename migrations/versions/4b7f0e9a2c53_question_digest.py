@@ -0,0 +1,43 @@
+"""question digest
+
+Revision ID: 4b7f0e9a2c53
+Revises: e8b4d2c61f07
+Create Date: 2026-10-18 21:16:40.207815
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '4b7f0e9a2c53'
+down_revision: Union[str, None] = 'e8b4d2c61f07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'question', sa.Column('cluster', sa.Integer(), nullable=True)
+    )
+    op.drop_index('ix_question_admin_message', table_name='question')
+    op.create_index(
+        'ix_question_admin_message', 'question',
+        ['admin_chat_id', 'admin_message_id']
+    )
+
+
+def downgrade() -> None:
+    # a digest message can only keep one of its questions
+    op.execute(
+        "DELETE FROM question WHERE id NOT IN ("
+        "SELECT min(id) FROM question "
+        "GROUP BY admin_chat_id, admin_message_id)"
+    )
+    op.drop_index('ix_question_admin_message', table_name='question')
+    op.create_index(
+        'ix_question_admin_message', 'question',
+        ['admin_chat_id', 'admin_message_id'], unique=True
+    )
+    op.drop_column('question', 'cluster')
@@ -0,0 +1,35 @@
+"""tg_user tg_id unique index
+
+Revision ID: 5d3b3936eaea
+Revises: 86f53c214a58
+Create Date: 2026-10-18 10:12:41.503117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '5d3b3936eaea'
+down_revision: Union[str, None] = '86f53c214a58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Older deployments could register the same user twice, keep the first
+    # registration so the unique index can be built.
+    op.execute(
+        sa.text(
+            "DELETE FROM tg_user a USING tg_user b "
+            "WHERE a.tg_id = b.tg_id AND a.id > b.id"
+        )
+    )
+    op.create_index(
+        op.f('ix_tg_user_tg_id'), 'tg_user', ['tg_id'], unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_tg_user_tg_id'), table_name='tg_user')
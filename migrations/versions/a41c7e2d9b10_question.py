@@ -0,0 +1,52 @@
+"""question ledger
+
+Revision ID: a41c7e2d9b10
+Revises: 5d3b3936eaea
+Create Date: 2026-10-18 14:05:12.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41c7e2d9b10'
+down_revision: Union[str, None] = '5d3b3936eaea'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'question',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('admin_chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('admin_message_id', sa.BigInteger(), nullable=False),
+        sa.Column('user_tg_id', sa.BigInteger(), nullable=False),
+        sa.Column('speaker', sa.String(), nullable=False),
+        sa.Column('text', sa.String(), nullable=False),
+        sa.Column('answered', sa.Boolean(), nullable=False,
+                  server_default=sa.false()),
+        sa.Column('created_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('now()'), nullable=False),
+        sa.Column('answered_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_question_admin_message', 'question',
+        ['admin_chat_id', 'admin_message_id'], unique=True
+    )
+    op.create_index(
+        op.f('ix_question_user_tg_id'), 'question', ['user_tg_id']
+    )
+    op.create_index(op.f('ix_question_speaker'), 'question', ['speaker'])
+    op.create_index(op.f('ix_question_answered'), 'question', ['answered'])
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_question_answered'), table_name='question')
+    op.drop_index(op.f('ix_question_speaker'), table_name='question')
+    op.drop_index(op.f('ix_question_user_tg_id'), table_name='question')
+    op.drop_index('ix_question_admin_message', table_name='question')
+    op.drop_table('question')
@@ -0,0 +1,103 @@
+"""tg_user search columns and trigram index
+
+Revision ID: c6e1f0a3b7d2
+Revises: a41c7e2d9b10
+Create Date: 2026-10-18 16:20:37.114902
+
+"""
+import re
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6e1f0a3b7d2'
+down_revision: Union[str, None] = 'a41c7e2d9b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+
+# seminar_bot.normalize as of this revision, copied so that changing the
+# module later doesn't change what this migration writes
+CYRILLIC_TO_LATIN = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo",
+    "ж": "j", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "x", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "",
+    "ы": "i", "ь": "", "э": "e", "ю": "yu", "я": "ya", "ў": "o", "қ": "q",
+    "ғ": "g", "ҳ": "h",
+})
+APOSTROPHES_REGEX = re.compile(r"['‘’ʻʼ`´]")
+NON_WORD_REGEX = re.compile(r"[\W_]+")
+LEGAL_FORMS = frozenset({
+    "ooo", "oao", "zao", "pao", "ao", "ip", "chp", "mchj", "aj", "xk", "qk",
+    "llc", "ltd", "jsc",
+})
+
+
+def normalize_text(text: str | None) -> str:
+    text = (text or "").lower().translate(CYRILLIC_TO_LATIN)
+    text = APOSTROPHES_REGEX.sub("", text)
+    return " ".join(
+        word for word in NON_WORD_REGEX.sub(" ", text).split()
+        if word not in LEGAL_FORMS
+    )
+
+
+def search_text(name: str | None, organization: str | None) -> str:
+    return f"{normalize_text(name)} {normalize_text(organization)}".strip()
+
+
+def upgrade() -> None:
+    op.execute(sa.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    op.add_column(
+        'tg_user', sa.Column('phone_digits', sa.String(), nullable=True)
+    )
+    op.add_column(
+        'tg_user', sa.Column('search_text', sa.String(), nullable=True)
+    )
+
+    op.execute(sa.text(
+        "UPDATE tg_user "
+        "SET phone_digits = regexp_replace(phone_number, '\\D', '', 'g')"
+    ))
+    # the transliteration lives in Python, fill search_text in batches
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text(
+                "SELECT id, name, organization FROM tg_user "
+                "WHERE id > :last_id ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": BATCH_SIZE},
+        ).all()
+        if not rows:
+            break
+        bind.execute(
+            sa.text("UPDATE tg_user SET search_text = :text WHERE id = :id"),
+            [
+                {"id": id_, "text": search_text(name, organization)}
+                for id_, name, organization in rows
+            ],
+        )
+        last_id = rows[-1][0]
+
+    op.create_index(
+        'ix_tg_user_phone_digits', 'tg_user', ['phone_digits'],
+        postgresql_ops={'phone_digits': 'text_pattern_ops'},
+    )
+    op.create_index(
+        'ix_tg_user_search_text', 'tg_user', ['search_text'],
+        postgresql_using='gin',
+        postgresql_ops={'search_text': 'gin_trgm_ops'},
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tg_user_search_text', table_name='tg_user')
+    op.drop_index('ix_tg_user_phone_digits', table_name='tg_user')
+    op.drop_column('tg_user', 'search_text')
+    op.drop_column('tg_user', 'phone_digits')
@@ -0,0 +1,133 @@
+"""event catalog
+
+Revision ID: e8b4d2c61f07
+Revises: c6e1f0a3b7d2
+Create Date: 2026-10-18 18:42:09.551730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8b4d2c61f07'
+down_revision: Union[str, None] = 'c6e1f0a3b7d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# the seminar the bot was written for, existing registrations belong to it
+SEMINAR = {
+    "slug": "poultry-2024",
+    "title": {
+        "ru": "Семинар «Современные вызовы в птицеводстве Узбекистана I» "
+              "Ташкент 2024.",
+        "uz": "“O‘zbekistonda parrandachilikning zamonaviy muammolari I” "
+              "Toshkent 2024 seminari.",
+    },
+    "plan_file_ids": {},
+    "active": True,
+}
+DATES = (
+    {"key": "5 марта", "label": {"ru": "5 марта", "uz": "5 mart"}},
+    {"key": "6 марта", "label": {"ru": "6 марта", "uz": "6 mart"}},
+)
+SPEAKERS = (
+    "Hosameldin Abdelhafez",
+    "Mohamed Ali",
+    "Gintaras Budginas",
+    "Tigran Aydinyan",
+    "Norbert Mischke",
+    "Slausgalvis Virginijus",
+)
+
+
+def upgrade() -> None:
+    event = op.create_table(
+        'event',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('slug', sa.String(), nullable=False),
+        sa.Column('title', sa.JSON(), nullable=False),
+        sa.Column('plan_file_ids', sa.JSON(), nullable=False),
+        sa.Column('active', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('slug')
+    )
+    event_date = op.create_table(
+        'event_date',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('event_id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('label', sa.JSON(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('seats', sa.Integer(), nullable=True),
+        sa.Column('rooms', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['event_id'], ['event.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('event_id', 'key', name='uq_event_date_key')
+    )
+    speaker = op.create_table(
+        'speaker',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('event_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['event_id'], ['event.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('event_id', 'name', name='uq_speaker_name')
+    )
+
+    bind = op.get_bind()
+    event_id = bind.execute(
+        event.insert().values(**SEMINAR).returning(event.c.id)
+    ).scalar_one()
+    op.bulk_insert(event_date, [
+        dict(date, event_id=event_id, position=position)
+        for position, date in enumerate(DATES)
+    ])
+    op.bulk_insert(speaker, [
+        dict(event_id=event_id, name=name, position=position)
+        for position, name in enumerate(SPEAKERS)
+    ])
+
+    op.add_column(
+        'tg_user', sa.Column('event_id', sa.Integer(), nullable=True)
+    )
+    op.execute(
+        sa.text("UPDATE tg_user SET event_id = :event_id")
+        .bindparams(event_id=event_id)
+    )
+    op.alter_column('tg_user', 'event_id', nullable=False)
+    op.create_foreign_key(
+        'tg_user_event_id_fkey', 'tg_user', 'event', ['event_id'], ['id']
+    )
+    op.create_index(op.f('ix_tg_user_event_id'), 'tg_user', ['event_id'])
+    # one registration per event instead of one per Telegram user
+    op.create_unique_constraint(
+        'uq_tg_user_event_tg_id', 'tg_user', ['event_id', 'tg_id']
+    )
+    op.drop_index(op.f('ix_tg_user_tg_id'), table_name='tg_user')
+    op.create_index(op.f('ix_tg_user_tg_id'), 'tg_user', ['tg_id'])
+
+
+def downgrade() -> None:
+    # registrations for other events than the first would break the
+    # tg_id unique index
+    op.execute(sa.text(
+        "DELETE FROM tg_user WHERE event_id <> (SELECT min(id) FROM event)"
+    ))
+    op.drop_index(op.f('ix_tg_user_tg_id'), table_name='tg_user')
+    op.create_index(
+        op.f('ix_tg_user_tg_id'), 'tg_user', ['tg_id'], unique=True
+    )
+    op.drop_constraint('uq_tg_user_event_tg_id', 'tg_user', type_='unique')
+    op.drop_index(op.f('ix_tg_user_event_id'), table_name='tg_user')
+    op.drop_constraint('tg_user_event_id_fkey', 'tg_user', type_='foreignkey')
+    op.drop_column('tg_user', 'event_id')
+    op.drop_table('speaker')
+    op.drop_table('event_date')
+    op.drop_table('event')
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+
+from aiogram import Bot, F, Router, types
+from aiogram.filters import Command, CommandObject
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from seminar_bot.broadcast import Broadcast, BroadcastRunning
+from seminar_bot.catalog import EventCatalog
+from seminar_bot.filters import IsAdmin
+from seminar_bot.media import PlanMedia
+from seminar_bot.questions import QuestionLedger
+from seminar_bot.search import search_users
+from seminar_bot.outbound import OutboundScheduler
+from seminar_bot.stats import RegistrationStats
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+router.message.filter(IsAdmin())
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def _run_broadcast(broadcast: Broadcast, chat_id: int) -> None:
+    try:
+        report = str(await broadcast.run())
+    except BroadcastRunning:
+        # resumed twice at once, the other run reports
+        report = f"Рассылка {broadcast.broadcast_id} уже идёт"
+    except Exception:
+        logger.exception("Broadcast %s failed", broadcast.broadcast_id)
+        report = str(await broadcast.report())
+    await broadcast.bot.send_message(chat_id, report, parse_mode=None)
+
+
+def _start(broadcast: Broadcast, chat_id: int) -> None:
+    task = asyncio.create_task(_run_broadcast(broadcast, chat_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+@router.message(Command("broadcast"), F.reply_to_message)
+async def start_broadcast(
+    message: types.Message,
+    bot: Bot,
+    redis: Redis,
+    session_factory: async_sessionmaker[AsyncSession],
+    outbound: OutboundScheduler,
+    catalog: EventCatalog,
+):
+    broadcast = await Broadcast.create(
+        message.chat.id,
+        message.reply_to_message.message_id,
+        catalog.event.id,
+        bot=bot,
+        redis=redis,
+        session_factory=session_factory,
+        outbound=outbound,
+    )
+    _start(broadcast, message.chat.id)
+    broadcast_id = broadcast.broadcast_id
+    await message.reply(
+        f"Рассылка {broadcast_id} запущена.\n"
+        f"Прогресс: /broadcast_status {broadcast_id}\n"
+        f"Продолжить после сбоя: /broadcast_resume {broadcast_id}"
+    )
+
+
+@router.message(Command("broadcast"))
+async def broadcast_help(message: types.Message):
+    await message.reply(
+        "Ответьте командой /broadcast на сообщение, которое нужно разослать"
+    )
+
+
+@router.message(Command("broadcast_resume"))
+async def resume_broadcast(
+    message: types.Message,
+    command: CommandObject,
+    bot: Bot,
+    redis: Redis,
+    session_factory: async_sessionmaker[AsyncSession],
+    outbound: OutboundScheduler,
+):
+    broadcast = Broadcast(
+        command.args or "",
+        bot=bot,
+        redis=redis,
+        session_factory=session_factory,
+        outbound=outbound,
+    )
+    if not command.args or not await broadcast.exists():
+        return await message.reply("Рассылка не найдена")
+    if await broadcast.running():
+        return await message.reply(
+            f"Рассылка {broadcast.broadcast_id} уже идёт"
+        )
+    _start(broadcast, message.chat.id)
+    await message.reply(f"Рассылка {broadcast.broadcast_id} продолжена")
+
+
+@router.message(Command("broadcast_status"))
+async def broadcast_status(
+    message: types.Message,
+    command: CommandObject,
+    bot: Bot,
+    redis: Redis,
+    session_factory: async_sessionmaker[AsyncSession],
+    outbound: OutboundScheduler,
+):
+    broadcast = Broadcast(
+        command.args or "",
+        bot=bot,
+        redis=redis,
+        session_factory=session_factory,
+        outbound=outbound,
+    )
+    if not command.args or not await broadcast.exists():
+        return await message.reply("Рассылка не найдена")
+    await message.reply(str(await broadcast.report()), parse_mode=None)
+
+
+@router.message(Command("reload_plan"))
+async def reload_plan(message: types.Message, plan_media: PlanMedia):
+    try:
+        await plan_media.reload()
+    except Exception:
+        logger.exception("Failed to reload the seminar plan")
+        return await message.reply(
+            "Не удалось обновить программу, используется прежняя"
+        )
+    counts = ", ".join(
+        f"{locale}: {len(plan_media.get(locale))}"
+        for locale in plan_media.locales
+    )
+    await message.reply(f"Программа семинара обновлена ({counts})")
+
+
+@router.message(Command("reload_catalog"))
+async def reload_catalog(message: types.Message, catalog: EventCatalog):
+    try:
+        await catalog.invalidate()
+    except Exception:
+        logger.exception("Failed to reload the event catalog")
+        return await message.reply(
+            "Не удалось обновить каталог мероприятий, используется прежний"
+        )
+    event = catalog.event
+    await message.reply(
+        f"Каталог мероприятий обновлён, регистрация на {event.slug}: "
+        f"дат {len(event.dates)}, спикеров {len(event.speakers)}",
+        parse_mode=None,
+    )
+
+
+@router.message(Command("unanswered"))
+async def unanswered(
+    message: types.Message,
+    command: CommandObject,
+    questions: QuestionLedger,
+    catalog: EventCatalog,
+):
+    speakers = catalog.event.speakers
+    speaker = None
+    if command.args:
+        matches = [
+            name for name in speakers
+            if command.args.strip().lower() in name.lower()
+        ]
+        if len(matches) != 1:
+            return await message.reply(
+                "Укажите одного из спикеров:\n" + "\n".join(speakers),
+                parse_mode=None,
+            )
+        speaker = matches[0]
+
+    total, oldest = await questions.unanswered(speaker)
+    if not total:
+        return await message.reply("Неотвеченных вопросов нет")
+    lines = [f"Неотвеченных вопросов: {total}"]
+    for question in oldest:
+        text = question.text
+        if len(text) > 100:
+            text = text[:100] + "…"
+        lines.append(
+            f"\n{question.speaker} (#id{question.user_tg_id}, "
+            f"сообщение {question.admin_message_id}):\n{text}"
+        )
+    await message.reply("\n".join(lines), parse_mode=None)
+
+
+@router.message(Command("stats"))
+async def stats(
+    message: types.Message,
+    command: CommandObject,
+    registration_stats: RegistrationStats,
+):
+    top = None
+    if command.args:
+        args = command.args.strip()
+        if not args.isdigit() or not int(args):
+            return await message.reply(
+                "Укажите число организаций, например /stats 20"
+            )
+        top = int(args)
+    summary = await registration_stats.summary(top)
+    await message.reply(str(summary), parse_mode=None)
+
+
+@router.message(Command("find"))
+async def find(
+    message: types.Message,
+    command: CommandObject,
+    session: AsyncSession,
+):
+    query = (command.args or "").strip()
+    if not query:
+        return await message.reply(
+            "Укажите имя, организацию или начало номера телефона, "
+            "например /find Ромашка"
+        )
+    results = await search_users(session, query)
+    if not results:
+        return await message.reply("Никого не найдено")
+    lines = [
+        f"{user.name} ({user.organization or '—'}), {user.phone_number}, "
+        f"{user.date or '—'}, #id{user.tg_id}"
+        for user, _ in results
+    ]
+    await message.reply("\n".join(lines), parse_mode=None)
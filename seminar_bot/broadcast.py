@@ -0,0 +1,293 @@
+"""
+Copy one message to every user registered for an event, by default the
+one the bot registers attendees for.
+
+    python -m seminar_bot.broadcast --from-chat <chat id> --message-id <id>
+    python -m seminar_bot.broadcast --resume <broadcast id>
+
+Progress is checkpointed in Redis, so a broadcast interrupted by a crash or
+restart continues where it stopped when resumed with the same id. A lock
+per broadcast keeps a resume from running next to a run still going.
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import secrets
+import time
+from dataclasses import dataclass
+from functools import partial
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+from redis.asyncio import Redis
+from redis.asyncio.lock import Lock
+from redis.exceptions import LockError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from seminar_bot.config import load_config
+from seminar_bot.db import User, create_engine, current_event_id
+from seminar_bot.outbound import OutboundScheduler, Priority, QueueFull
+from seminar_bot.storage import create_redis
+
+logger = logging.getLogger(__name__)
+
+SENT = "sent"
+FAILED = "failed"
+BLOCKED = "blocked"
+# seconds the lock of a running broadcast outlives its last extension
+LOCK_TIMEOUT = 60
+
+
+class BroadcastRunning(Exception):
+    pass
+
+
+@dataclass
+class BroadcastReport:
+    broadcast_id: str
+    sent: int
+    failed: int
+    blocked: int
+    elapsed: float
+    finished: bool
+
+    @property
+    def throughput(self) -> float:
+        return self.sent / self.elapsed if self.elapsed else 0
+
+    def __str__(self) -> str:
+        status = "завершена" if self.finished else "не завершена"
+        return (
+            f"Рассылка {self.broadcast_id} {status}\n"
+            f"Доставлено: {self.sent}\n"
+            f"Заблокировали бота: {self.blocked}\n"
+            f"Ошибки: {self.failed}\n"
+            f"Скорость: {self.throughput:.1f} сообщ./с"
+        )
+
+
+class Broadcast:
+    def __init__(
+        self,
+        broadcast_id: str,
+        bot: Bot,
+        redis: Redis,
+        session_factory: async_sessionmaker[AsyncSession],
+        outbound: OutboundScheduler,
+        batch_size: int = 500,
+    ):
+        self.broadcast_id = broadcast_id
+        self.bot = bot
+        self.redis = redis
+        self.session_factory = session_factory
+        self.outbound = outbound
+        self.batch_size = batch_size
+        self.key = f"broadcast:{broadcast_id}"
+        self.recipients_key = f"{self.key}:recipients"
+        self.lock_key = f"{self.key}:lock"
+
+    @classmethod
+    async def create(
+        cls,
+        from_chat_id: int,
+        message_id: int,
+        event_id: int,
+        **kwargs,
+    ) -> "Broadcast":
+        broadcast = cls(secrets.token_hex(4), **kwargs)
+        await broadcast.redis.hset(broadcast.key, mapping={
+            "from_chat_id": from_chat_id,
+            "message_id": message_id,
+            "event_id": event_id,
+            "last_id": 0,
+            SENT: 0,
+            FAILED: 0,
+            BLOCKED: 0,
+            "elapsed": 0,
+            "finished": 0,
+        })
+        return broadcast
+
+    async def exists(self) -> bool:
+        return bool(await self.redis.exists(self.key))
+
+    async def running(self) -> bool:
+        return bool(await self.redis.exists(self.lock_key))
+
+    async def report(self) -> BroadcastReport:
+        state = await self.redis.hgetall(self.key)
+        return BroadcastReport(
+            broadcast_id=self.broadcast_id,
+            sent=int(state.get(b"sent", 0)),
+            failed=int(state.get(b"failed", 0)),
+            blocked=int(state.get(b"blocked", 0)),
+            elapsed=float(state.get(b"elapsed", 0)),
+            finished=state.get(b"finished") == b"1",
+        )
+
+    async def _deliver(
+        self,
+        tg_id: int,
+        from_chat_id: int,
+        message_id: int
+    ) -> None:
+        send = partial(
+            self.bot.copy_message, tg_id, from_chat_id, message_id
+        )
+        while True:
+            try:
+                delivery = self.outbound.submit(tg_id, send, Priority.BULK)
+            except QueueFull:
+                await asyncio.sleep(1)
+            else:
+                break
+        try:
+            await delivery
+        except TelegramForbiddenError:
+            status = BLOCKED
+        except Exception:
+            status = FAILED
+        else:
+            status = SENT
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self.recipients_key, str(tg_id), status)
+        pipe.hincrby(self.key, status, 1)
+        await pipe.execute()
+
+    async def _next_batch(
+        self, event_id: int | None, last_id: int
+    ) -> list[tuple[int, int]]:
+        stmt = (
+            select(User.id, User.tg_id)
+            .where(User.id > last_id)
+            .order_by(User.id)
+            .limit(self.batch_size)
+        )
+        if event_id is not None:
+            stmt = stmt.where(User.event_id == event_id)
+        async with self.session_factory() as session:
+            result = await session.execute(stmt)
+            return [tuple(row) for row in result]
+
+    async def _keep_lock(self, lock: Lock) -> None:
+        while True:
+            await asyncio.sleep(LOCK_TIMEOUT / 3)
+            await lock.reacquire()
+
+    async def run(self) -> BroadcastReport:
+        lock = self.redis.lock(self.lock_key, timeout=LOCK_TIMEOUT)
+        if not await lock.acquire(blocking=False):
+            raise BroadcastRunning(self.broadcast_id)
+        keeper = asyncio.create_task(self._keep_lock(lock))
+        try:
+            return await self._run(keeper)
+        finally:
+            keeper.cancel()
+            with contextlib.suppress(LockError):
+                await lock.release()
+
+    async def _run(self, keeper: asyncio.Task) -> BroadcastReport:
+        state = await self.redis.hgetall(self.key)
+        if not state:
+            raise ValueError(f"Unknown broadcast {self.broadcast_id}")
+        from_chat_id = int(state[b"from_chat_id"])
+        message_id = int(state[b"message_id"])
+        # broadcasts started before they were per event went to everyone
+        event_id = int(state[b"event_id"]) if b"event_id" in state else None
+        last_id = int(state[b"last_id"])
+        started = time.monotonic()
+        elapsed_before = float(state.get(b"elapsed", 0))
+
+        while batch := await self._next_batch(event_id, last_id):
+            if keeper.done():
+                # the lock was lost, another run may have taken over
+                keeper.result()
+            tg_ids = [tg_id for _, tg_id in batch]
+            # recipients handled before a crash in the middle of this batch
+            done = await self.redis.hmget(
+                self.recipients_key, [str(tg_id) for tg_id in tg_ids]
+            )
+            await asyncio.gather(*(
+                self._deliver(tg_id, from_chat_id, message_id)
+                for tg_id, status in zip(tg_ids, done)
+                if status is None
+            ))
+            last_id = batch[-1][0]
+            await self.redis.hset(self.key, mapping={
+                "last_id": last_id,
+                "elapsed": elapsed_before + time.monotonic() - started,
+            })
+            logger.info(
+                "Broadcast %s reached tg_user.id %d",
+                self.broadcast_id, last_id,
+            )
+
+        await self.redis.hset(self.key, mapping={
+            "finished": 1,
+            "elapsed": elapsed_before + time.monotonic() - started,
+        })
+        return await self.report()
+
+
+async def run_cli(args: argparse.Namespace) -> None:
+    config = load_config()
+    bot = Bot(config.token)
+    redis = create_redis(config)
+    outbound = OutboundScheduler.from_config(config)
+    kwargs = dict(
+        bot=bot,
+        redis=redis,
+        session_factory=async_sessionmaker(bind=create_engine(config)),
+        outbound=outbound,
+        batch_size=args.batch_size,
+    )
+    if args.resume:
+        broadcast = Broadcast(args.resume, **kwargs)
+        if not await broadcast.exists():
+            raise SystemExit(f"Unknown broadcast {args.resume}")
+    else:
+        try:
+            async with kwargs["session_factory"]() as session:
+                event_id = await current_event_id(
+                    session, args.event or config.event_slug
+                )
+        except LookupError as ex:
+            raise SystemExit(str(ex))
+        broadcast = await Broadcast.create(
+            args.from_chat, args.message_id, event_id, **kwargs
+        )
+        print(f"Started broadcast {broadcast.broadcast_id}")
+
+    await outbound.start()
+    try:
+        print(await broadcast.run())
+    except BroadcastRunning:
+        raise SystemExit(f"Broadcast {broadcast.broadcast_id} is running")
+    finally:
+        await outbound.stop()
+        await bot.session.close()
+        await redis.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--from-chat", type=int)
+    parser.add_argument("--message-id", type=int)
+    parser.add_argument(
+        "--event",
+        help="slug of the event, defaults to the one the bot registers for",
+    )
+    parser.add_argument("--resume", help="id of the broadcast to resume")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    missing_message = args.from_chat is None or args.message_id is None
+    if not args.resume and missing_message:
+        parser.error("--from-chat and --message-id are required")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_cli(args))
+
+
+if __name__ == "__main__":
+    main()
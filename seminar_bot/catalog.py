@@ -0,0 +1,265 @@
+"""
+The seminars the bot registers attendees for, with their dates, speakers
+and plan photos, kept in the database and indexed in memory.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Iterable, Mapping
+
+from redis.asyncio import Redis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import selectinload
+
+from seminar_bot.db import Event, EventDate, Speaker
+
+logger = logging.getLogger(__name__)
+
+# bumped on every change to the catalog tables
+VERSION_KEY = "catalog:version"
+# what the date keyboard puts between a date's label and the free seats
+LABEL_SEPARATOR = " · "
+
+
+@dataclass(eq=False)
+class CatalogDate:
+    event_slug: str
+    key: str
+    # locale -> label
+    labels: Mapping[str, str]
+    seats: int | None = None
+    rooms: int | None = None
+
+    @property
+    def ref(self) -> str:
+        """Names the date among all events, e.g. for the seat counters."""
+        return f"{self.event_slug}:{self.key}"
+
+    def label(self, locale: str) -> str:
+        return self.labels.get(locale) or self.key
+
+
+@dataclass(eq=False)
+class CatalogEvent:
+    """
+    One event as loaded from the database. Treated as immutable: a reload
+    builds new objects, so it can key caches by identity.
+    """
+
+    id: int
+    slug: str
+    # locale -> title
+    titles: Mapping[str, str]
+    active: bool
+    dates: tuple[CatalogDate, ...]
+    speakers: tuple[str, ...]
+    # locale -> file_ids
+    plan_file_ids: Mapping[str, tuple[str, ...]]
+    _dates_by_label: dict[str, CatalogDate] = field(init=False, repr=False)
+    _dates_by_ref: dict[str, CatalogDate] = field(init=False, repr=False)
+    _speakers: frozenset[str] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._dates_by_label = {
+            label: date for date in self.dates
+            for label in (date.key, *date.labels.values())
+        }
+        self._dates_by_ref = {date.ref: date for date in self.dates}
+        self._speakers = frozenset(self.speakers)
+
+    @classmethod
+    def from_row(cls, event: Event) -> "CatalogEvent":
+        return cls(
+            id=event.id,
+            slug=event.slug,
+            titles=dict(event.title),
+            active=event.active,
+            dates=tuple(
+                CatalogDate(
+                    event_slug=event.slug,
+                    key=date.key,
+                    labels=dict(date.label),
+                    seats=date.seats,
+                    rooms=date.rooms,
+                )
+                for date in event.dates
+            ),
+            speakers=tuple(speaker.name for speaker in event.speakers),
+            plan_file_ids={
+                locale: tuple(file_ids)
+                for locale, file_ids in (event.plan_file_ids or {}).items()
+            },
+        )
+
+    def title(self, locale: str) -> str:
+        return self.titles.get(locale) or next(
+            iter(self.titles.values()), self.slug
+        )
+
+    def date(self, ref: str) -> CatalogDate | None:
+        return self._dates_by_ref.get(ref)
+
+    def date_by_label(self, text: str | None) -> CatalogDate | None:
+        """
+        The date a date keyboard button or a ``tg_user.date`` value stands
+        for, in any language and with or without the free seats.
+        """
+        if text is None:
+            return None
+        return self._dates_by_label.get(text.partition(LABEL_SEPARATOR)[0])
+
+    def has_speaker(self, name: str | None) -> bool:
+        return name in self._speakers
+
+    @property
+    def capacity(self) -> dict[str, tuple[int, int]]:
+        """Seats and rooms (0 = no limit) of the dates with a seat limit."""
+        return {
+            date.ref: (date.seats, date.rooms or 0)
+            for date in self.dates if date.seats is not None
+        }
+
+
+async def bump_version(redis: Redis) -> int:
+    """Make every process reload the catalog within its check interval."""
+    return await redis.incr(VERSION_KEY)
+
+
+class EventCatalog:
+    """
+    All events, and the one the bot currently registers attendees for:
+    ``slug``, or the most recently created active event without one.
+
+    Handlers read ``event`` and validate input against its lookup tables,
+    the database is only read on ``load``. Changes are announced by
+    bumping ``VERSION_KEY`` in Redis (``invalidate``, the admin panel);
+    every ``check_interval`` seconds each process compares it with the
+    version it loaded and reloads when it moved. ``subscribe`` callbacks
+    run with the current event after every load.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        session_factory: async_sessionmaker[AsyncSession],
+        slug: str | None = None,
+        check_interval: float = 30,
+    ):
+        self.redis = redis
+        self.session_factory = session_factory
+        self.slug = slug
+        self.check_interval = check_interval
+        self.events: dict[str, CatalogEvent] = {}
+        self.event: CatalogEvent | None = None
+        # ref -> date of every event, waitlists can outlive a switch
+        self.dates: dict[str, CatalogDate] = {}
+        self.version: int | None = None
+        self._listeners: list[Callable[[CatalogEvent], Awaitable[Any]]] = []
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def subscribe(
+        self, callback: Callable[[CatalogEvent], Awaitable[Any]]
+    ) -> None:
+        self._listeners.append(callback)
+
+    async def _read(self) -> dict[str, CatalogEvent]:
+        async with self.session_factory() as session:
+            events = await session.scalars(
+                select(Event)
+                .options(selectinload(Event.dates))
+                .options(selectinload(Event.speakers))
+                .order_by(Event.id)
+            )
+            return {
+                event.slug: CatalogEvent.from_row(event) for event in events
+            }
+
+    def _current(self, events: Mapping[str, CatalogEvent]) -> CatalogEvent:
+        if self.slug:
+            if self.slug not in events:
+                raise LookupError(f"No event {self.slug!r} in the catalog")
+            return events[self.slug]
+        active = [event for event in events.values() if event.active]
+        if not active:
+            raise LookupError("No active event in the catalog")
+        return active[-1]
+
+    async def load(self) -> None:
+        async with self._lock:
+            # read the version first, a change made meanwhile reloads again
+            version = int(await self.redis.get(VERSION_KEY) or 0)
+            events = await self._read()
+            event = self._current(events)
+            self.events = events
+            self.dates = {
+                date.ref: date
+                for item in events.values() for date in item.dates
+            }
+            self.event = event
+            self.version = version
+            for listener in self._listeners:
+                await listener(event)
+        logger.info(
+            "Event catalog version %d loaded, registering for %s",
+            version, event.slug,
+        )
+
+    async def refresh(self) -> bool:
+        """Reload if the catalog changed since the last load."""
+        version = int(await self.redis.get(VERSION_KEY) or 0)
+        if version == self.version:
+            return False
+        await self.load()
+        return True
+
+    async def invalidate(self) -> None:
+        await bump_version(self.redis)
+        await self.load()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                # keep serving the catalog loaded last
+                logger.exception("Failed to refresh the event catalog")
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+
+async def add_event(
+    session: AsyncSession,
+    slug: str,
+    title: Mapping[str, str],
+    dates: Iterable[tuple[str, Mapping[str, str]]],
+    speakers: Iterable[str],
+    plan_file_ids: Mapping[str, list[str]] | None = None,
+) -> Event:
+    """
+    Add an event with its ``(key, labels)`` dates and speakers, in order.
+    Bump the version once committed for running bots to pick it up.
+    """
+    event = Event(
+        slug=slug,
+        title=dict(title),
+        plan_file_ids=dict(plan_file_ids or {}),
+        dates=[
+            EventDate(key=key, label=dict(labels), position=position)
+            for position, (key, labels) in enumerate(dates)
+        ],
+        speakers=[
+            Speaker(name=name, position=position)
+            for position, name in enumerate(speakers)
+        ],
+    )
+    session.add(event)
+    await session.flush()
+    return event
@@ -0,0 +1,88 @@
+from typing import Callable, Any, Awaitable
+
+from aiogram import BaseMiddleware, types
+from aiogram.filters import BaseFilter
+from aiogram.types import TelegramObject
+from aiogram.utils.i18n import I18n
+
+# action -> msgid of the reply keyboard button that triggers it
+MENU_COMMANDS = {
+    "plan": "Программа семинара",
+    "register": "Зарегистрироваться",
+    "unregister": "Отменить регистрацию",
+    "ask": "Задать вопрос",
+    "language": "Изменить язык",
+    "cancel": "Отмена",
+}
+
+
+class CommandIndex:
+    """
+    Per-locale ``button text -> action`` lookup table built from the
+    compiled translation catalogs.
+    """
+
+    def __init__(
+        self,
+        i18n: I18n,
+        commands: dict[str, str] = MENU_COMMANDS
+    ):
+        self.i18n = i18n
+        self.commands = commands
+        self._locales = None
+        self._index: dict[str, dict[str, str]] = {}
+
+    def rebuild(self) -> None:
+        self._locales = self.i18n.locales
+        locales = {self.i18n.default_locale, *self.i18n.available_locales}
+        self._index = {
+            locale: {
+                self.i18n.gettext(msgid, locale=locale): action
+                for action, msgid in self.commands.items()
+            }
+            for locale in locales
+        }
+
+    def resolve(self, locale: str, text: str | None) -> str | None:
+        # I18n.reload() swaps the catalogs dict, rebuild when that happens
+        if self._locales is not self.i18n.locales:
+            self.rebuild()
+        if text is None:
+            return None
+        return self._index.get(locale, {}).get(text)
+
+
+class MenuCommandMiddleware(BaseMiddleware):
+    """
+    Resolves the menu action of a message once, before the handlers'
+    filters run. Must be registered after the i18n middleware.
+    """
+
+    def __init__(self, index: CommandIndex):
+        self.index = index
+
+    async def __call__(
+        self,
+        handler: Callable[
+            [TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        data["menu_command"] = self.index.resolve(
+            self.index.i18n.current_locale, getattr(event, "text", None)
+        )
+        return await handler(event, data)
+
+
+class MenuCommand(BaseFilter):
+    def __init__(self, action: str):
+        if action not in MENU_COMMANDS:
+            raise ValueError(f"Unknown menu command {action!r}")
+        self.action = action
+
+    async def __call__(
+        self,
+        message: types.Message,
+        menu_command: str | None = None
+    ) -> bool:
+        return menu_command == self.action
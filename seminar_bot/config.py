@@ -1,9 +1,14 @@
 from configparser import ConfigParser
-from dataclasses import dataclass
-from typing import Callable, Any, Awaitable, Sequence
+from dataclasses import dataclass, field
+from typing import Mapping, Sequence
 
-from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject
+# action: (messages, seconds); handlers choose their action with
+# flags={"throttle": ...}, the rest are limited as "default"
+DEFAULT_THROTTLE_LIMITS = {
+    "default": (20, 10),
+    "registration": (30, 60),
+    "question": (3, 60),
+}
 
 
 @dataclass(frozen=True)
@@ -13,6 +18,73 @@ class Config:
     plan_files_id_ru: Sequence[str]
     plan_files_id_uz: Sequence[str]
     admin_chat_id: int
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_pre_ping: bool = True
+    db_pool_recycle: int = 1800
+    members_cache_ttl: int = 3600
+    members_cache_size: int = 100_000
+    mode: str = "polling"
+    webhook_url: str = ""
+    webhook_host: str = "127.0.0.1"
+    webhook_port: int = 8080
+    webhook_path: str = "/webhook"
+    webhook_secret: str = ""
+    webhook_concurrency: int = 100
+    webhook_max_connections: int = 40
+    write_behind: bool = False
+    write_behind_interval_ms: int = 500
+    write_behind_batch_size: int = 500
+    redis_url: str = "redis://localhost:6379/0"
+    redis_max_connections: int = 50
+    redis_pool_timeout: int = 5
+    redis_prewarm_connections: int = 10
+    fsm_state_ttl: int = 0
+    fsm_data_ttl: int = 0
+    fsm_serializer: str = "json"
+    outbound_global_rate: float = 30
+    outbound_private_rate: float = 1
+    outbound_group_rate_per_minute: float = 20
+    outbound_queue_size: int = 10_000
+    outbound_workers: int = 8
+    outbound_max_retries: int = 5
+    plan_dir: str = "plan"
+    plan_cooldown: float = 10
+    admin_page_size: int = 50
+    admin_page_size_options: Sequence[int] = (50, 100, 200)
+    admin_count_cache_ttl: float = 30
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 0
+    metrics_path: str = "/metrics"
+    worker_partitions: int = 0
+    worker_stream_maxlen: int = 100_000
+    worker_lease_ttl_ms: int = 10_000
+    worker_batch_size: int = 100
+    throttle_limits: Mapping[str, tuple[int, float]] = field(
+        default_factory=lambda: dict(DEFAULT_THROTTLE_LIMITS)
+    )
+    throttle_notice_window: float = 10
+    stats_reconcile_interval: float = 600
+    stats_top_organizations: int = 10
+    seats_cache_ttl: float = 2
+    # the event registrations go to, the latest active one when empty
+    event_slug: str = ""
+    catalog_check_interval: float = 30
+    # 0 forwards questions one by one, see seminar_bot.digest
+    question_digest_window: float = 0
+    question_digest_similarity: float = 0.5
+
+
+def _throttle_limits(parser: ConfigParser) -> dict[str, tuple[int, float]]:
+    limits = dict(DEFAULT_THROTTLE_LIMITS)
+    if not parser.has_section("throttling"):
+        return limits
+    for action, value in parser.items("throttling"):
+        if action == "notice_window":
+            continue
+        messages, seconds = value.split("/")
+        limits[action] = (int(messages), float(seconds))
+    return limits
 
 
 def load_config() -> Config:
@@ -23,23 +95,114 @@ def load_config() -> Config:
     return Config(
         token=parser["bot"].get("token"),
         db_uri=parser["bot"].get("db_uri"),
-        plan_files_id_ru=parser["bot"].get("plan_files_id_ru").split(),
-        plan_files_id_uz=parser["bot"].get("plan_files_id_uz").split(),
-        admin_chat_id=parser["bot"].getint("admin_chat_id")
+        plan_files_id_ru=parser["bot"].get("plan_files_id_ru", "").split(),
+        plan_files_id_uz=parser["bot"].get("plan_files_id_uz", "").split(),
+        admin_chat_id=parser["bot"].getint("admin_chat_id"),
+        db_pool_size=parser.getint("db", "pool_size", fallback=5),
+        db_max_overflow=parser.getint("db", "max_overflow", fallback=10),
+        db_pool_pre_ping=parser.getboolean(
+            "db", "pool_pre_ping", fallback=True
+        ),
+        db_pool_recycle=parser.getint("db", "pool_recycle", fallback=1800),
+        members_cache_ttl=parser.getint(
+            "cache", "members_ttl", fallback=3600
+        ),
+        members_cache_size=parser.getint(
+            "cache", "members_size", fallback=100_000
+        ),
+        mode=parser["bot"].get("mode", "polling"),
+        webhook_url=parser.get("webhook", "url", fallback=""),
+        webhook_host=parser.get("webhook", "host", fallback="127.0.0.1"),
+        webhook_port=parser.getint("webhook", "port", fallback=8080),
+        webhook_path=parser.get("webhook", "path", fallback="/webhook"),
+        webhook_secret=parser.get("webhook", "secret", fallback=""),
+        webhook_concurrency=parser.getint(
+            "webhook", "concurrency", fallback=100
+        ),
+        webhook_max_connections=parser.getint(
+            "webhook", "max_connections", fallback=40
+        ),
+        write_behind=parser.getboolean(
+            "registration", "write_behind", fallback=False
+        ),
+        write_behind_interval_ms=parser.getint(
+            "registration", "flush_interval_ms", fallback=500
+        ),
+        write_behind_batch_size=parser.getint(
+            "registration", "flush_batch_size", fallback=500
+        ),
+        redis_url=parser.get(
+            "redis", "url", fallback="redis://localhost:6379/0"
+        ),
+        redis_max_connections=parser.getint(
+            "redis", "max_connections", fallback=50
+        ),
+        redis_pool_timeout=parser.getint("redis", "pool_timeout", fallback=5),
+        redis_prewarm_connections=parser.getint(
+            "redis", "prewarm_connections", fallback=10
+        ),
+        fsm_state_ttl=parser.getint("redis", "state_ttl", fallback=0),
+        fsm_data_ttl=parser.getint("redis", "data_ttl", fallback=0),
+        fsm_serializer=parser.get("redis", "serializer", fallback="json"),
+        outbound_global_rate=parser.getfloat(
+            "outbound", "global_rate", fallback=30
+        ),
+        outbound_private_rate=parser.getfloat(
+            "outbound", "private_rate", fallback=1
+        ),
+        outbound_group_rate_per_minute=parser.getfloat(
+            "outbound", "group_rate_per_minute", fallback=20
+        ),
+        outbound_queue_size=parser.getint(
+            "outbound", "queue_size", fallback=10_000
+        ),
+        outbound_workers=parser.getint("outbound", "workers", fallback=8),
+        outbound_max_retries=parser.getint(
+            "outbound", "max_retries", fallback=5
+        ),
+        plan_dir=parser.get("plan", "dir", fallback="plan"),
+        plan_cooldown=parser.getfloat("plan", "cooldown", fallback=10),
+        admin_page_size=parser.getint("admin", "page_size", fallback=50),
+        admin_page_size_options=[
+            int(size) for size in parser.get(
+                "admin", "page_size_options", fallback="50 100 200"
+            ).split()
+        ],
+        admin_count_cache_ttl=parser.getfloat(
+            "admin", "count_cache_ttl", fallback=30
+        ),
+        metrics_host=parser.get("metrics", "host", fallback="127.0.0.1"),
+        metrics_port=parser.getint("metrics", "port", fallback=0),
+        metrics_path=parser.get("metrics", "path", fallback="/metrics"),
+        worker_partitions=parser.getint("workers", "partitions", fallback=0),
+        worker_stream_maxlen=parser.getint(
+            "workers", "stream_maxlen", fallback=100_000
+        ),
+        worker_lease_ttl_ms=parser.getint(
+            "workers", "lease_ttl_ms", fallback=10_000
+        ),
+        worker_batch_size=parser.getint(
+            "workers", "batch_size", fallback=100
+        ),
+        throttle_limits=_throttle_limits(parser),
+        throttle_notice_window=parser.getfloat(
+            "throttling", "notice_window", fallback=10
+        ),
+        stats_reconcile_interval=parser.getfloat(
+            "stats", "reconcile_interval", fallback=600
+        ),
+        stats_top_organizations=parser.getint(
+            "stats", "top_organizations", fallback=10
+        ),
+        seats_cache_ttl=parser.getfloat("seats", "cache_ttl", fallback=2),
+        event_slug=parser.get("event", "slug", fallback=""),
+        catalog_check_interval=parser.getfloat(
+            "event", "check_interval", fallback=30
+        ),
+        question_digest_window=parser.getfloat(
+            "questions", "digest_window", fallback=0
+        ),
+        question_digest_similarity=parser.getfloat(
+            "questions", "digest_similarity", fallback=0.5
+        ),
     )
-
-
-class ConfigMiddleware(BaseMiddleware):
-    def __init__(self, config: Config):
-        self.config = config
-
-    async def __call__(
-        self,
-        handler: Callable[
-            [TelegramObject, dict[str, Any]], Awaitable[Any]],
-        event: TelegramObject,
-        data: dict[str, Any],
-    ) -> Any:
-        data["config"] = self.config
-        result = await handler(event, data)
-        return result
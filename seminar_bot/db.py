@@ -1,44 +1,251 @@
-from typing import Callable, Any, Awaitable
+import asyncio
+from datetime import datetime
+from typing import Any
 
-from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import (
+    JSON,
+    BigInteger,
+    DateTime,
+    ForeignKey,
+    Index,
+    UniqueConstraint,
+    func,
+    select,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
 from sqlalchemy.orm import (
     declarative_base,
     Mapped,
     mapped_column,
+    relationship,
 )
 
+from seminar_bot.config import Config
+from seminar_bot.normalize import phone_digits, search_text
+
 Base = declarative_base()
 
 
+def _phone_digits_default(context) -> str:
+    return phone_digits(context.get_current_parameters().get("phone_number"))
+
+
+def _search_text_default(context) -> str:
+    params = context.get_current_parameters()
+    return search_text(params.get("name"), params.get("organization"))
+
+
+class Event(Base):
+    """A seminar of the series the bot registers attendees for."""
+    __tablename__ = "event"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    slug: Mapped[str] = mapped_column(unique=True)
+    # locale -> title, shown after the language is picked
+    title: Mapped[dict[str, str]] = mapped_column(JSON)
+    # locale -> file_ids of the plan photos, when there are no image files
+    plan_file_ids: Mapped[dict[str, list[str]]] = mapped_column(
+        JSON, default=dict
+    )
+    active: Mapped[bool] = mapped_column(default=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+    dates: Mapped[list["EventDate"]] = relationship(
+        back_populates="event",
+        order_by="EventDate.position",
+        cascade="all, delete-orphan",
+    )
+    speakers: Mapped[list["Speaker"]] = relationship(
+        back_populates="event",
+        order_by="Speaker.position",
+        cascade="all, delete-orphan",
+    )
+
+    def __str__(self) -> str:
+        return self.slug
+
+
+class EventDate(Base):
+    __tablename__ = "event_date"
+    __table_args__ = (
+        UniqueConstraint("event_id", "key", name="uq_event_date_key"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    event_id: Mapped[int] = mapped_column(
+        ForeignKey("event.id", ondelete="CASCADE")
+    )
+    # stable name of the date, e.g. for the seat counters in Redis
+    key: Mapped[str] = mapped_column()
+    # locale -> button text, which is also what tg_user.date stores
+    label: Mapped[dict[str, str]] = mapped_column(JSON)
+    position: Mapped[int] = mapped_column(default=0)
+    # no limit when NULL, see seminar_bot.seats
+    seats: Mapped[int | None] = mapped_column()
+    rooms: Mapped[int | None] = mapped_column()
+
+    event: Mapped[Event] = relationship(back_populates="dates")
+
+
+class Speaker(Base):
+    __tablename__ = "speaker"
+    __table_args__ = (
+        UniqueConstraint("event_id", "name", name="uq_speaker_name"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    event_id: Mapped[int] = mapped_column(
+        ForeignKey("event.id", ondelete="CASCADE")
+    )
+    name: Mapped[str] = mapped_column()
+    position: Mapped[int] = mapped_column(default=0)
+
+    event: Mapped[Event] = relationship(back_populates="speakers")
+
+
 class User(Base):
     __tablename__ = "tg_user"
+    __table_args__ = (
+        # one registration per event
+        UniqueConstraint(
+            "event_id", "tg_id", name="uq_tg_user_event_tg_id"
+        ),
+        # prefix searches, LIKE '998901%', in any collation
+        Index(
+            "ix_tg_user_phone_digits", "phone_digits",
+            postgresql_ops={"phone_digits": "text_pattern_ops"},
+        ),
+        # needs the pg_trgm extension, see migration c6e1f0a3b7d2
+        Index(
+            "ix_tg_user_search_text", "search_text",
+            postgresql_using="gin",
+            postgresql_ops={"search_text": "gin_trgm_ops"},
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    tg_id: Mapped[int] = mapped_column()
+    event_id: Mapped[int] = mapped_column(ForeignKey("event.id"), index=True)
+    tg_id: Mapped[int] = mapped_column(index=True)
     username: Mapped[str | None] = mapped_column()
     name: Mapped[str] = mapped_column()
     phone_number: Mapped[str] = mapped_column()
     date: Mapped[str | None] = mapped_column()
     organization: Mapped[str | None] = mapped_column()
     hotel_info: Mapped[bool] = mapped_column(default=False)
+    # filled in from the columns above on INSERT, for seminar_bot.search
+    phone_digits: Mapped[str | None] = mapped_column(
+        default=_phone_digits_default
+    )
+    search_text: Mapped[str | None] = mapped_column(
+        default=_search_text_default
+    )
+
+
+class Question(Base):
+    __tablename__ = "question"
+    __table_args__ = (
+        # not unique, a digest message stands for several questions
+        Index(
+            "ix_question_admin_message",
+            "admin_chat_id", "admin_message_id",
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # supergroup ids don't fit into a 32-bit integer
+    admin_chat_id: Mapped[int] = mapped_column(BigInteger)
+    admin_message_id: Mapped[int] = mapped_column(BigInteger)
+    user_tg_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    speaker: Mapped[str] = mapped_column(index=True)
+    text: Mapped[str] = mapped_column()
+    # number of the question's cluster in a digest message, see
+    # seminar_bot.digest; NULL for a question forwarded on its own
+    cluster: Mapped[int | None] = mapped_column()
+    answered: Mapped[bool] = mapped_column(default=False, index=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    answered_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True)
+    )
+
+
+def with_search_columns(row: dict[str, Any]) -> dict[str, Any]:
+    """
+    A tg_user row with the normalized columns filled in. Multi-row INSERTs
+    need them up front, their column defaults can't see the other values.
+    """
+    return dict(
+        row,
+        phone_digits=phone_digits(row.get("phone_number")),
+        search_text=search_text(row.get("name"), row.get("organization")),
+    )
+
+
+def insert_users(dialect: str):
+    # INSERT into tg_user that silently skips users already registered for
+    # the event
+    insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+    return insert(User).on_conflict_do_nothing(
+        index_elements=[User.event_id, User.tg_id]
+    )
+
+
+async def current_event_id(
+    session: AsyncSession, slug: str | None = None
+) -> int:
+    """
+    The id of the event an ``EventCatalog`` with ``slug`` registers for,
+    for the tools that don't load the catalog and shouldn't import Redis.
+    """
+    if slug:
+        stmt = select(Event.id).where(Event.slug == slug)
+    else:
+        stmt = (
+            select(Event.id)
+            .where(Event.active)
+            .order_by(Event.id.desc())
+            .limit(1)
+        )
+    event_id = await session.scalar(stmt)
+    if event_id is None:
+        raise LookupError(
+            f"No event {slug!r} in the catalog" if slug
+            else "No active event in the catalog"
+        )
+    return event_id
+
+
+def create_engine(config: Config) -> AsyncEngine:
+    return create_async_engine(
+        config.db_uri,
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+        pool_pre_ping=config.db_pool_pre_ping,
+        pool_recycle=config.db_pool_recycle,
+    )
 
 
-class DatabaseMiddleware(BaseMiddleware):
-    def __init__(self, db_uri):
-        engine = create_async_engine(db_uri)
-        self.session_factory = async_sessionmaker(bind=engine)
-
-    async def __call__(
-            self,
-            handler: Callable[
-                [TelegramObject, dict[str, Any]], Awaitable[Any]],
-            event: TelegramObject,
-            data: dict[str, Any],
-    ) -> Any:
-        async with self.session_factory() as session:
-            data["session"] = session
-            result = await handler(event, data)
-            await session.commit()
-        return result
+async def prewarm_engine(engine: AsyncEngine, connections: int) -> None:
+    """
+    Open ``connections`` pooled connections at once and give them back to
+    the pool, so the first requests after a start don't each pay for a
+    new connection.
+    """
+    pending = [engine.connect() for _ in range(connections)]
+    results = await asyncio.gather(
+        *(connection.start() for connection in pending),
+        return_exceptions=True,
+    )
+    for connection in pending:
+        await connection.close()
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
@@ -0,0 +1,470 @@
+"""
+Questions to speakers collected for a while and posted to the admin chat
+as one digest per speaker, with near-duplicates merged.
+"""
+import asyncio
+import html
+import json
+import logging
+import operator
+import random
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Iterable, Sequence
+
+from aiogram import Bot, types
+from redis.asyncio import Redis
+
+from seminar_bot.normalize import normalize_text
+from seminar_bot.outbound import OutboundScheduler, Priority, QueueFull
+from seminar_bot.questions import QuestionLedger
+
+logger = logging.getLogger(__name__)
+
+# list of JSON questions waiting for the next digest
+BUFFER_KEY = "questions:digest"
+# questions taken for a digest that wasn't delivered yet, one list per
+# process, see processing_key
+PROCESSING_KEY = "questions:digest:processing"
+# owner -> time in ms its processing list counts as abandoned from
+OWNERS_KEY = "questions:digest:owners"
+# seconds a process may miss heartbeats before its questions are requeued
+OWNER_TTL = 60
+FLUSH_LOCK_KEY = "questions:digest:flush"
+# Telegram's limit on the text of a message
+MESSAGE_LIMIT = 4096
+# characters of a question quoted in the digest
+EXCERPT_LENGTH = 300
+# questions are compared by their character 4-grams, which survive typos,
+# word order and Cyrillic or Latin spelling
+SHINGLE_SIZE = 4
+# 16 bands of 4 rows: questions at least ~50% alike share a band
+NUM_PERM = 64
+BANDS = 16
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+# Moves a whole list onto another one entry by one, so no entry is ever
+# in neither list.
+#
+# KEYS: source, destination
+# ARGV: end to take from, end to put to, LEFT or RIGHT
+# Returns: the entries moved, in the order they were moved
+MOVE_ALL = """
+local moved = {}
+while true do
+    local entry = redis.call('LMOVE', KEYS[1], KEYS[2], ARGV[1], ARGV[2])
+    if not entry then
+        break
+    end
+    moved[#moved + 1] = entry
+end
+return moved
+"""
+
+# same permutations in every process, signatures are comparable
+_random = random.Random(4099)
+PERMUTATIONS = tuple(
+    (_random.randrange(1, MERSENNE_PRIME), _random.randrange(MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+)
+
+
+def processing_key(owner: str) -> str:
+    return f"{PROCESSING_KEY}:{owner}"
+
+
+def shingles(text: str) -> set[str]:
+    text = normalize_text(text)
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {
+        text[i:i + SHINGLE_SIZE]
+        for i in range(len(text) - SHINGLE_SIZE + 1)
+    }
+
+
+def minhash(text: str) -> tuple[int, ...] | None:
+    """MinHash signature of ``text``, None if it has no words at all."""
+    hashes = [zlib.crc32(shingle.encode()) for shingle in shingles(text)]
+    if not hashes:
+        return None
+    return tuple(
+        min([(a * value + b) % MERSENNE_PRIME for value in hashes])
+        & MAX_HASH
+        for a, b in PERMUTATIONS
+    )
+
+
+def similarity(first: Sequence[int], second: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return sum(map(operator.eq, first, second)) / NUM_PERM
+
+
+class MinHashIndex:
+    """
+    Groups near-duplicate texts. A text joins the cluster whose first text
+    is the most similar to it, if at least ``threshold``, else starts a new
+    one. Only the first texts sharing one of its LSH bands are compared,
+    not every cluster.
+    """
+
+    def __init__(self, threshold: float = 0.5):
+        self.threshold = threshold
+        self.clusters: list[list[int]] = []
+        # signature of the first text of each cluster, None without one
+        self._signatures: list[tuple[int, ...] | None] = []
+        # band -> clusters whose first text has it
+        self._buckets: dict[tuple[int, tuple[int, ...]], list[int]] = {}
+        self._size = 0
+
+    def _bands(self, signature: tuple[int, ...]) -> Iterable[tuple]:
+        rows = NUM_PERM // BANDS
+        for band in range(BANDS):
+            yield band, signature[band * rows:(band + 1) * rows]
+
+    def add(self, text: str) -> int:
+        """Add the next text, returns the number of its cluster."""
+        index = self._size
+        self._size += 1
+        signature = minhash(text)
+        if signature is not None:
+            best, best_similarity = None, self.threshold
+            candidates = {
+                cluster for key in self._bands(signature)
+                for cluster in self._buckets.get(key, ())
+            }
+            for cluster in sorted(candidates):
+                value = similarity(signature, self._signatures[cluster])
+                if value >= best_similarity:
+                    best, best_similarity = cluster, value
+            if best is not None:
+                self.clusters[best].append(index)
+                return best
+
+        # nothing alike, or nothing to compare such as only punctuation
+        cluster = len(self.clusters)
+        self.clusters.append([index])
+        self._signatures.append(signature)
+        if signature is not None:
+            for key in self._bands(signature):
+                self._buckets.setdefault(key, []).append(cluster)
+        return cluster
+
+
+@dataclass
+class BufferedQuestion:
+    speaker: str
+    user_tg_id: int
+    text: str
+
+
+@dataclass
+class Cluster:
+    questions: list[BufferedQuestion] = field(default_factory=list)
+
+    @property
+    def askers(self) -> list[int]:
+        return list(dict.fromkeys(
+            question.user_tg_id for question in self.questions
+        ))
+
+
+def cluster_questions(
+    questions: Sequence[BufferedQuestion], threshold: float
+) -> list[Cluster]:
+    """Near-duplicates together, the most asked first."""
+    index = MinHashIndex(threshold)
+    for question in questions:
+        index.add(question.text)
+    clusters = [
+        Cluster([questions[i] for i in members])
+        for members in index.clusters
+    ]
+    # stable, ties keep the order of the first ask
+    clusters.sort(key=lambda cluster: -len(cluster.askers))
+    return clusters
+
+
+def _excerpt(text: str) -> str:
+    text = " ".join(text.split())
+    if len(text) > EXCERPT_LENGTH:
+        text = text[:EXCERPT_LENGTH] + "…"
+    return html.escape(text)
+
+
+def _render(speaker: str, clusters: Sequence[Cluster]) -> str:
+    asked = sum(len(cluster.questions) for cluster in clusters)
+    lines = [
+        f"Спикер: {html.escape(speaker)}",
+        f"Вопросов: {asked}, разных: {len(clusters)}",
+        "",
+    ]
+    for number, cluster in enumerate(clusters, 1):
+        count = len(cluster.askers)
+        ask_count = f"<b>(×{count})</b> " if count > 1 else ""
+        lines.append(
+            f"{number}. {ask_count}{_excerpt(cluster.questions[0].text)}"
+        )
+    lines.append(
+        "\nЧтобы ответить, процитируйте вопрос или начните ответ с его "
+        "номера"
+    )
+    return "\n".join(lines)
+
+
+def digest_texts(
+    speaker: str, clusters: Sequence[Cluster]
+) -> list[tuple[str, list[Cluster]]]:
+    """
+    The digest messages for ``speaker`` with the clusters each one lists,
+    split where a message would get too long. Every message numbers its
+    clusters from 1.
+    """
+    messages: list[tuple[str, list[Cluster]]] = []
+    listed: list[Cluster] = []
+    for cluster in clusters:
+        if listed and len(
+            _render(speaker, [*listed, cluster])
+        ) > MESSAGE_LIMIT:
+            messages.append((_render(speaker, listed), listed))
+            listed = []
+        listed.append(cluster)
+    if listed:
+        messages.append((_render(speaker, listed), listed))
+    return messages
+
+
+class QuestionDigest:
+    """
+    Collects questions in Redis and every ``window`` seconds posts one
+    digest message per speaker to the admin chat instead of a message per
+    question, so a busy talk doesn't flood the chat or run into the
+    group's send limit.
+
+    Questions at least ``threshold`` alike (see ``MinHashIndex``) are
+    listed once, with the number of users who asked. The questions are
+    recorded in the ``QuestionLedger`` under the digest message and their
+    cluster number, and an admin's reply to a cluster goes to everyone in
+    it. Whichever process takes the lock first posts the digest.
+
+    Questions stay in Redis until their digest is delivered: a flush moves
+    them to a processing list and drops them from it once ``outbound``
+    sent the message, a failed digest goes back to the buffer. Every
+    process has a processing list of its own and heartbeats in Redis. What
+    a process left behind is queued again once it missed its heartbeats for
+    ``OWNER_TTL`` seconds, so a digest may be posted twice but no question
+    is lost.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        bot: Bot,
+        outbound: OutboundScheduler,
+        questions: QuestionLedger,
+        admin_chat_id: int,
+        window: float,
+        threshold: float = 0.5,
+    ):
+        self.redis = redis
+        self.bot = bot
+        self.outbound = outbound
+        self.questions = questions
+        self.admin_chat_id = admin_chat_id
+        self.window = window
+        self.threshold = threshold
+        self.owner = uuid.uuid4().hex
+        self.processing_key = processing_key(self.owner)
+        self._task: asyncio.Task | None = None
+        self._heartbeat_task: asyncio.Task | None = None
+        self._move_all = redis.register_script(MOVE_ALL)
+
+    async def add(self, speaker: str, user_tg_id: int, text: str) -> None:
+        await self.redis.rpush(BUFFER_KEY, json.dumps(dict(
+            speaker=speaker, user_tg_id=user_tg_id, text=text,
+        )))
+
+    async def _take(self) -> list[bytes]:
+        # no processing list without an owner entry to requeue it by
+        await self._heartbeat()
+        return await self._move_all(
+            keys=[BUFFER_KEY, self.processing_key], args=["LEFT", "RIGHT"]
+        )
+
+    async def _settle(self, payloads: list[bytes], delivered: bool) -> None:
+        """
+        Drop taken questions from the processing list, back to the front
+        of the buffer unless they were ``delivered``.
+        """
+        pipe = self.redis.pipeline(transaction=True)
+        if not delivered:
+            pipe.lpush(BUFFER_KEY, *reversed(payloads))
+        for payload in payloads:
+            pipe.lrem(self.processing_key, 1, payload)
+        await pipe.execute()
+
+    async def _send(
+        self, speaker: str, text: str, clusters: list[Cluster]
+    ) -> types.Message:
+        sent = await self.bot.send_message(
+            self.admin_chat_id, text, parse_mode="HTML"
+        )
+        try:
+            await self.questions.record_digest(
+                self.admin_chat_id, sent.message_id, speaker,
+                [
+                    [(question.user_tg_id, question.text)
+                     for question in cluster.questions]
+                    for cluster in clusters
+                ],
+            )
+        except Exception:
+            logger.exception(
+                "Failed to record the questions of digest %s",
+                sent.message_id,
+            )
+        return sent
+
+    def _digests(
+        self, by_speaker: dict[str, list[BufferedQuestion]]
+    ) -> list[tuple[str, str, list[Cluster]]]:
+        return [
+            (speaker, text, listed)
+            for speaker, questions in by_speaker.items()
+            for text, listed in digest_texts(
+                speaker, cluster_questions(questions, self.threshold)
+            )
+        ]
+
+    async def flush(self) -> int:
+        """Post the questions collected so far, returns how many."""
+        by_speaker: dict[str, list[BufferedQuestion]] = {}
+        # id of a question -> its payload, to settle it in the lists
+        payloads: dict[int, bytes] = {}
+        for payload in await self._take():
+            question = BufferedQuestion(**json.loads(payload))
+            payloads[id(question)] = payload
+            by_speaker.setdefault(question.speaker, []).append(question)
+        # a busy window takes a while to cluster, keep serving updates
+        digests = await asyncio.to_thread(self._digests, by_speaker)
+
+        def listed_payloads(clusters: Iterable[Cluster]) -> list[bytes]:
+            return [
+                payloads[id(question)]
+                for cluster in clusters for question in cluster.questions
+            ]
+
+        deliveries = []
+        for i, (speaker, text, listed) in enumerate(digests):
+            try:
+                delivery = self.outbound.submit(
+                    self.admin_chat_id,
+                    partial(self._send, speaker, text, listed),
+                    Priority.ADMIN,
+                )
+            except QueueFull:
+                rest = listed_payloads(
+                    cluster for _, _, clusters in digests[i:]
+                    for cluster in clusters
+                )
+                await self._settle(rest, delivered=False)
+                logger.warning(
+                    "Outbound queue full, %d questions kept for the next "
+                    "digest", len(rest),
+                )
+                break
+            deliveries.append((delivery, listed_payloads(listed)))
+
+        posted, failed = 0, []
+        for delivery, sent in deliveries:
+            try:
+                await delivery
+            except Exception:
+                logger.exception(
+                    "Failed to post a digest, %d questions kept for the "
+                    "next one", len(sent),
+                )
+                failed.extend(sent)
+            else:
+                await self._settle(sent, delivered=True)
+                posted += len(sent)
+        if failed:
+            await self._settle(failed, delivered=False)
+        return posted
+
+    async def _heartbeat(self) -> None:
+        await self.redis.zadd(OWNERS_KEY, {
+            self.owner: int((time.time() + OWNER_TTL) * 1000),
+        })
+
+    async def _keep_alive(self) -> None:
+        while True:
+            await asyncio.sleep(OWNER_TTL / 3)
+            try:
+                await self._heartbeat()
+            except Exception:
+                logger.exception("Failed to renew the digest heartbeat")
+
+    async def _requeue(self, owner: str) -> int:
+        # in their order, to the front of the buffer
+        requeued = await self._move_all(
+            keys=[processing_key(owner), BUFFER_KEY],
+            args=["RIGHT", "LEFT"],
+        )
+        await self.redis.zrem(OWNERS_KEY, owner)
+        return len(requeued)
+
+    async def requeue_abandoned(self) -> int:
+        """
+        Queue the questions of processes that stopped heartbeating again,
+        returns how many.
+        """
+        owners = await self.redis.zrangebyscore(
+            OWNERS_KEY, "-inf", int(time.time() * 1000)
+        )
+        requeued = 0
+        for owner in owners:
+            # another process doing the same finds the list empty
+            requeued += await self._requeue(owner.decode())
+        if requeued:
+            logger.info(
+                "%d questions of an undelivered digest queued again",
+                requeued,
+            )
+        return requeued
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.window)
+            try:
+                # one digest per window however many processes run
+                if not await self.redis.set(
+                    FLUSH_LOCK_KEY, 1,
+                    nx=True, px=int(self.window * 1000),
+                ):
+                    continue
+                await self.requeue_abandoned()
+                posted = await self.flush()
+                if posted:
+                    logger.info("Posted a digest of %d questions", posted)
+            except Exception:
+                logger.exception("Failed to post the question digest")
+
+    async def start(self) -> None:
+        await self._heartbeat()
+        await self.requeue_abandoned()
+        self._heartbeat_task = asyncio.create_task(self._keep_alive())
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._heartbeat_task):
+            if task is not None:
+                task.cancel()
+        # a digest cut short by the shutdown goes to whoever runs next
+        requeued = await self._requeue(self.owner)
+        if requeued:
+            logger.info("%d questions queued again on shutdown", requeued)
@@ -0,0 +1,270 @@
+"""
+Export registrations from tg_user as CSV or XLSX.
+
+    python -m seminar_bot.export --output users.csv
+    python -m seminar_bot.export --output users.xlsx --date "5 марта" \\
+        --hotel yes --columns name,phone_number,organization
+    python -m seminar_bot.export --output users.csv --event <slug>
+
+Only the registrations for one event are exported, by default the one the
+bot registers attendees for.
+
+Rows are fetched with a server-side cursor and written as they arrive, so
+memory use does not grow with the size of the table.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import os
+import tempfile
+from typing import Any, AsyncIterator, Iterable, Sequence
+
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from seminar_bot.config import load_config
+from seminar_bot.db import EventDate, User, create_engine, current_event_id
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+COLUMNS = {
+    "tg_id": User.tg_id,
+    "username": User.username,
+    "name": User.name,
+    "phone_number": User.phone_number,
+    "organization": User.organization,
+    "date": User.date,
+    "hotel_info": User.hotel_info,
+}
+FORMATS = ("csv", "xlsx")
+BATCH_SIZE = 1000
+# typed in by attendees, so a spreadsheet must not take them for formulas
+ESCAPED_COLUMNS = ("name", "organization")
+FORMULA_PREFIXES = ("=", "+", "-", "@")
+
+
+def parse_columns(value: str | None) -> list[str]:
+    if not value:
+        return list(COLUMNS)
+    columns = [column.strip() for column in value.split(",")]
+    unknown = [column for column in columns if column not in COLUMNS]
+    if unknown:
+        raise ValueError(
+            f"Unknown columns {', '.join(unknown)}, "
+            f"expected some of {', '.join(COLUMNS)}"
+        )
+    return columns
+
+
+def export_query(
+    columns: Sequence[str],
+    event_id: int,
+    dates: Sequence[str] = (),
+    hotel_info: bool | None = None,
+) -> Select:
+    stmt = (
+        select(*(COLUMNS[column] for column in columns))
+        .where(User.event_id == event_id)
+        .order_by(User.id)
+    )
+    if dates:
+        stmt = stmt.where(User.date.in_(dates))
+    if hotel_info is not None:
+        stmt = stmt.where(User.hotel_info == hotel_info)
+    return stmt
+
+
+async def date_labels(
+    session: AsyncSession, event_id: int, dates: Iterable[str]
+) -> list[str]:
+    """
+    ``dates`` with every label of the event's dates among them, as users
+    registered in any locale. Dates are given by key or by any label.
+    """
+    dates = list(dates)
+    result = await session.execute(
+        select(EventDate.key, EventDate.label)
+        .where(EventDate.event_id == event_id)
+    )
+    for key, labels in result:
+        if key in dates or any(label in dates for label in labels.values()):
+            dates.extend(
+                label for label in labels.values() if label not in dates
+            )
+    return dates
+
+
+def escape_formula(value: Any) -> Any:
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+async def escape_formulas(
+    batches: AsyncIterator[Sequence[tuple]],
+    columns: Sequence[str],
+) -> AsyncIterator[Sequence[tuple]]:
+    escaped = [column in ESCAPED_COLUMNS for column in columns]
+    async for batch in batches:
+        yield [
+            tuple(
+                escape_formula(value) if escape else value
+                for value, escape in zip(row, escaped)
+            )
+            for row in batch
+        ]
+
+
+async def stream_rows(
+    session_factory: async_sessionmaker[AsyncSession],
+    stmt: Select,
+    batch_size: int = BATCH_SIZE,
+) -> AsyncIterator[Sequence[tuple]]:
+    """Yield the rows of ``stmt`` in batches from a server-side cursor."""
+    async with session_factory() as session:
+        result = await session.stream(
+            stmt.execution_options(yield_per=batch_size)
+        )
+        async for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+
+
+async def iter_csv(
+    batches: AsyncIterator[Sequence[tuple]],
+    columns: Sequence[str],
+) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    # the BOM makes Excel read the Cyrillic names as UTF-8
+    buffer.write("\ufeff")
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def write_xlsx(
+    batches: AsyncIterator[Sequence[tuple]],
+    columns: Sequence[str],
+    path: str,
+) -> None:
+    if Workbook is None:
+        raise RuntimeError("XLSX export requires the openpyxl package")
+    # write-only workbooks spool rows to a temporary file instead of
+    # keeping cell objects around
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("tg_user")
+    sheet.append(list(columns))
+    async for batch in batches:
+        # serializing the cells takes a while, keep the event loop free
+        await asyncio.to_thread(_append_rows, sheet, batch)
+    await asyncio.to_thread(workbook.save, path)
+
+
+def _append_rows(sheet, rows: Sequence[tuple]) -> None:
+    for row in rows:
+        sheet.append(row)
+
+
+async def iter_export(
+    session_factory: async_sessionmaker[AsyncSession],
+    fmt: str,
+    columns: Sequence[str],
+    event_id: int,
+    dates: Iterable[str] = (),
+    hotel_info: bool | None = None,
+) -> AsyncIterator[bytes]:
+    """The export file as a stream of byte chunks."""
+    dates = tuple(dates)
+    if dates:
+        async with session_factory() as session:
+            dates = await date_labels(session, event_id, dates)
+    stmt = export_query(columns, event_id, dates, hotel_info)
+    batches = escape_formulas(stream_rows(session_factory, stmt), columns)
+    if fmt == "csv":
+        async for chunk in iter_csv(batches, columns):
+            yield chunk
+        return
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        await write_xlsx(batches, columns, path)
+        with open(path, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, 64 * 1024):
+                yield chunk
+    finally:
+        os.unlink(path)
+
+
+async def run_cli(args: argparse.Namespace) -> None:
+    config = load_config()
+    engine = create_engine(config)
+    session_factory = async_sessionmaker(bind=engine)
+    try:
+        async with session_factory() as session:
+            event_id = await current_event_id(
+                session, args.event or config.event_slug
+            )
+        chunks = iter_export(
+            session_factory,
+            args.format,
+            parse_columns(args.columns),
+            event_id,
+            args.date,
+            args.hotel,
+        )
+        with open(args.output, "wb") as f:
+            async for chunk in chunks:
+                f.write(chunk)
+    except LookupError as ex:
+        raise SystemExit(str(ex))
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", required=True)
+    parser.add_argument(
+        "--format", choices=FORMATS,
+        help="defaults to the extension of --output",
+    )
+    parser.add_argument(
+        "--columns", help=f"comma-separated, any of {','.join(COLUMNS)}"
+    )
+    parser.add_argument(
+        "--event",
+        help="slug of the event, defaults to the one the bot registers for",
+    )
+    parser.add_argument(
+        "--date", action="append", default=[],
+        help="only this seminar date, by key or label in any locale, "
+        "may be repeated",
+    )
+    parser.add_argument(
+        "--hotel", choices=("yes", "no"),
+        help="only users who do or don't need a hotel room",
+    )
+    args = parser.parse_args()
+    args.format = args.format or os.path.splitext(args.output)[1][1:]
+    if args.format not in FORMATS:
+        parser.error("--format must be csv or xlsx")
+    if args.hotel is not None:
+        args.hotel = args.hotel == "yes"
+    try:
+        parse_columns(args.columns)
+    except ValueError as ex:
+        parser.error(str(ex))
+    asyncio.run(run_cli(args))
+
+
+if __name__ == "__main__":
+    main()
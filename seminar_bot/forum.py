@@ -1,24 +1,44 @@
+import asyncio
+import logging
+import re
+from functools import partial
+from typing import Sequence
+
 from aiogram import Router, F, types, Bot
-from aiogram.exceptions import TelegramAPIError
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.i18n import gettext as _
-from aiogram.utils.i18n import lazy_gettext as __
 
+from seminar_bot.catalog import CatalogEvent, EventCatalog
+from seminar_bot.commands import MenuCommand
 from seminar_bot.config import Config
+from seminar_bot.digest import QuestionDigest
 from seminar_bot.filters import IsAdmin
-from seminar_bot.keyboards import get_meu_kb
-from seminar_bot.state import Menu
+from seminar_bot.keyboards import (
+    cancel_kb,
+    cancel_kb_btn,
+    get_meu_kb,
+    locale_cached,
+)
+from seminar_bot.outbound import OutboundScheduler, Priority, QueueFull
+from seminar_bot.questions import QuestionLedger, QuestionRef
+from seminar_bot.state import Menu, advance
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
-speakers = (
-    "Hosameldin Abdelhafez",
-    "Mohamed Ali",
-    "Gintaras Budginas",
-    "Tigran Aydinyan",
-    "Norbert Mischke",
-    "Slausgalvis Virginijus"
-)
+# "2. ", "#2 " or "2) " at the start of an answer to a digest
+CLUSTER_NUMBER_REGEX = re.compile(r"^\s*#?(\d+)[.):]?(?:\s+|$)")
+# how a digest lists its questions, see seminar_bot.digest
+DIGEST_LINE_REGEX = re.compile(r"^(\d+)\. ")
+
+
+@locale_cached
+def speakers_kb(event: CatalogEvent) -> types.ReplyKeyboardMarkup:
+    return types.ReplyKeyboardMarkup(keyboard=[
+        *[[types.KeyboardButton(text=speaker)] for speaker in event.speakers],
+        [cancel_kb_btn()]
+    ], resize_keyboard=True)
 
 
 def extract_id(message: types.Message) -> int:
@@ -35,18 +55,55 @@ def extract_id(message: types.Message) -> int:
     return int(hashtag[3:])
 
 
-@router.message(Menu.menu, F.text == __("Задать вопрос"))
+def quoted_cluster(message: types.Message) -> int | None:
+    """The number of the digest question the admin quoted, if any."""
+    if message.quote is None:
+        return None
+    # quote positions count UTF-16 code units
+    offset = 0
+    for line in message.reply_to_message.text.split("\n"):
+        end = offset + len(line.encode("utf-16-le")) // 2
+        if offset <= message.quote.position <= end:
+            match = DIGEST_LINE_REGEX.match(line)
+            return int(match[1]) if match else None
+        offset = end + 1
+    return None
+
+
+def select_cluster(
+    message: types.Message, refs: Sequence[QuestionRef]
+) -> tuple[list[QuestionRef], str | None]:
+    """
+    The questions of the digest cluster an admin answers, by quote or by
+    the number the answer starts with, and the answer without the number.
+    """
+    answer = None
+    number = quoted_cluster(message)
+    if number is None:
+        match = CLUSTER_NUMBER_REGEX.match(message.html_text)
+        if match is None:
+            raise ValueError(
+                "Процитируйте вопрос или начните ответ с его номера"
+            )
+        number, answer = int(match[1]), message.html_text[match.end():]
+        if message.text and not answer:
+            raise ValueError("Напишите ответ после номера вопроса")
+    selected = [ref for ref in refs if ref.cluster == number]
+    if not selected:
+        raise ValueError(f"Вопроса {number} в этом сообщении нет")
+    return selected, answer
+
+
+@router.message(Menu.menu, MenuCommand("ask"))
 async def ask_question(
     message: types.Message,
+    catalog: EventCatalog,
     state: FSMContext
 ):
 
     await message.answer(
         _("Выберите спикера, которому вы хотите задать вопрос"),
-        reply_markup=types.ReplyKeyboardMarkup(keyboard=[
-            *[[types.KeyboardButton(text=speaker)] for speaker in speakers],
-            [types.KeyboardButton(text=_("Отмена"))]
-        ], resize_keyboard=True)
+        reply_markup=speakers_kb(catalog.event)
     )
 
     await state.set_state(Menu.choose_speaker)
@@ -55,34 +112,76 @@ async def ask_question(
 @router.message(Menu.choose_speaker)
 async def choose_speaker(
     message: types.Message,
+    catalog: EventCatalog,
     state: FSMContext
 ):
     text = message.text
-    if text not in speakers:
+    if not catalog.event.has_speaker(text):
         await message.answer(_(
             "Некорректный ввод. Выберите спикера из списка ниже"
         ))
         return
-    data = await state.get_data()
-    await state.set_data({
-        **data,
-        "speaker": text
-    })
     await message.answer(
         _("Введите свой вопрос"),
-        reply_markup=types.ReplyKeyboardMarkup(keyboard=[
-            [types.KeyboardButton(text=_("Отмена"))]
-        ], resize_keyboard=True)
+        reply_markup=cancel_kb()
     )
 
-    await state.set_state(Menu.send_question)
+    await advance(state, Menu.send_question, speaker=text)
+
+
+async def forward_question(
+    bot: Bot,
+    questions: QuestionLedger,
+    admin_chat_id: int,
+    user_id: int,
+    speaker: str,
+    question: str,
+    text: str,
+) -> types.Message:
+    sent = await bot.send_message(admin_chat_id, text, parse_mode="HTML")
+    try:
+        await questions.record(
+            admin_chat_id, sent.message_id, user_id, speaker, question
+        )
+    except Exception:
+        # the #id hashtag still lets admins answer, don't resend the question
+        logger.exception("Failed to record question %s", sent.message_id)
+    return sent
+
+
+async def send_answer(
+    message: types.Message,
+    questions: QuestionLedger,
+    user_id: int,
+    question_ids: Sequence[int],
+    answer: str | None = None,
+) -> types.MessageId | types.Message:
+    if answer is None:
+        result = await message.copy_to(user_id)
+    elif message.text:
+        result = await message.bot.send_message(
+            user_id, answer, parse_mode="HTML"
+        )
+    else:
+        result = await message.copy_to(
+            user_id, caption=answer, parse_mode="HTML"
+        )
+    try:
+        await questions.mark_answered(question_ids)
+    except Exception:
+        logger.exception("Failed to mark questions %s answered",
+                         question_ids)
+    return result
 
 
-@router.message(Menu.send_question, F.text)
+@router.message(Menu.send_question, F.text, flags={"throttle": "question"})
 async def text_question(
     message: types.Message,
     config: Config,
     bot: Bot,
+    outbound: OutboundScheduler,
+    questions: QuestionLedger,
+    digest: QuestionDigest | None,
     state: FSMContext
 ):
     if len(message.text) > 4000:
@@ -91,13 +190,38 @@ async def text_question(
         )
 
     speaker = (await state.get_data())["speaker"]
-    await bot.send_message(
-        config.admin_chat_id,
+    if digest is not None:
+        await digest.add(speaker, message.from_user.id, message.text)
+        await message.answer(
+            _("Сообщение отправлено. Скоро мы ответим"),
+            reply_markup=get_meu_kb()
+        )
+        return await state.set_state(Menu.menu)
+
+    text = (
         f"Спикер: {speaker}\n\n"
         + message.html_text
-        + f"\n\n#id{message.from_user.id}",
-        parse_mode="HTML"
+        + f"\n\n#id{message.from_user.id}"
     )
+    try:
+        outbound.submit(
+            config.admin_chat_id,
+            partial(
+                forward_question,
+                bot,
+                questions,
+                config.admin_chat_id,
+                message.from_user.id,
+                speaker,
+                message.text,
+                text,
+            ),
+            Priority.ADMIN,
+        )
+    except QueueFull:
+        return await message.answer(
+            _("Сейчас слишком много вопросов, попробуйте через минуту")
+        )
     await message.answer(
         _("Сообщение отправлено. Скоро мы ответим"),
         reply_markup=get_meu_kb()
@@ -105,25 +229,74 @@ async def text_question(
     await state.set_state(Menu.menu)
 
 
+def report_delivery(
+    outbound: OutboundScheduler,
+    message: types.Message,
+    total: int,
+    deliveries: asyncio.Future
+) -> None:
+    results = [] if deliveries.cancelled() else deliveries.result()
+    delivered = sum(
+        not isinstance(result, BaseException) for result in results
+    )
+    if total > 1:
+        text = f"Ответ доставлен {delivered} из {total} спросивших"
+    elif delivered:
+        text = "Сообщение доставлено"
+    else:
+        text = "Не удалось ответить на сообщение"
+    try:
+        outbound.submit(
+            message.chat.id, partial(message.reply, text), Priority.ADMIN
+        )
+    except QueueFull:
+        logger.warning("Dropped delivery report for message %s", message)
+
+
 @router.message(
     F.reply_to_message,
     IsAdmin()
 )
 async def reply_to_user(
     message: types.Message,
-    config: Config
+    outbound: OutboundScheduler,
+    questions: QuestionLedger,
 ):
-    if message.chat.id != config.admin_chat_id:
-        pass
-
-    try:
-        user_id = extract_id(message.reply_to_message)
-    except ValueError as ex:
-        return await message.reply(str(ex))
+    refs = await questions.resolve(
+        message.chat.id, message.reply_to_message.message_id
+    )
+    answer = None
+    if len({ref.cluster for ref in refs}) > 1:
+        try:
+            refs, answer = select_cluster(message, refs)
+        except ValueError as ex:
+            return await message.reply(str(ex))
+    # user -> their questions, a user who asked twice gets one answer
+    recipients: dict[int, list[int]] = {}
+    for ref in refs:
+        recipients.setdefault(ref.user_tg_id, []).append(ref.id)
+    if not recipients:
+        # forwarded copies and questions asked before the ledger existed
+        try:
+            recipients[extract_id(message.reply_to_message)] = []
+        except ValueError as ex:
+            return await message.reply(str(ex))
 
-    try:
-        await message.copy_to(user_id)
-    except TelegramAPIError as ex:
-        await message.reply("Не удалось ответить на сообщение")
-    else:
-        await message.reply("Сообщение доставлено")
+    deliveries = []
+    for user_id, question_ids in recipients.items():
+        try:
+            deliveries.append(outbound.submit(
+                user_id,
+                partial(
+                    send_answer, message, questions, user_id, question_ids,
+                    answer,
+                ),
+                Priority.USER,
+            ))
+        except QueueFull:
+            break
+    if not deliveries:
+        return await message.reply("Очередь отправки переполнена")
+    asyncio.gather(*deliveries, return_exceptions=True).add_done_callback(
+        partial(report_delivery, outbound, message, len(recipients))
+    )
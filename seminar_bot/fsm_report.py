@@ -0,0 +1,82 @@
+"""
+Report how much Redis memory the FSM keys take.
+
+    python -m seminar_bot.fsm_report [--prefix fsm] [--batch 500]
+
+Run it before and after changing [redis] serializer or the TTLs to see
+the difference. The "as json"/"as msgpack" columns show what the data
+records currently in Redis would take with either serializer.
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+
+from seminar_bot.config import load_config
+from seminar_bot.storage import SERIALIZERS, create_redis, msgpack
+
+
+async def report(prefix: str, batch: int) -> None:
+    redis = create_redis(load_config())
+    keys = defaultdict(int)
+    memory = defaultdict(int)
+    persistent = defaultdict(int)
+    encoded = defaultdict(int)
+    # msgpack's loader also understands records still stored as JSON
+    loads = SERIALIZERS["msgpack" if msgpack else "json"].loads
+
+    async def measure(chunk: list[bytes]) -> None:
+        pipe = redis.pipeline(transaction=False)
+        for key in chunk:
+            pipe.memory_usage(key)
+            pipe.ttl(key)
+            pipe.get(key)
+        results = await pipe.execute()
+        for i, key in enumerate(chunk):
+            usage, ttl, value = results[i * 3:i * 3 + 3]
+            part = key.rsplit(b":", 1)[-1].decode()
+            keys[part] += 1
+            memory[part] += usage or 0
+            persistent[part] += ttl == -1
+            if part != "data" or value is None:
+                continue
+            data = loads(value)
+            for name, serializer in SERIALIZERS.items():
+                if name == "msgpack" and msgpack is None:
+                    continue
+                encoded[name] += len(serializer.dumps(data))
+
+    chunk: list[bytes] = []
+    async for key in redis.scan_iter(match=f"{prefix}:*", count=batch):
+        chunk.append(key)
+        if len(chunk) >= batch:
+            await measure(chunk)
+            chunk = []
+    if chunk:
+        await measure(chunk)
+    await redis.aclose()
+
+    print(f"{'part':<8}{'keys':>10}{'memory':>14}{'avg':>10}{'no ttl':>10}")
+    for part in sorted(keys):
+        print(
+            f"{part:<8}{keys[part]:>10}{memory[part]:>14}"
+            f"{memory[part] / keys[part]:>10.0f}{persistent[part]:>10}"
+        )
+    total = sum(memory.values())
+    print(f"{'total':<8}{sum(keys.values()):>10}{total:>14}")
+    if encoded:
+        print()
+        print(f"data payload as json:    {encoded['json']} bytes")
+        if "msgpack" in encoded:
+            print(f"data payload as msgpack: {encoded['msgpack']} bytes")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--prefix", default="fsm")
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(report(args.prefix, args.batch))
+
+
+if __name__ == "__main__":
+    main()
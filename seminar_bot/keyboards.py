@@ -1,7 +1,52 @@
+from functools import wraps
+from typing import Callable, Hashable, Mapping, TypeVar
+
 from aiogram import types
+from aiogram.utils.i18n import I18n, get_i18n
 from aiogram.utils.i18n import gettext as _
 
+from seminar_bot.catalog import CatalogDate, CatalogEvent
+
+T = TypeVar("T")
+
+# (builder name, locale, *arguments) -> markup. Markups are frozen pydantic
+# models, so one instance can safely be shared by every message in that
+# locale. Catalog events are hashed by identity and every catalog reload
+# clears the cache.
+_markups: dict[tuple, object] = {}
+
+
+def locale_cached(builder: Callable[..., T]) -> Callable[..., T]:
+    key_name = f"{builder.__module__}.{builder.__qualname__}"
+
+    @wraps(builder)
+    def wrapper(*args: Hashable) -> T:
+        key = (key_name, get_i18n().current_locale, *args)
+        markup = _markups.get(key)
+        if markup is None:
+            markup = _markups[key] = builder(*args)
+        return markup
+
+    return wrapper
+
+
+def invalidate_keyboards() -> None:
+    _markups.clear()
+
 
+def reload_translations(i18n: I18n) -> None:
+    """Reread the compiled catalogs, the keyboards built from them too."""
+    i18n.reload()
+    invalidate_keyboards()
+
+
+LANGUAGE_KB = types.ReplyKeyboardMarkup(keyboard=[
+    [types.KeyboardButton(text="🇷🇺Русский")],
+    [types.KeyboardButton(text="🇺🇿O'zbekcha")],
+], resize_keyboard=True)
+
+
+@locale_cached
 def get_meu_kb() -> types.ReplyKeyboardMarkup:
     return types.ReplyKeyboardMarkup(
         keyboard=[
@@ -11,6 +56,9 @@ def get_meu_kb() -> types.ReplyKeyboardMarkup:
             [types.KeyboardButton(
                 text=_("Зарегистрироваться")
             )],
+            [types.KeyboardButton(
+                text=_("Отменить регистрацию")
+            )],
             [types.KeyboardButton(
                 text=_("Задать вопрос")
             )],
@@ -26,7 +74,69 @@ def cancel_kb_btn():
     return types.KeyboardButton(text=_("Отмена"))
 
 
+@locale_cached
 def cancel_kb():
     return types.ReplyKeyboardMarkup(keyboard=[
         [cancel_kb_btn()],
     ], resize_keyboard=True)
+
+
+@locale_cached
+def contact_kb() -> types.ReplyKeyboardMarkup:
+    return types.ReplyKeyboardMarkup(
+        keyboard=[[
+            types.KeyboardButton(
+                text=_("Отправить контакт"), request_contact=True
+            )
+        ], [cancel_kb_btn()]],
+        resize_keyboard=True
+    )
+
+
+def _date_kb(
+    event: CatalogEvent, remaining: Mapping[str, int]
+) -> types.ReplyKeyboardMarkup:
+    return types.ReplyKeyboardMarkup(keyboard=[
+        [
+            types.KeyboardButton(text=date_button_text(date, remaining))
+            for date in event.dates
+        ],
+        [cancel_kb_btn()]
+    ], resize_keyboard=True)
+
+
+@locale_cached
+def date_kb(event: CatalogEvent) -> types.ReplyKeyboardMarkup:
+    return _date_kb(event, {})
+
+
+def seats_date_kb(
+    event: CatalogEvent, remaining: Mapping[str, int]
+) -> types.ReplyKeyboardMarkup:
+    # the counts change all the time, only the plain keyboard is cached
+    return _date_kb(event, remaining) if remaining else date_kb(event)
+
+
+def date_button_text(date: CatalogDate, remaining: Mapping[str, int]) -> str:
+    label = date.label(get_i18n().current_locale)
+    left = remaining.get(date.ref)
+    if left is None:
+        return label
+    # the label goes first and catalog.LABEL_SEPARATOR after it, so
+    # CatalogEvent.date_by_label finds the date of a button with counts
+    if not left:
+        return _("{date} · лист ожидания").format(date=label)
+    return _("{date} · мест: {left}").format(date=label, left=left)
+
+
+@locale_cached
+def hotel_kb() -> types.ReplyKeyboardMarkup:
+    return types.ReplyKeyboardMarkup(keyboard=[
+        [
+            types.KeyboardButton(text=_("Да")),
+            types.KeyboardButton(text=_("Нет")),
+        ],
+        [cancel_kb_btn()]
+    ],
+        resize_keyboard=True
+    )
@@ -2,40 +2,75 @@ import asyncio
 import logging
 import re
 import sys
-
-from seminar_bot.keyboards import get_meu_kb, cancel_kb, cancel_kb_btn
+from functools import partial
+from typing import Any
+
+from seminar_bot.keyboards import (
+    LANGUAGE_KB,
+    cancel_kb,
+    contact_kb,
+    get_meu_kb,
+    hotel_kb,
+    reload_translations,
+    seats_date_kb,
+)
 
 try:
     from asyncio import WindowsSelectorEventLoopPolicy
 except ImportError:
     pass
 
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import Bot, Dispatcher, Router, types, F
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart, or_f
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.redis import RedisStorage
-from aiogram.types import Message, InputMediaPhoto
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.types import Message
 from aiogram.utils.i18n import FSMI18nMiddleware, I18n
 from aiogram.utils.i18n import gettext as _
-from aiogram.utils.i18n import lazy_gettext as __
-from redis.asyncio import Redis
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
-
-from seminar_bot.config import load_config, Config, ConfigMiddleware
-from seminar_bot.db import DatabaseMiddleware, User as DbUser
-from seminar_bot.forum import router as forum_router
-from seminar_bot.state import Menu
+from sqlalchemy import delete, exists, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from seminar_bot.catalog import CatalogEvent, EventCatalog
+from seminar_bot.commands import (
+    CommandIndex,
+    MenuCommand,
+    MenuCommandMiddleware,
+)
+from seminar_bot.config import load_config, Config
+from seminar_bot.db import User as DbUser, create_engine, prewarm_engine
+from seminar_bot.media import PlanMedia
+from seminar_bot.members import MembershipCache, load_members
+from seminar_bot.metrics import (
+    REGISTRY,
+    MetricsMiddleware,
+    run_metrics_server,
+)
+from seminar_bot.middlewares import (
+    ConfigMiddleware,
+    DatabaseMiddleware,
+    LazySession,
+)
+from seminar_bot.outbound import OutboundScheduler
+from seminar_bot.registrations import RegistrationQueue, store_registration
+from seminar_bot.seats import SeatMap
+from seminar_bot.state import Menu, advance
+from seminar_bot.stats import RegistrationStats
+from seminar_bot.storage import (
+    RedisCallsMiddleware,
+    create_storage,
+    prewarm_redis,
+)
+from seminar_bot.waitlist import Waitlist
 
 NAME_MAX_LENGTH = 512
 
 PHONE_NUMBER_REGEX = re.compile("^([+]998)([0-9]{9})$")
 
-dp = Dispatcher(storage=RedisStorage(redis=Redis()))
+router = Router()
 
 
-@dp.message(or_f(CommandStart(), F.text == __("Изменить язык")))
+@router.message(or_f(CommandStart(), MenuCommand("language")))
 async def start_command(
     message: Message,
     state: FSMContext
@@ -43,23 +78,22 @@ async def start_command(
     await state.set_state(Menu.choose_language)
     await message.answer(
         _("Выберите, пожалуйста, язык"),
-        reply_markup=types.ReplyKeyboardMarkup(keyboard=[
-            [types.KeyboardButton(text="🇷🇺Русский")],
-            [types.KeyboardButton(text="🇺🇿O'zbekcha")],
-        ], resize_keyboard=True)
+        reply_markup=LANGUAGE_KB
     )
 
 
-@dp.message(F.text == __("Отмена"))
+@router.message(MenuCommand("cancel"))
 async def cancel(message: types.Message, state: FSMContext):
     await message.answer(_("Отмена"), reply_markup=get_meu_kb())
     await state.set_state(Menu.menu)
 
 
-@dp.message(Menu.choose_language)
+@router.message(Menu.choose_language)
 async def choose_language(
     message: types.Message,
     i18n_middleware: FSMI18nMiddleware,
+    i18n: I18n,
+    catalog: EventCatalog,
     state: FSMContext
 ) -> None:
     languages = {
@@ -72,20 +106,24 @@ async def choose_language(
     await i18n_middleware.set_locale(state=state, locale=chosen_language)
     await state.set_state(Menu.menu)
     await message.answer(
-        _('Семинар «Современные вызовы в птицеводстве Узбекистана I» '
-          'Ташкент 2024.'
-          ),
+        catalog.event.title(i18n.current_locale),
         reply_markup=get_meu_kb()
     )
 
 
-@dp.message(Menu.menu, F.text == __("Зарегистрироваться"))
+@router.message(
+    Menu.menu, MenuCommand("register"), flags={"throttle": "registration"}
+)
 async def register(
     message: types.Message,
     session: AsyncSession,
+    members: MembershipCache,
+    catalog: EventCatalog,
     state: FSMContext
 ) -> None:
-    if await is_registered(session, message.from_user):
+    if await is_registered(
+        session, members, catalog.event.id, message.from_user
+    ):
         await message.answer(_("Вы уже зарегистрированы"))
         return
     await message.answer(
@@ -95,7 +133,7 @@ async def register(
     await state.set_state(Menu.send_name)
 
 
-@dp.message(Menu.send_name, F.text)
+@router.message(Menu.send_name, F.text, flags={"throttle": "registration"})
 async def send_name(
     message: types.Message,
     state: FSMContext
@@ -105,50 +143,33 @@ async def send_name(
         await message.answer(_("Имя слишком длинное"))
         return
 
-    data = await state.get_data()
-    await state.set_data({
-        **data,
-        "name": text
-    })
-
     await message.answer(
         _("Введите название организации"),
         reply_markup=cancel_kb()
     )
-    await state.set_state(Menu.send_organization)
+    await advance(state, Menu.send_organization, name=text)
 
 
-@dp.message(Menu.send_organization)
+@router.message(Menu.send_organization, flags={"throttle": "registration"})
 async def send_organization(message: Message, state: FSMContext):
     text = message.text
     if len(text) > NAME_MAX_LENGTH:
         await message.answer(_("Название слишком длинное"))
         return
 
-    data = await state.get_data()
-    await state.set_data({
-        **data,
-        "organization": text
-    })
-
     await message.answer(
         _("Пожалуйста, отправьте контакт нажав на кнопку ниже или "
           "номер телефона в формате +998XXXXXXXXX"),
-        reply_markup=types.ReplyKeyboardMarkup(
-            keyboard=[[
-                types.KeyboardButton(
-                    text=_("Отправить контакт"), request_contact=True
-                )
-            ], [cancel_kb_btn()]],
-            resize_keyboard=True
-        ),
+        reply_markup=contact_kb(),
     )
-    await state.set_state(Menu.send_phone_number)
+    await advance(state, Menu.send_phone_number, organization=text)
 
 
-@dp.message(Menu.send_phone_number)
+@router.message(Menu.send_phone_number, flags={"throttle": "registration"})
 async def send_phone_number(
     message: types.Message,
+    catalog: EventCatalog,
+    seat_map: SeatMap,
     state: FSMContext
 ) -> None:
     phone_number = None
@@ -165,57 +186,47 @@ async def send_phone_number(
               "отправьте контакт.")
         )
         return
-    data = await state.get_data()
-    await state.set_data({
-        **data,
-        "phone_number": phone_number
-    })
     await message.answer(
         _("Пожалуйста, выберите дату семинара"),
-        reply_markup=types.ReplyKeyboardMarkup(keyboard=[
-            [
-                types.KeyboardButton(text=_("5 марта")),
-                types.KeyboardButton(text=_("6 марта"))
-            ],
-            [cancel_kb_btn()]
-        ], resize_keyboard=True)
+        reply_markup=seats_date_kb(
+            catalog.event, await seat_map.remaining()
+        )
     )
-    await state.set_state(Menu.send_date)
+    await advance(state, Menu.send_date, phone_number=phone_number)
 
 
-@dp.message(Menu.send_date)
+@router.message(Menu.send_date, flags={"throttle": "registration"})
 async def send_date(
     message: Message,
+    i18n: I18n,
+    catalog: EventCatalog,
     state: FSMContext
 ):
-    text = message.text
-    if text not in (_("5 марта"), _("6 марта")):
+    date = catalog.event.date_by_label(message.text)
+    if date is None:
         await message.answer(_("Пожалуйста, выберите корректный вариант"))
         return
-    data = await state.get_data()
-    await state.set_data({
-        **data,
-        "date": text
-    })
     await message.answer(
         _("Нужен ли Вам номер в гостинице?"),
-        reply_markup=types.ReplyKeyboardMarkup(keyboard=[
-            [
-                types.KeyboardButton(text=_("Да")),
-                types.KeyboardButton(text=_("Нет")),
-            ],
-            [cancel_kb_btn()]
-        ],
-            resize_keyboard=True
-        )
+        reply_markup=hotel_kb()
+    )
+    await advance(
+        state, Menu.send_hotel_info,
+        date=date.label(i18n.current_locale), date_key=date.ref,
     )
-    await state.set_state(Menu.send_hotel_info)
 
 
-@dp.message(Menu.send_hotel_info)
+@router.message(Menu.send_hotel_info, flags={"throttle": "registration"})
 async def send_hotel_info(
     message: Message,
-    session: AsyncSession,
+    session: LazySession,
+    members: MembershipCache,
+    registrations: RegistrationQueue | None,
+    registration_stats: RegistrationStats,
+    catalog: EventCatalog,
+    seat_map: SeatMap,
+    waitlist: Waitlist,
+    i18n: I18n,
     state: FSMContext
 ):
     text = message.text
@@ -228,81 +239,403 @@ async def send_hotel_info(
         hotel_info = True
 
     data = await state.get_data()
-    await process_registered(
-        session=session,
-        user=message.from_user,
-        name=data["name"],
-        phone_number=data["phone_number"],
-        organization=data["organization"],
-        date=data["date"],
-        hotel_info=hotel_info
+    row = registration_row(
+        message.from_user, catalog.event, data, hotel_info
     )
+    date = data.get("date_key")
+    limited = seat_map.limited(date)
+    if limited:
+        reservation = await seat_map.reserve(
+            date, message.from_user.id,
+            dict(row, date_key=date, locale=i18n.current_locale),
+        )
+        if not reservation.seated:
+            await message.answer(
+                _("Мест на {date} больше нет. Вы в листе ожидания под "
+                  "номером {position}, мы напишем, как только место "
+                  "освободится.").format(
+                    date=row["date"], position=reservation.position
+                ),
+                reply_markup=get_meu_kb()
+            )
+            await state.set_state(Menu.menu)
+            return
+
+    try:
+        created = await store_registration(
+            session, members, registrations, registration_stats, row
+        )
+    except Exception:
+        if limited:
+            await seat_map.release(date, hotel_info, promote=False)
+        raise
+    if limited and not created:
+        # the seat was reserved twice for a double submit
+        await waitlist.release(date, hotel_info)
+    elif limited and registrations is None:
+        # the row only exists once the middleware commits it
+        session.after_rollback(
+            partial(seat_map.release, date, hotel_info, promote=False)
+        )
+    if created:
+        await message.answer(
+            _("Ваша заявка принята. Спасибо за регистрацию!"),
+            reply_markup=get_meu_kb()
+        )
+    else:
+        await message.answer(
+            _("Вы уже зарегистрированы"),
+            reply_markup=get_meu_kb()
+        )
+    await state.set_state(Menu.menu)
+
+
+@router.message(
+    Menu.menu, MenuCommand("unregister"), flags={"throttle": "registration"}
+)
+async def unregister(
+    message: Message,
+    session: LazySession,
+    members: MembershipCache,
+    registrations: RegistrationQueue | None,
+    registration_stats: RegistrationStats,
+    catalog: EventCatalog,
+    seat_map: SeatMap,
+    waitlist: Waitlist,
+) -> None:
+    user_id = message.from_user.id
+    event = catalog.event
+    stmt = delete(DbUser).where(
+        DbUser.event_id == event.id, DbUser.tg_id == user_id
+    ).returning(DbUser.date, DbUser.hotel_info, DbUser.organization)
+    registration = (await session.execute(stmt)).first()
+    if registration is None:
+        if await seat_map.leave_waitlist(user_id):
+            await message.answer(_("Вы удалены из листа ожидания"))
+        else:
+            await message.answer(_("Вы не зарегистрированы"))
+        return
+
+    label, hotel_info, organization = registration
+
+    async def forget_member() -> None:
+        members.discard(user_id)
+
+    session.after_commit(forget_member)
+    session.after_commit(partial(
+        registration_stats.record, label, hotel_info, organization, -1
+    ))
+    if registrations is not None:
+        session.after_commit(
+            partial(registrations.forget, event.id, user_id)
+        )
+    date = event.date_by_label(label)
+    if date is not None and seat_map.limited(date.ref):
+        # the seat is only free once the row is gone
+        session.after_commit(
+            partial(waitlist.release, date.ref, hotel_info)
+        )
     await message.answer(
-        _("Ваша заявка принята. Спасибо за регистрацию!"),
-        reply_markup=get_meu_kb()
+        _("Регистрация отменена"), reply_markup=get_meu_kb()
     )
-    await state.set_state(Menu.menu)
 
 
-@dp.message(Menu.menu, F.text == __("Программа семинара"))
+@router.message(Menu.menu, MenuCommand("plan"))
 async def plan(
     message: Message,
     i18n: I18n,
+    plan_media: PlanMedia,
+) -> None:
+    await plan_media.send(message, i18n.current_locale)
+
+
+def create_dispatcher(
+    config: Config,
+    storage: BaseStorage | None = None
+) -> Dispatcher:
+    # imported here, not at the top: they pull in broadcasts, search and
+    # the question digest, which importing this module doesn't need
+    from seminar_bot.admin import router as admin_router
+    from seminar_bot.forum import router as forum_router
+
+    dp = Dispatcher(storage=storage or create_storage(config))
+    dp.include_router(router)
+    dp.include_router(admin_router)
+    dp.include_router(forum_router)
+    return dp
+
+
+async def setup_dispatcher(
+    dp: Dispatcher,
+    bot: Bot,
     config: Config,
+    session_factory: async_sessionmaker[AsyncSession],
 ) -> None:
-    lang = i18n.current_locale
+    """Put the services handlers depend on and the middlewares into dp."""
+    from seminar_bot.digest import QuestionDigest
+    from seminar_bot.questions import QuestionLedger
+    from seminar_bot.throttling import Throttle, ThrottlingMiddleware
 
-    media_list = config.plan_files_id_uz
-    if lang == 'ru':
-        media_list = config.plan_files_id_ru
+    i18n = I18n(path="locales", default_locale="ru", domain="messages")
+    dp["session_factory"] = session_factory
+    dp["redis"] = dp.storage.redis
+    catalog = EventCatalog(
+        redis=dp.storage.redis,
+        session_factory=session_factory,
+        slug=config.event_slug or None,
+        check_interval=config.catalog_check_interval,
+    )
+    dp.startup.register(catalog.start)
+    dp.shutdown.register(catalog.stop)
+    dp["catalog"] = catalog
+    members = MembershipCache(
+        ttl=config.members_cache_ttl,
+        max_size=config.members_cache_size,
+    )
+    dp["members"] = members
 
-    await message.answer_media_group(
-        media=[InputMediaPhoto(media=media) for media in media_list]
+    registration_stats = RegistrationStats(
+        redis=dp.storage.redis,
+        session_factory=session_factory,
+        reconcile_interval=config.stats_reconcile_interval,
+        top_organizations=config.stats_top_organizations,
+    )
+    dp.startup.register(registration_stats.start)
+    dp.shutdown.register(registration_stats.stop)
+    dp["registration_stats"] = registration_stats
+
+    seat_map = SeatMap(
+        redis=dp.storage.redis,
+        capacity={},
+        cache_ttl=config.seats_cache_ttl,
     )
 
+    registrations = None
+    if config.write_behind:
+        registrations = RegistrationQueue(
+            redis=dp.storage.redis,
+            session_factory=session_factory,
+            catalog=catalog,
+            registration_stats=registration_stats,
+            seat_map=seat_map,
+            batch_size=config.write_behind_batch_size,
+            interval_ms=config.write_behind_interval_ms,
+        )
+        dp.startup.register(registrations.start)
+        dp.shutdown.register(registrations.stop)
+    dp["registrations"] = registrations
+
+    outbound = OutboundScheduler.from_config(config)
+    dp.startup.register(outbound.start)
+    dp.shutdown.register(outbound.stop)
+    dp["outbound"] = outbound
+
+    waitlist = Waitlist(
+        seat_map=seat_map,
+        catalog=catalog,
+        session_factory=session_factory,
+        bot=bot,
+        outbound=outbound,
+        i18n=i18n,
+        members=members,
+        registrations=registrations,
+        registration_stats=registration_stats,
+    )
+    dp["seat_map"] = seat_map
+    dp["waitlist"] = waitlist
+    questions = QuestionLedger(session_factory)
+    dp["questions"] = questions
+
+    digest = None
+    if config.question_digest_window:
+        digest = QuestionDigest(
+            redis=dp.storage.redis,
+            bot=bot,
+            outbound=outbound,
+            questions=questions,
+            admin_chat_id=config.admin_chat_id,
+            window=config.question_digest_window,
+            threshold=config.question_digest_similarity,
+        )
+        dp.startup.register(digest.start)
+        dp.shutdown.register(digest.stop)
+    dp["digest"] = digest
+
+    plan_media = PlanMedia(
+        bot=bot,
+        redis=dp.storage.redis,
+        locales=i18n.available_locales,
+        directory=config.plan_dir,
+        upload_chat_id=config.admin_chat_id,
+        fallback={
+            "ru": config.plan_files_id_ru,
+            "uz": config.plan_files_id_uz,
+        },
+        cooldown=config.plan_cooldown,
+    )
+    dp["plan_media"] = plan_media
+
+    async def use_event(event: CatalogEvent) -> None:
+        # after every catalog load: drop what was built from the old one,
+        # and reread the translations so /reload_catalog also deploys new
+        # .mo files to every process
+        reload_translations(i18n)
+        previous = registration_stats.event
+        # the new catalog objects may have other date labels
+        registration_stats.event = event
+        if previous is None or previous.id != event.id:
+            switched = previous is not None
+            await load_members(session_factory, members, event.id)
+            if registrations is not None:
+                # before the waitlist below registers anyone
+                await registrations.load(event.id)
+            if switched:
+                await registration_stats.reconcile(force=True)
+        seat_map.set_capacity(event.capacity)
+        await seat_map.sync(session_factory, event)
+        for ref in event.capacity:
+            # seats added to a full date go to the waitlist
+            await waitlist.release(ref, give_back=False)
+        plan_media.set_event(event.slug, event.plan_file_ids)
+        await plan_media.reload()
+
+    catalog.subscribe(use_event)
+    await catalog.load()
+    throttle = Throttle(
+        redis=dp.storage.redis,
+        limits=config.throttle_limits,
+        notice_window=config.throttle_notice_window,
+    )
+    redis_calls = RedisCallsMiddleware()
+    database = DatabaseMiddleware(session_factory)
+    dp.update.outer_middleware(redis_calls)
+    dp.message.middleware(
+        ThrottlingMiddleware(throttle, config.admin_chat_id)
+    )
+    dp.message.middleware(MetricsMiddleware())
+    dp.message.middleware(database)
+    dp.message.outer_middleware(ConfigMiddleware(config))
+    dp.message.outer_middleware(FSMI18nMiddleware(i18n=i18n))
+    dp.message.outer_middleware(MenuCommandMiddleware(CommandIndex(i18n)))
+
+    REGISTRY.register_stats(
+        "seminar_bot_db", database.stats,
+        counters=("updates", "sessions", "commits"),
+    )
+    REGISTRY.register_stats(
+        "seminar_bot_redis", redis_calls.stats, counters=("updates", "calls")
+    )
+    REGISTRY.register_stats(
+        "seminar_bot_throttle", throttle.stats,
+        counters=("local_allowed", "local_denied", "redis_calls",
+                  "redis_errors"),
+    )
+    if registrations is not None:
+        REGISTRY.register_stats(
+            "seminar_bot_write_behind", registrations.stats,
+            counters=("enqueued", "flushed", "dead_lettered", "flushes"),
+        )
+    REGISTRY.register_collector("seminar_bot", lambda: [
+        "# TYPE seminar_bot_outbound_sent counter",
+        f"seminar_bot_outbound_sent {outbound.sent}",
+        "# TYPE seminar_bot_outbound_failed counter",
+        f"seminar_bot_outbound_failed {outbound.failed}",
+        "# TYPE seminar_bot_outbound_retried counter",
+        f"seminar_bot_outbound_retried {outbound.retried}",
+        "# TYPE seminar_bot_outbound_pending gauge",
+        f"seminar_bot_outbound_pending {outbound.pending}",
+        "# TYPE seminar_bot_members_cache_hits counter",
+        f"seminar_bot_members_cache_hits {members.hits}",
+        "# TYPE seminar_bot_members_cache_misses counter",
+        f"seminar_bot_members_cache_misses {members.misses}",
+    ])
+
+
+async def create_application(config: Config) -> tuple[Dispatcher, Bot]:
+    """
+    The bot ready to take updates: services set up, the DB and Redis pools
+    filled and the catalogs loaded, so the first updates are as fast as
+    the rest.
+    """
+    dp = create_dispatcher(config)
+    bot = Bot(config.token, parse_mode=ParseMode.HTML)
+    engine = create_engine(config)
+    await setup_dispatcher(dp, bot, config, async_sessionmaker(bind=engine))
+    await asyncio.gather(
+        prewarm_engine(engine, config.db_pool_size),
+        prewarm_redis(dp.storage.redis, config.redis_prewarm_connections),
+    )
+    dp.shutdown.register(engine.dispose)
+    return dp, bot
+
 
 async def main() -> None:
+    # only the modules of the chosen mode are imported
     config = load_config()
+    if config.worker_partitions:
+        from seminar_bot.workers import run_receiver
 
-    bot = Bot(config.token, parse_mode=ParseMode.HTML)
-    i18n = I18n(path="locales", default_locale="ru", domain="messages")
-    dp.message.middleware(DatabaseMiddleware(config.db_uri))
-    dp.message.outer_middleware(ConfigMiddleware(config))
-    dp.message.outer_middleware(FSMI18nMiddleware(i18n=i18n))
+        dp = create_dispatcher(config)
+        bot = Bot(config.token, parse_mode=ParseMode.HTML)
+        await run_receiver(dp, bot, config)
+        return
 
-    dp.include_router(forum_router)
-    await dp.start_polling(bot)
+    dp, bot = await create_application(config)
+    if config.mode == "webhook":
+        from seminar_bot.webhook import run_webhook
 
+        await run_webhook(dp, bot, config)
+        return
 
-async def process_registered(
-    session: AsyncSession,
+    metrics_server = None
+    if config.metrics_port:
+        metrics_server = asyncio.create_task(run_metrics_server(
+            config.metrics_host, config.metrics_port, config.metrics_path
+        ))
+    try:
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+    finally:
+        if metrics_server is not None:
+            metrics_server.cancel()
+
+
+def registration_row(
     user: types.User,
-    organization: str,
-    name: str,
-    phone_number: str,
-    date: str,
-    hotel_info: bool
-):
-    db_user = DbUser(
+    event: CatalogEvent,
+    data: dict[str, Any],
+    hotel_info: bool,
+) -> dict[str, Any]:
+    """The tg_user row of a registration from the answers in FSM data."""
+    return dict(
+        event_id=event.id,
         tg_id=user.id,
         username=user.username,
-        organization=organization,
-        name=name,
-        phone_number=phone_number,
-        date=date,
+        organization=data["organization"],
+        name=data["name"],
+        phone_number=data["phone_number"],
+        date=data["date"],
         hotel_info=hotel_info
     )
-    session.add(db_user)
-    await session.flush([db_user])
 
 
 async def is_registered(
     session: AsyncSession,
+    members: MembershipCache,
+    event_id: int,
     user: types.User
 ) -> bool:
-    stmt = select(DbUser).filter(DbUser.tg_id == user.id)
-    result = await session.scalars(stmt)
-    return bool(result.all())
+    registered = members.get(user.id)
+    if registered is None:
+        stmt = select(exists().where(
+            DbUser.event_id == event_id, DbUser.tg_id == user.id
+        ))
+        registered = bool(await session.scalar(stmt))
+        # only registrations are cached: a registration committed by
+        # another process can't clear a cached "no" here
+        if registered:
+            members.add(user.id)
+    return registered
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Mapping, Sequence
+
+from aiogram import Bot, types
+from aiogram.types import FSInputFile, InputMediaPhoto
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Telegram allows at most 10 items in one media group
+MEDIA_GROUP_LIMIT = 10
+
+
+class PlanMedia:
+    """
+    Seminar plan photos, ready to be sent as a media group per locale.
+
+    Images are read from ``<directory>/<locale>/`` and uploaded once to
+    ``upload_chat_id``. The resulting ``file_id``s are kept in Redis, keyed
+    by file name, size and mtime, so restarts and other processes reuse
+    them and a replaced image is uploaded again. Locales without a
+    directory fall back to the ``file_id``s from config.ini.
+
+    ``set_event`` switches to the plan of a catalog event: the images in
+    ``<directory>/<event slug>/<locale>/`` when that directory exists,
+    else the event's ``file_id``s. Events with neither keep the images and
+    ``file_id``s above.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        redis: Redis,
+        locales: Sequence[str],
+        directory: str,
+        upload_chat_id: int,
+        fallback: Mapping[str, Sequence[str]],
+        cooldown: float,
+    ):
+        self.bot = bot
+        self.redis = redis
+        self.locales = tuple(locales)
+        self.directory = directory
+        self.upload_chat_id = upload_chat_id
+        self.fallback = fallback
+        self.cooldown = cooldown
+        self._directory: str | None = directory
+        self._fallback = fallback
+        self._payloads: dict[str, list[InputMediaPhoto]] = {}
+        self._reload_lock = asyncio.Lock()
+        self._in_flight: set[int] = set()
+        self._last_sent: dict[int, float] = {}
+
+    def set_event(
+        self, slug: str, file_ids: Mapping[str, Sequence[str]]
+    ) -> None:
+        """Use the plan of event ``slug`` from the next ``reload`` on."""
+        directory = os.path.join(self.directory, slug)
+        if os.path.isdir(directory):
+            self._directory = directory
+        else:
+            self._directory = None if file_ids else self.directory
+        self._fallback = file_ids or self.fallback
+
+    def _local_files(self, locale: str) -> list[str]:
+        if self._directory is None:
+            return []
+        path = os.path.join(self._directory, locale)
+        if not os.path.isdir(path):
+            return []
+        return sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )[:MEDIA_GROUP_LIMIT]
+
+    @staticmethod
+    def _signature(path: str) -> str:
+        stat = os.stat(path)
+        return f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    async def _upload(self, paths: list[str]) -> list[str]:
+        # one by one: a media group needs at least two items, and often
+        # only one image changed
+        file_ids = []
+        for path in paths:
+            message = await self.bot.send_photo(
+                self.upload_chat_id, FSInputFile(path)
+            )
+            file_ids.append(message.photo[-1].file_id)
+        return file_ids
+
+    async def _resolve(self, locale: str) -> list[str]:
+        paths = self._local_files(locale)
+        if not paths:
+            return list(self._fallback.get(locale, ()))
+
+        key = f"media:plan:{locale}"
+        signatures = [self._signature(path) for path in paths]
+        cached = await self.redis.hmget(key, signatures)
+        missing = [
+            path for path, file_id in zip(paths, cached) if file_id is None
+        ]
+        uploaded = dict(zip(missing, await self._upload(missing))) \
+            if missing else {}
+
+        file_ids = [
+            file_id.decode() if file_id is not None else uploaded[path]
+            for path, file_id in zip(paths, cached)
+        ]
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping=dict(zip(signatures, file_ids)))
+        await pipe.execute()
+        if missing:
+            logger.info("Uploaded %d plan images for %s", len(missing), locale)
+        return file_ids
+
+    async def reload(self) -> None:
+        async with self._reload_lock:
+            payloads = {}
+            for locale in self.locales:
+                payloads[locale] = [
+                    InputMediaPhoto(media=file_id)
+                    for file_id in await self._resolve(locale)
+                ]
+            # swap in one assignment, requests in flight keep the old plan
+            self._payloads = payloads
+
+    def get(self, locale: str) -> list[InputMediaPhoto]:
+        return self._payloads.get(locale, [])
+
+    async def send(self, message: types.Message, locale: str) -> None:
+        chat_id = message.chat.id
+        now = time.monotonic()
+        # users tend to hammer the button while the album is uploading
+        if chat_id in self._in_flight:
+            return
+        if now - self._last_sent.get(chat_id, 0) < self.cooldown:
+            return
+        media = self.get(locale)
+        if not media:
+            return
+
+        self._in_flight.add(chat_id)
+        try:
+            if len(media) == 1:
+                # media groups take 2 to 10 items
+                await message.answer_photo(media[0].media)
+            else:
+                await message.answer_media_group(media=media)
+        finally:
+            self._in_flight.discard(chat_id)
+        self._last_sent[chat_id] = now
+        if len(self._last_sent) > 10_000:
+            self._last_sent = {
+                key: sent for key, sent in self._last_sent.items()
+                if now - sent < self.cooldown
+            }
@@ -0,0 +1,80 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Iterable
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from seminar_bot.db import User
+
+logger = logging.getLogger(__name__)
+
+
+class MembershipCache:
+    """
+    In-process cache of "is this Telegram user registered" answers.
+
+    Entries expire after ``ttl`` seconds and the least recently used ones
+    are evicted once ``max_size`` is reached.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict[int, tuple[bool, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, tg_id: int) -> bool | None:
+        entry = self._entries.get(tg_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        registered, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[tg_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(tg_id)
+        self.hits += 1
+        return registered
+
+    def set(self, tg_id: int, registered: bool) -> None:
+        self._entries[tg_id] = (registered, time.monotonic() + self.ttl)
+        self._entries.move_to_end(tg_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def add(self, tg_id: int) -> None:
+        self.set(tg_id, True)
+
+    def discard(self, tg_id: int) -> None:
+        self._entries.pop(tg_id, None)
+
+    def rebuild(self, tg_ids: Iterable[int]) -> None:
+        self._entries.clear()
+        for tg_id in tg_ids:
+            self.add(tg_id)
+
+
+async def load_members(
+    session_factory: async_sessionmaker[AsyncSession],
+    cache: MembershipCache,
+    event_id: int,
+) -> None:
+    """Fill ``cache`` with the latest registrations for ``event_id``."""
+    async with session_factory() as session:
+        result = await session.stream_scalars(
+            select(User.tg_id)
+            .where(User.event_id == event_id)
+            .order_by(User.id.desc())
+            .limit(cache.max_size)
+            .execution_options(yield_per=1000)
+        )
+        tg_ids = [tg_id async for tg_id in result]
+    cache.rebuild(reversed(tg_ids))
+    logger.info("Membership cache warmed with %d users", len(cache))
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from dataclasses import asdict
+from typing import Any, Awaitable, Callable, Iterable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# seconds; handlers normally answer within tens of milliseconds, the tail
+# buckets catch Telegram and database stalls
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: Any) -> str:
+    return (
+        str(value).replace("\\", r"\\").replace('"', r"\"")
+        .replace("\n", r"\n")
+    )
+
+
+def _labels(names: Iterable[str], values: Iterable[Any]) -> str:
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values: Any, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self._values.items():
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # per label set: observations per bucket (the last one is +Inf), sum
+        self._series: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *label_values: Any) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = ([0] * (len(self.buckets) + 1), [0.0])
+            self._series[label_values] = series
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        names = self.labels + ("le",)
+        for label_values, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _labels(names, label_values + (bound,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {total[0]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """
+    Metrics of this process, rendered in the Prometheus text format.
+
+    Besides counters and histograms it takes collectors: callables that
+    return the current values of gauges and counters kept elsewhere, such
+    as the stats dataclasses of the middlewares and background workers.
+    Collectors are named; registering a name again, e.g. when a dispatcher
+    is set up anew, replaces the old collector instead of adding another.
+    """
+
+    def __init__(self):
+        self._metrics: list[Counter | Histogram] = []
+        self._collectors: dict[str, Callable[[], Iterable[str]]] = {}
+
+    def counter(self, *args: Any, **kwargs: Any) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args: Any, **kwargs: Any) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(
+        self,
+        prefix: str,
+        stats: Any,
+        counters: Iterable[str] = (),
+    ) -> None:
+        """
+        Export every field of a stats dataclass as ``<prefix>_<field>``.
+        Fields named in ``counters`` only ever grow, the rest are gauges.
+        """
+        counters = set(counters)
+
+        def collect() -> Iterable[str]:
+            for field, value in asdict(stats).items():
+                kind = "counter" if field in counters else "gauge"
+                yield f"# TYPE {prefix}_{field} {kind}"
+                yield f"{prefix}_{field} {value}"
+
+        self._collectors[prefix] = collect
+
+    def register_collector(
+        self, name: str, collect: Callable[[], Iterable[str]]
+    ) -> None:
+        self._collectors[name] = collect
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors.values():
+            try:
+                lines.extend(collect())
+            except Exception:
+                logger.exception("Metrics collector %r failed", collect)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "seminar_bot_handler_seconds",
+    "Time spent handling a message, by handler",
+    ("handler",),
+)
+STATE_SECONDS = REGISTRY.histogram(
+    "seminar_bot_state_seconds",
+    "Time spent handling a message, by FSM state the user was in",
+    ("state",),
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "seminar_bot_handler_errors_total",
+    "Exceptions raised by handlers",
+    ("handler", "error"),
+)
+DB_SESSION_SECONDS = REGISTRY.histogram(
+    "seminar_bot_db_session_seconds",
+    "Time from opening a handler's DB session to closing it",
+)
+REDIS_SECONDS = REGISTRY.histogram(
+    "seminar_bot_redis_seconds",
+    "FSM storage round trips, by operation",
+    ("operation",),
+)
+OUTBOUND_SECONDS = REGISTRY.histogram(
+    "seminar_bot_outbound_seconds",
+    "Bot API requests sent by the outbound scheduler, by priority",
+    ("priority",),
+)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Times every handled message by handler and by the FSM state it was
+    handled in, and counts the exceptions handlers raise.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[
+            [TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "-"
+        state = data.get("raw_state") or "-"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as ex:
+            HANDLER_ERRORS.inc(name, type(ex).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_SECONDS.observe(elapsed, name)
+            STATE_SECONDS.observe(elapsed, state)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(
+        body=REGISTRY.render().encode(),
+        headers={"Content-Type": CONTENT_TYPE},
+    )
+
+
+def setup_metrics_route(app: web.Application, path: str) -> None:
+    app.router.add_get(path, metrics_handler)
+
+
+async def run_metrics_server(host: str, port: int, path: str) -> None:
+    app = web.Application()
+    setup_metrics_route(app, path)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info("Serving metrics on %s:%d%s", host, port, path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,161 @@
+"""
+Middlewares of the bot process. They live apart from config and db so
+that the admin panel and the command line tools don't import aiogram.
+"""
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy import event as sa_event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from seminar_bot.config import Config
+from seminar_bot.metrics import DB_SESSION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigMiddleware(BaseMiddleware):
+    def __init__(self, config: Config):
+        self.config = config
+
+    async def __call__(
+        self,
+        handler: Callable[
+            [TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        data["config"] = self.config
+        result = await handler(event, data)
+        return result
+
+
+class LazySession:
+    """
+    Stands in for an ``AsyncSession`` inside a handler. The real session is
+    only created on first attribute access, and tracks whether anything was
+    written so read-only updates can skip the commit round trip.
+    Callbacks passed to ``after_commit`` run once the update's changes are
+    committed and are dropped if they are not. Those passed to
+    ``after_rollback`` run when the changes are thrown away instead: the
+    handler failed or the commit did.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession]):
+        self._session_factory = session_factory
+        self._session: AsyncSession | None = None
+        self.opened = False
+        self.opened_at = 0.0
+        self.written = False
+        self._after_commit: list[Callable[[], Awaitable[Any]]] = []
+        self._after_rollback: list[Callable[[], Awaitable[Any]]] = []
+
+    def _get_session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._session_factory()
+            self.opened = True
+            self.opened_at = time.perf_counter()
+            sync_session = self._session.sync_session
+            sa_event.listen(
+                sync_session, "do_orm_execute", self._on_execute
+            )
+            sa_event.listen(sync_session, "after_flush", self._on_flush)
+        return self._session
+
+    def _on_execute(self, orm_execute_state) -> None:
+        if not orm_execute_state.is_select:
+            self.written = True
+
+    def _on_flush(self, session, flush_context) -> None:
+        self.written = True
+
+    def after_commit(self, callback: Callable[[], Awaitable[Any]]) -> None:
+        self._after_commit.append(callback)
+
+    def after_rollback(
+        self, callback: Callable[[], Awaitable[Any]]
+    ) -> None:
+        self._after_rollback.append(callback)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._get_session(), name)
+
+    @property
+    def has_changes(self) -> bool:
+        session = self._session
+        if session is None:
+            return False
+        return self.written or bool(
+            session.new or session.dirty or session.deleted
+        )
+
+    async def close(self, commit: bool) -> bool:
+        callbacks, self._after_commit = self._after_commit, []
+        rollbacks, self._after_rollback = self._after_rollback, []
+        committed = failed = False
+        try:
+            if self._session is not None and commit and self.has_changes:
+                try:
+                    await self._session.commit()
+                except Exception:
+                    failed = True
+                    raise
+                committed = True
+        finally:
+            if self._session is not None:
+                await self._session.close()
+                self._session = None
+                DB_SESSION_SECONDS.observe(
+                    time.perf_counter() - self.opened_at
+                )
+            for callback in rollbacks if failed or not commit else ():
+                try:
+                    await callback()
+                except Exception:
+                    # don't hide the error that caused the rollback
+                    logger.exception("Rollback callback %s failed", callback)
+        for callback in callbacks if committed else ():
+            await callback()
+        return committed
+
+
+@dataclass
+class DatabaseStats:
+    updates: int = 0
+    sessions: int = 0
+    commits: int = 0
+
+
+class DatabaseMiddleware(BaseMiddleware):
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession]):
+        self.session_factory = session_factory
+        self.stats = DatabaseStats()
+
+    async def __call__(
+            self,
+            handler: Callable[
+                [TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any],
+    ) -> Any:
+        session = LazySession(self.session_factory)
+        data["session"] = session
+        self.stats.updates += 1
+        committed = False
+        try:
+            result = await handler(event, data)
+            committed = await session.close(commit=True)
+        finally:
+            await session.close(commit=False)
+            self.stats.sessions += session.opened
+            self.stats.commits += committed
+
+        logger.debug(
+            "DB usage: %d of %d updates opened a session, %d committed",
+            self.stats.sessions, self.stats.updates, self.stats.commits,
+        )
+        return result
@@ -0,0 +1,43 @@
+"""
+Normalized forms of attendee fields, stored next to the originals so they
+can be indexed for search.
+"""
+import re
+
+# Uzbek Latin spelling of Russian and Uzbek Cyrillic letters, so "Ромашка"
+# and "Romashka" end up as the same words
+CYRILLIC_TO_LATIN = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo",
+    "ж": "j", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "x", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "",
+    "ы": "i", "ь": "", "э": "e", "ю": "yu", "я": "ya", "ў": "o", "қ": "q",
+    "ғ": "g", "ҳ": "h",
+})
+# o‘zbek, o'zbek and ozbek are spelled all three ways
+APOSTROPHES_REGEX = re.compile(r"['‘’ʻʼ`´]")
+NON_WORD_REGEX = re.compile(r"[\W_]+")
+NON_DIGIT_REGEX = re.compile(r"\D")
+# legal forms say nothing about which organization it is
+LEGAL_FORMS = frozenset({
+    "ooo", "oao", "zao", "pao", "ao", "ip", "chp", "mchj", "aj", "xk", "qk",
+    "llc", "ltd", "jsc",
+})
+
+
+def normalize_text(text: str | None) -> str:
+    """Lowercase Latin words without punctuation and legal forms."""
+    text = (text or "").lower().translate(CYRILLIC_TO_LATIN)
+    text = APOSTROPHES_REGEX.sub("", text)
+    return " ".join(
+        word for word in NON_WORD_REGEX.sub(" ", text).split()
+        if word not in LEGAL_FORMS
+    )
+
+
+def phone_digits(phone_number: str | None) -> str:
+    return NON_DIGIT_REGEX.sub("", phone_number or "")
+
+
+def search_text(name: str | None, organization: str | None) -> str:
+    return f"{normalize_text(name)} {normalize_text(organization)}".strip()
@@ -0,0 +1,264 @@
+import asyncio
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable
+
+from aiogram.exceptions import (
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from seminar_bot.config import Config
+from seminar_bot.metrics import OUTBOUND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    USER = 0
+    ADMIN = 1
+    BULK = 2
+
+
+class QueueFull(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is right now."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(
+            self.blocked_until, time.monotonic() + seconds
+        )
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    chat_id: int = field(compare=False)
+    call: Callable[[], Awaitable[Any]] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    # failures are logged by the scheduler, don't warn about fire-and-forget
+    # jobs whose result nobody awaited
+    if not future.cancelled():
+        future.exception()
+
+
+class OutboundScheduler:
+    """
+    Sends Bot API requests in the background, within Telegram's flood
+    limits.
+
+    Jobs are picked by priority, so replies to users go before admin-chat
+    forwards and broadcasts. Each job waits for a token from the global
+    bucket and from its chat's bucket. ``TelegramRetryAfter`` pauses the
+    chat for the requested time and puts the job back, and network or
+    server errors are retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        private_rate: float = 1,
+        private_burst: int = 3,
+        group_rate: float = 20 / 60,
+        group_burst: int = 5,
+        max_queue: int = 10_000,
+        workers: int = 8,
+        max_retries: int = 5,
+    ):
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_queue = max_queue
+        self.workers = workers
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._queue: asyncio.PriorityQueue[_Job] = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._pending = 0
+        self._tasks: list[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    @classmethod
+    def from_config(cls, config: Config) -> "OutboundScheduler":
+        return cls(
+            global_rate=config.outbound_global_rate,
+            private_rate=config.outbound_private_rate,
+            group_rate=config.outbound_group_rate_per_minute / 60,
+            max_queue=config.outbound_queue_size,
+            workers=config.outbound_workers,
+            max_retries=config.outbound_max_retries,
+        )
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(
+        self,
+        chat_id: int,
+        call: Callable[[], Awaitable[Any]],
+        priority: Priority = Priority.USER,
+    ) -> asyncio.Future:
+        if self._pending >= self.max_queue:
+            raise QueueFull(f"{self._pending} outbound requests queued")
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        self._pending += 1
+        self._queue.put_nowait(
+            _Job(priority, next(self._seq), chat_id, call, future)
+        )
+        return future
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10_000:
+                now = time.monotonic()
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items()
+                    if not value.is_idle(now)
+                }
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _requeue(self, job: _Job, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+        loop.call_later(delay, self._queue.put_nowait, job)
+
+    async def _run_job(self, job: _Job) -> None:
+        chat_bucket = self._chat_bucket(job.chat_id)
+        delay = chat_bucket.wait_time(time.monotonic())
+        if delay:
+            # don't hold a worker for a busy chat, other chats may be ready
+            self._requeue(job, delay)
+            return
+        while delay := self.global_bucket.wait_time(time.monotonic()):
+            await asyncio.sleep(delay)
+        self.global_bucket.take()
+        chat_bucket.take()
+
+        started = time.perf_counter()
+        try:
+            try:
+                result = await job.call()
+            finally:
+                OUTBOUND_SECONDS.observe(
+                    time.perf_counter() - started, Priority(job.priority).name
+                )
+        except TelegramRetryAfter as ex:
+            self.retried += 1
+            chat_bucket.block(ex.retry_after)
+            self._requeue(job, ex.retry_after)
+            return
+        except (TelegramNetworkError, TelegramServerError) as ex:
+            job.attempts += 1
+            if job.attempts <= self.max_retries:
+                self.retried += 1
+                self._requeue(job, min(2 ** job.attempts, 60))
+                return
+            self._finish(job, exception=ex)
+        except Exception as ex:
+            self._finish(job, exception=ex)
+        else:
+            self.sent += 1
+            self._finish(job, result=result)
+
+    def _finish(
+        self,
+        job: _Job,
+        result: Any = None,
+        exception: BaseException | None = None
+    ) -> None:
+        self._pending -= 1
+        if job.future.done():
+            return
+        if exception is not None:
+            self.failed += 1
+            # users blocking the bot are routine during broadcasts
+            level = logging.WARNING
+            if isinstance(exception, TelegramForbiddenError):
+                level = logging.INFO
+            logger.log(
+                level,
+                "Outbound request to chat %s failed: %r",
+                job.chat_id, exception,
+            )
+            job.future.set_exception(exception)
+        else:
+            job.future.set_result(result)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run_job(job)
+            except Exception:
+                logger.exception("Outbound worker failed")
+            finally:
+                self._queue.task_done()
+
+    async def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    async def stop(self, timeout: float = 10) -> None:
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._pending:
+            logger.warning(
+                "Dropping %d outbound requests on shutdown", self._pending
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
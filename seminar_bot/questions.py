@@ -0,0 +1,165 @@
+import logging
+from collections import OrderedDict
+from typing import Iterable, NamedTuple, Sequence
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from seminar_bot.db import Question
+
+logger = logging.getLogger(__name__)
+
+
+class QuestionRef(NamedTuple):
+    id: int
+    user_tg_id: int
+    cluster: int | None = None
+
+
+class QuestionLedger:
+    """
+    Questions forwarded to the admin chat, looked up by the admin-chat
+    message an admin replies to. That is one question, or all questions of
+    a digest numbered by cluster.
+
+    Recently forwarded messages are kept in a bounded in-process cache
+    with all their questions, older ones are looked up through the
+    (chat, message) index, which lists every question of a digest.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        cache_size: int = 10_000,
+    ):
+        self.session_factory = session_factory
+        self.cache_size = cache_size
+        self._cache: OrderedDict[
+            tuple[int, int], tuple[QuestionRef, ...]
+        ] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(
+        self, key: tuple[int, int], refs: tuple[QuestionRef, ...]
+    ) -> None:
+        self._cache[key] = refs
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def record(
+        self,
+        admin_chat_id: int,
+        admin_message_id: int,
+        user_tg_id: int,
+        speaker: str,
+        text: str,
+    ) -> QuestionRef:
+        question = Question(
+            admin_chat_id=admin_chat_id,
+            admin_message_id=admin_message_id,
+            user_tg_id=user_tg_id,
+            speaker=speaker,
+            text=text,
+        )
+        async with self.session_factory() as session:
+            session.add(question)
+            await session.flush()
+            ref = QuestionRef(question.id, user_tg_id)
+            await session.commit()
+        self._remember((admin_chat_id, admin_message_id), (ref,))
+        return ref
+
+    async def record_digest(
+        self,
+        admin_chat_id: int,
+        admin_message_id: int,
+        speaker: str,
+        clusters: Sequence[Sequence[tuple[int, str]]],
+    ) -> tuple[QuestionRef, ...]:
+        """
+        Record the ``(user_tg_id, text)`` questions of a digest message,
+        numbering the clusters from 1 in the order they are listed.
+        """
+        questions = [
+            Question(
+                admin_chat_id=admin_chat_id,
+                admin_message_id=admin_message_id,
+                user_tg_id=user_tg_id,
+                speaker=speaker,
+                text=text,
+                cluster=number,
+            )
+            for number, cluster in enumerate(clusters, 1)
+            for user_tg_id, text in cluster
+        ]
+        async with self.session_factory() as session:
+            session.add_all(questions)
+            await session.flush()
+            refs = tuple(
+                QuestionRef(question.id, question.user_tg_id, question.cluster)
+                for question in questions
+            )
+            await session.commit()
+        self._remember((admin_chat_id, admin_message_id), refs)
+        return refs
+
+    async def resolve(
+        self,
+        admin_chat_id: int,
+        admin_message_id: int
+    ) -> tuple[QuestionRef, ...]:
+        """The questions an admin-chat message stands for, if any."""
+        key = (admin_chat_id, admin_message_id)
+        refs = self._cache.get(key)
+        if refs is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return refs
+        self.misses += 1
+        async with self.session_factory() as session:
+            rows = (await session.execute(
+                select(Question.id, Question.user_tg_id, Question.cluster)
+                .where(
+                    Question.admin_chat_id == admin_chat_id,
+                    Question.admin_message_id == admin_message_id,
+                )
+                .order_by(Question.id)
+            )).all()
+        if not rows:
+            return ()
+        refs = tuple(QuestionRef(*row) for row in rows)
+        self._remember(key, refs)
+        return refs
+
+    async def mark_answered(self, question_ids: Iterable[int]) -> None:
+        question_ids = list(question_ids)
+        if not question_ids:
+            return
+        async with self.session_factory() as session:
+            await session.execute(
+                update(Question)
+                .where(Question.id.in_(question_ids), ~Question.answered)
+                .values(answered=True, answered_at=func.now())
+            )
+            await session.commit()
+
+    async def unanswered(
+        self,
+        speaker: str | None = None,
+        limit: int = 20,
+    ) -> tuple[int, list[Question]]:
+        """Total number of unanswered questions and the oldest ``limit``."""
+        condition = ~Question.answered
+        if speaker:
+            condition &= Question.speaker == speaker
+        async with self.session_factory() as session:
+            total = await session.scalar(
+                select(func.count()).select_from(Question).where(condition)
+            )
+            questions = (await session.scalars(
+                select(Question).where(condition)
+                .order_by(Question.id).limit(limit)
+            )).all()
+        return total, list(questions)
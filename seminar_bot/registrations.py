@@ -0,0 +1,303 @@
+import asyncio
+import contextlib
+import json
+import logging
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import Any
+
+from redis.asyncio import Redis
+from redis.exceptions import LockError
+from sqlalchemy import select
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from seminar_bot.catalog import EventCatalog
+from seminar_bot.db import User, insert_users, with_search_columns
+from seminar_bot.members import MembershipCache
+from seminar_bot.middlewares import LazySession
+from seminar_bot.seats import SeatMap
+from seminar_bot.stats import RegistrationStats
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = "registrations:queue"
+# rows the database refused, kept for a look by hand
+DEAD_LETTER_KEY = "registrations:dead"
+LOCK_KEY = "registrations:lock"
+
+# Queues a registration unless the user is already registered for the
+# event, so double submits are told apart before the flush.
+#
+# KEYS: set of tg_ids registered for the event, the queue
+# ARGV: tg_id, row
+# Returns: 1 if queued, 0 if the user was registered already
+ENQUEUE = """
+if redis.call('SADD', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[2])
+return 1
+"""
+
+
+def registered_key(event_id: int) -> str:
+    return f"registrations:{event_id}:users"
+
+
+@dataclass
+class WriteBehindStats:
+    enqueued: int = 0
+    flushed: int = 0
+    dead_lettered: int = 0
+    flushes: int = 0
+    queue_depth: int = 0
+    last_flush_ms: float = 0
+    max_flush_ms: float = 0
+
+
+class RegistrationQueue:
+    """
+    Write-behind pipeline for ``tg_user`` rows.
+
+    Registrations are pushed to a Redis list and a background task moves
+    them into the database with one multi-row INSERT per batch. The INSERT
+    ignores users already registered for the event, so a batch may safely
+    be written twice if the process dies between the INSERT and the trim.
+
+    A per-event set of registered ``tg_id``s, filled by ``load``, tells
+    ``enqueue`` whether a registration is new before it reaches the
+    database. Rows the database refuses, e.g. for an event deleted
+    meanwhile, go to a dead-letter list instead of blocking the queue, and
+    their stats and seats are given back.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        session_factory: async_sessionmaker[AsyncSession],
+        catalog: EventCatalog,
+        registration_stats: RegistrationStats,
+        seat_map: SeatMap,
+        batch_size: int,
+        interval_ms: int,
+    ):
+        self.redis = redis
+        self.session_factory = session_factory
+        self.catalog = catalog
+        self.registration_stats = registration_stats
+        self.seat_map = seat_map
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.stats = WriteBehindStats()
+        self._pending = 0
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: asyncio.Task | None = None
+        self._enqueue = redis.register_script(ENQUEUE)
+
+    async def load(self, event_id: int) -> None:
+        """
+        Rebuild the registered set of ``event_id`` from ``tg_user`` and
+        the rows still queued.
+        """
+        async with self.session_factory() as session:
+            result = await session.stream_scalars(
+                select(User.tg_id)
+                .where(User.event_id == event_id)
+                .execution_options(yield_per=10_000)
+            )
+            tg_ids = [tg_id async for tg_id in result]
+        for raw in await self.redis.lrange(QUEUE_KEY, 0, -1):
+            row = json.loads(raw)
+            if row["event_id"] == event_id:
+                tg_ids.append(row["tg_id"])
+
+        key = registered_key(event_id)
+        building = f"{key}:building"
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(building)
+        for start in range(0, len(tg_ids), 10_000):
+            pipe.sadd(building, *tg_ids[start:start + 10_000])
+        if tg_ids:
+            pipe.rename(building, key)
+        else:
+            pipe.delete(key)
+        await pipe.execute()
+
+    async def enqueue(self, row: dict[str, Any]) -> bool:
+        """Queue ``row``, returns False if the user is registered already."""
+        queued = await self._enqueue(
+            keys=[registered_key(row["event_id"]), QUEUE_KEY],
+            args=[row["tg_id"], json.dumps(row)],
+        )
+        if not queued:
+            return False
+        self.stats.enqueued += 1
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def forget(self, event_id: int, tg_id: int) -> None:
+        """Let a user whose registration was deleted register again."""
+        await self.redis.srem(registered_key(event_id), tg_id)
+
+    async def _insert(self, rows: list[dict[str, Any]]) -> None:
+        async with self.session_factory() as session:
+            dialect = session.bind.dialect.name
+            await session.execute(insert_users(dialect).values(rows))
+            await session.commit()
+
+    async def _dead_letter(
+        self, raw_rows: list[bytes], rows: list[dict[str, Any]]
+    ) -> list[dict[str, Any]]:
+        """
+        Insert the rows of a refused batch one by one and move those the
+        database refuses again to the dead-letter list. Returns them.
+        """
+        dead = []
+        for raw, row in zip(raw_rows, rows):
+            try:
+                await self._insert([row])
+            except (IntegrityError, DataError):
+                logger.exception("Registration refused: %s", raw)
+                dead.append((raw, row))
+        if dead:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.rpush(DEAD_LETTER_KEY, *(raw for raw, _ in dead))
+            for _, row in dead:
+                pipe.srem(registered_key(row["event_id"]), row["tg_id"])
+            await pipe.execute()
+        self.stats.dead_lettered += len(dead)
+        return [row for _, row in dead]
+
+    async def _undo(self, row: dict[str, Any]) -> None:
+        """Take back what was counted and reserved for a dead row."""
+        await self.registration_stats.record(
+            row["date"], row["hotel_info"], row["organization"], -1
+        )
+        event = next((
+            event for event in self.catalog.events.values()
+            if event.id == row["event_id"]
+        ), None)
+        date = event.date_by_label(row["date"]) if event else None
+        if date is not None and self.seat_map.limited(date.ref):
+            # the waitlist is seated by whoever releases a seat next
+            await self.seat_map.release(
+                date.ref, row["hotel_info"], promote=False
+            )
+
+    async def flush(self) -> int:
+        lock = self.redis.lock(LOCK_KEY, timeout=30)
+        if not await lock.acquire(blocking=False):
+            return 0
+        try:
+            raw_rows = await self.redis.lrange(
+                QUEUE_KEY, 0, self.batch_size - 1
+            )
+            if not raw_rows:
+                self.stats.queue_depth = 0
+                return 0
+
+            started = time.perf_counter()
+            rows = [with_search_columns(json.loads(raw)) for raw in raw_rows]
+            dead = []
+            try:
+                await self._insert(rows)
+            except (IntegrityError, DataError):
+                # a bad row, not an outage: the others still go in, so
+                # retrying the batch as it is would block the queue
+                dead = await self._dead_letter(raw_rows, rows)
+            await self.redis.ltrim(QUEUE_KEY, len(raw_rows), -1)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        finally:
+            # expired during a slow flush, maybe taken by another process
+            with contextlib.suppress(LockError):
+                await lock.release()
+
+        # after the trim, a retried batch must not undo a row twice
+        for row in dead:
+            try:
+                await self._undo(row)
+            except Exception:
+                logger.exception(
+                    "Failed to give back the seat of user %s", row["tg_id"]
+                )
+        self._pending = max(self._pending - len(rows), 0)
+        self.stats.flushes += 1
+        self.stats.flushed += len(rows) - len(dead)
+        self.stats.last_flush_ms = elapsed_ms
+        self.stats.max_flush_ms = max(self.stats.max_flush_ms, elapsed_ms)
+        self.stats.queue_depth = await self.redis.llen(QUEUE_KEY)
+        logger.debug(
+            "Flushed %d registrations in %.1f ms, %d still queued",
+            len(rows), elapsed_ms, self.stats.queue_depth,
+        )
+        return len(rows)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while await self.flush() == self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Failed to flush queued registrations")
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+        while await self.flush():
+            pass
+        logger.info(
+            "Registration queue drained, %d rows flushed in total",
+            self.stats.flushed,
+        )
+
+
+async def store_registration(
+    session: LazySession,
+    members: MembershipCache,
+    registrations: RegistrationQueue | None,
+    registration_stats: RegistrationStats,
+    row: dict[str, Any],
+) -> bool:
+    """
+    Stores a tg_user row in a single INSERT ... ON CONFLICT (event_id,
+    tg_id) DO NOTHING RETURNING statement, or queues it in write-behind
+    mode. Returns False if the user was already registered for the event,
+    e.g. when the last answer was submitted twice at once.
+    """
+    stats = partial(
+        registration_stats.record,
+        row["date"], row["hotel_info"], row["organization"],
+    )
+    if registrations is not None:
+        # the registered set in Redis is the commit here, the row is
+        # already visible to every process
+        created = await registrations.enqueue(row)
+        members.add(row["tg_id"])
+        if created:
+            await stats()
+        return created
+
+    async def remember() -> None:
+        members.add(row["tg_id"])
+
+    stmt = insert_users(session.bind.dialect.name).values(**row)
+    created = await session.scalar(stmt.returning(User.id)) is not None
+    session.after_commit(remember)
+    if created:
+        session.after_commit(stats)
+    return created
@@ -0,0 +1,82 @@
+import re
+from typing import NamedTuple
+
+from sqlalchemy import ColumnElement, Select, func, literal, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from seminar_bot.db import User
+from seminar_bot.normalize import normalize_text, phone_digits
+
+# "+998 90 123", "90-123-45-67" and the like are phone number prefixes
+PHONE_QUERY_REGEX = re.compile(r"^[\d\s()+-]*\d[\d\s()+-]*$")
+MIN_PHONE_DIGITS = 3
+# registration only takes +998 numbers, admins type them without it
+COUNTRY_CODE = "998"
+
+
+class SearchResult(NamedTuple):
+    user: User
+    score: float
+
+
+def search_condition(
+    query: str, dialect: str
+) -> tuple[ColumnElement[bool], ColumnElement[float]] | None:
+    """
+    The WHERE clause matching ``query`` and the expression to rank the
+    matches by, best first, or None if the query has nothing to search for.
+
+    Phone-like queries match the beginning of the digits of the phone
+    number, with or without the country code. Anything else is matched against the transliterated name and
+    organization by trigram word similarity, so spelling variants and
+    Cyrillic/Latin spellings of the same name are found. That uses the
+    trigram index on PostgreSQL; other databases get a substring match.
+    """
+    if PHONE_QUERY_REGEX.match(query):
+        digits = phone_digits(query)
+        if len(digits) < MIN_PHONE_DIGITS:
+            return None
+        # "998 90..." may be a local number of operator 99 as well
+        return or_(
+            User.phone_digits.startswith(digits),
+            User.phone_digits.startswith(COUNTRY_CODE + digits),
+        ), literal(1.0)
+
+    text = normalize_text(query)
+    if not text:
+        return None
+    if dialect != "postgresql":
+        return User.search_text.contains(text, autoescape=True), literal(1.0)
+    # "search_text %> text" is what the gin_trgm_ops index can answer
+    return (
+        User.search_text.op("%>")(text),
+        func.word_similarity(text, User.search_text),
+    )
+
+
+def search_statement(
+    stmt: Select, query: str, dialect: str
+) -> Select | None:
+    """``stmt`` narrowed down to the matches of ``query``, best first."""
+    condition = search_condition(query, dialect)
+    if condition is None:
+        return None
+    where, score = condition
+    return stmt.where(where).order_by(None).order_by(score.desc(), User.id)
+
+
+async def search_users(
+    session: AsyncSession, query: str, limit: int = 10
+) -> list[SearchResult]:
+    condition = search_condition(query, session.bind.dialect.name)
+    if condition is None:
+        return []
+    where, score = condition
+    stmt = (
+        select(User, score.label("score"))
+        .where(where)
+        .order_by(score.desc(), User.id)
+        .limit(limit)
+    )
+    result = await session.execute(stmt)
+    return [SearchResult(user, float(score)) for user, score in result]
@@ -0,0 +1,310 @@
+import json
+import logging
+import time
+from typing import Any, Iterable, Mapping, NamedTuple
+
+from redis.asyncio import Redis
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from seminar_bot.catalog import CatalogEvent
+from seminar_bot.db import User
+
+logger = logging.getLogger(__name__)
+
+# rooms on a date without a hotel limit
+UNLIMITED = 2 ** 31
+
+# Takes a seat, and a hotel room if asked for, or puts the user on the
+# date's waitlist.
+#
+# KEYS: seat counters hash, waitlist sorted set, waitlist payload hash
+# ARGV: seats, rooms, 1 if a room is wanted, tg_id, payload, now in ms
+# Returns: {1, 0} if seated, {0, position} if on the waitlist
+RESERVE = """
+local rank = redis.call('ZRANK', KEYS[2], ARGV[4])
+if rank then
+    return {0, rank + 1}
+end
+local taken = tonumber(redis.call('HGET', KEYS[1], 'taken') or '0')
+local rooms = tonumber(redis.call('HGET', KEYS[1], 'rooms_taken') or '0')
+local room = ARGV[3] == '1'
+if taken < tonumber(ARGV[1]) and (not room or rooms < tonumber(ARGV[2])) then
+    redis.call('HINCRBY', KEYS[1], 'taken', 1)
+    if room then
+        redis.call('HINCRBY', KEYS[1], 'rooms_taken', 1)
+    end
+    return {1, 0}
+end
+redis.call('ZADD', KEYS[2], ARGV[6], ARGV[4])
+redis.call('HSET', KEYS[3], ARGV[4], ARGV[5])
+return {0, redis.call('ZRANK', KEYS[2], ARGV[4]) + 1}
+"""
+
+# Gives a seat (and room) back, then seats waitlisted users in order while
+# they fit. Someone who needs a room the hotel no longer has is skipped,
+# not a reason to keep everyone behind them waiting.
+#
+# KEYS: seat counters hash, waitlist sorted set, waitlist payload hash
+# ARGV: seats, rooms, 1 to give a seat back, 1 to give a room back,
+#       waitlist entries looked at, 0 to seat nobody
+# Returns: the payloads of the seated users
+RELEASE = """
+local taken = tonumber(redis.call('HGET', KEYS[1], 'taken') or '0')
+local rooms = tonumber(redis.call('HGET', KEYS[1], 'rooms_taken') or '0')
+if ARGV[3] == '1' then
+    taken = math.max(0, taken - 1)
+    if ARGV[4] == '1' then
+        rooms = math.max(0, rooms - 1)
+    end
+end
+local seated = {}
+local waiting = {}
+if tonumber(ARGV[5]) > 0 then
+    waiting = redis.call('ZRANGE', KEYS[2], 0, tonumber(ARGV[5]) - 1)
+end
+for _, tg_id in ipairs(waiting) do
+    if taken >= tonumber(ARGV[1]) then
+        break
+    end
+    local payload = redis.call('HGET', KEYS[3], tg_id)
+    local room = payload and cjson.decode(payload)['hotel_info']
+    if not payload or not room or rooms < tonumber(ARGV[2]) then
+        redis.call('ZREM', KEYS[2], tg_id)
+        redis.call('HDEL', KEYS[3], tg_id)
+        if payload then
+            taken = taken + 1
+            if room then
+                rooms = rooms + 1
+            end
+            table.insert(seated, payload)
+        end
+    end
+end
+redis.call('HSET', KEYS[1], 'taken', taken, 'rooms_taken', rooms)
+return seated
+"""
+
+# Gives the seat (and room) of a user seated off the waitlist back and puts
+# them first in line again, e.g. when registering them failed.
+#
+# KEYS: seat counters hash, waitlist sorted set, waitlist payload hash
+# ARGV: 1 to give a room back, tg_id, payload
+REQUEUE = """
+local taken = tonumber(redis.call('HGET', KEYS[1], 'taken') or '0')
+local rooms = tonumber(redis.call('HGET', KEYS[1], 'rooms_taken') or '0')
+taken = math.max(0, taken - 1)
+if ARGV[1] == '1' then
+    rooms = math.max(0, rooms - 1)
+end
+redis.call('HSET', KEYS[1], 'taken', taken, 'rooms_taken', rooms)
+local first = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+local score = 0
+if first[2] then
+    score = tonumber(first[2]) - 1
+end
+redis.call('ZADD', KEYS[2], score, ARGV[2])
+redis.call('HSET', KEYS[3], ARGV[2], ARGV[3])
+"""
+
+
+class Reservation(NamedTuple):
+    seated: bool
+    # place on the waitlist, 0 when seated
+    position: int
+
+
+def seats_key(date: str) -> str:
+    return f"seats:{date}"
+
+
+def waitlist_key(date: str) -> str:
+    return f"seats:{date}:waitlist"
+
+
+def waitlist_data_key(date: str) -> str:
+    return f"seats:{date}:waitlist:data"
+
+
+class SeatMap:
+    """
+    Seats and hotel rooms per seminar date, counted in Redis so that a
+    burst of registrations for the same day costs one script call each
+    instead of queueing on a database row lock. Dates are named by their
+    ``CatalogDate.ref``.
+
+    Dates missing from ``capacity`` are unlimited and never touch Redis.
+    The counters live in Redis only; ``sync`` rebuilds missing ones from
+    ``tg_user``. Registrations that don't fit go to a per-date waitlist,
+    with everything needed to register them later, and are seated in order
+    by ``release`` as seats are given back.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        capacity: Mapping[str, tuple[int, int]],
+        cache_ttl: float = 2,
+        promote_scan: int = 100,
+    ):
+        self.redis = redis
+        self.capacity = capacity
+        self.cache_ttl = cache_ttl
+        self.promote_scan = promote_scan
+        self._reserve = redis.register_script(RESERVE)
+        self._release = redis.register_script(RELEASE)
+        self._requeue = redis.register_script(REQUEUE)
+        self._remaining: dict[str, int] = {}
+        self._remaining_expires_at = 0.0
+
+    def set_capacity(self, capacity: Mapping[str, tuple[int, int]]) -> None:
+        self.capacity = capacity
+        self._remaining = {}
+        self._remaining_expires_at = 0.0
+
+    def limited(self, date: str | None) -> bool:
+        return date in self.capacity
+
+    def _limits(self, date: str) -> tuple[int, int]:
+        seats, rooms = self.capacity[date]
+        return seats, rooms or UNLIMITED
+
+    def _keys(self, date: str) -> list[str]:
+        return [seats_key(date), waitlist_key(date), waitlist_data_key(date)]
+
+    async def reserve(
+        self, date: str, tg_id: int, payload: dict[str, Any]
+    ) -> Reservation:
+        """
+        A seat for ``tg_id``, or its place on the waitlist, where
+        ``payload`` is kept until ``release`` hands it back. Asking again
+        while waiting keeps the original place.
+        """
+        seats, rooms = self._limits(date)
+        seated, position = await self._reserve(
+            keys=self._keys(date),
+            args=[
+                seats,
+                rooms,
+                int(bool(payload.get("hotel_info"))),
+                tg_id,
+                json.dumps(payload),
+                int(time.time() * 1000),
+            ],
+        )
+        if seated:
+            self._remaining.pop(date, None)
+        return Reservation(bool(seated), position)
+
+    async def release(
+        self,
+        date: str,
+        hotel_info: bool = False,
+        give_back: bool = True,
+        promote: bool = True,
+    ) -> list[dict[str, Any]]:
+        """
+        Give a seat back, and the room if ``hotel_info``, and return the
+        payloads of the waitlisted users who got seats. With ``give_back``
+        unset it only seats whoever fits, e.g. after a capacity increase,
+        with ``promote`` unset nobody is seated.
+        """
+        seats, rooms = self._limits(date)
+        seated = await self._release(
+            keys=self._keys(date),
+            args=[seats, rooms, int(give_back), int(hotel_info),
+                  self.promote_scan if promote else 0],
+        )
+        self._remaining.pop(date, None)
+        return [json.loads(payload) for payload in seated]
+
+    async def requeue(self, date: str, payload: dict[str, Any]) -> None:
+        """
+        Undo seating ``payload`` from ``release``: the seat is given back
+        and the user is first on the waitlist again.
+        """
+        await self._requeue(
+            keys=self._keys(date),
+            args=[
+                int(bool(payload.get("hotel_info"))),
+                payload["tg_id"],
+                json.dumps(payload),
+            ],
+        )
+        self._remaining.pop(date, None)
+
+    async def leave_waitlist(
+        self, tg_id: int, dates: Iterable[str] | None = None
+    ) -> bool:
+        """Take ``tg_id`` off the waitlists. Returns True if it was on one."""
+        pipe = self.redis.pipeline(transaction=True)
+        for date in self.capacity if dates is None else dates:
+            pipe.zrem(waitlist_key(date), tg_id)
+            pipe.hdel(waitlist_data_key(date), tg_id)
+        return any(await pipe.execute())
+
+    async def remaining(self) -> dict[str, int]:
+        """Free seats per limited date, at most ``cache_ttl`` seconds old."""
+        if not self.capacity:
+            return {}
+        now = time.monotonic()
+        if now < self._remaining_expires_at and len(self._remaining) == len(
+            self.capacity
+        ):
+            return self._remaining
+        dates = list(self.capacity)
+        pipe = self.redis.pipeline(transaction=False)
+        for date in dates:
+            pipe.hget(seats_key(date), "taken")
+        taken = await pipe.execute()
+        self._remaining = {
+            date: max(0, self.capacity[date][0] - int(count or 0))
+            for date, count in zip(dates, taken)
+        }
+        self._remaining_expires_at = now + self.cache_ttl
+        return self._remaining
+
+    async def sync(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        event: CatalogEvent,
+    ) -> None:
+        """
+        Count the seats and rooms taken on the dates of ``event`` that
+        have no counters in Redis yet from its ``tg_user`` rows.
+        """
+        refs = [date.ref for date in event.dates if self.limited(date.ref)]
+        pipe = self.redis.pipeline(transaction=False)
+        for ref in refs:
+            pipe.exists(seats_key(ref))
+        missing = [
+            ref for ref, exists in zip(refs, await pipe.execute())
+            if not exists
+        ]
+        if not missing:
+            return
+
+        async with session_factory() as session:
+            rows = await session.execute(
+                select(
+                    User.date,
+                    func.count(User.id),
+                    func.count(User.id).filter(User.hotel_info),
+                ).where(User.event_id == event.id).group_by(User.date)
+            )
+            rows = rows.all()
+        counts = {ref: [0, 0] for ref in missing}
+        for label, taken, rooms in rows:
+            # tg_user.date holds the label the user picked
+            date = event.date_by_label(label)
+            if date is not None and date.ref in counts:
+                counts[date.ref][0] += taken
+                counts[date.ref][1] += rooms
+
+        # HSETNX, another process may have done this meanwhile
+        pipe = self.redis.pipeline(transaction=True)
+        for ref, (taken, rooms) in counts.items():
+            pipe.hsetnx(seats_key(ref), "taken", taken)
+            pipe.hsetnx(seats_key(ref), "rooms_taken", rooms)
+        await pipe.execute()
+        logger.info("Seat counters rebuilt for %s", ", ".join(missing))
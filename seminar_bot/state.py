@@ -1,5 +1,8 @@
+from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 
+from seminar_bot.storage import SeminarRedisStorage
+
 
 class Menu(StatesGroup):
     choose_language = State()
@@ -12,3 +15,13 @@ class Menu(StatesGroup):
     send_hotel_info = State()
     send_date = State()
     main_menu = State()
+
+
+async def advance(state: FSMContext, new_state: State, **data) -> None:
+    """Merge ``data`` into the FSM data and switch to ``new_state``."""
+    storage = state.storage
+    if isinstance(storage, SeminarRedisStorage):
+        await storage.set_state_and_update_data(state.key, new_state, data)
+        return
+    await state.update_data(**data)
+    await state.set_state(new_state)
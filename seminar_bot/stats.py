@@ -0,0 +1,275 @@
+import asyncio
+import contextlib
+import logging
+import time
+from dataclasses import dataclass, field
+
+from redis.asyncio import Redis
+from redis.exceptions import LockError, RedisError
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from seminar_bot.catalog import CatalogEvent
+from seminar_bot.db import User
+
+logger = logging.getLogger(__name__)
+
+# hash with "total", "hotel", "date:<date>" and "hotel:<date>" counts, by
+# the catalog key of the date whatever language it was picked in
+SUMMARY_KEY = "stats:registrations"
+# sorted set of organizations scored by registrations
+ORGANIZATIONS_KEY = "stats:registrations:organizations"
+RECONCILED_KEY = "stats:registrations:reconciled_at"
+LOCK_KEY = "stats:registrations:lock"
+# dates are shown in the language of the admin chat
+LABEL_LOCALE = "ru"
+
+
+def organization_key(organization: str | None) -> str:
+    # "ООО  Ромашка " and "ООО Ромашка" are the same organization
+    return " ".join((organization or "").split()) or "—"
+
+
+@dataclass
+class RegistrationSummary:
+    total: int = 0
+    hotel: int = 0
+    # date key: (registrations, hotel rooms wanted)
+    dates: dict[str, tuple[int, int]] = field(default_factory=dict)
+    organizations: list[tuple[str, int]] = field(default_factory=list)
+    reconciled_at: float | None = None
+    # date key -> label, dates missing from the catalog show their key
+    labels: dict[str, str] = field(default_factory=dict)
+
+    def label(self, date: str) -> str:
+        return self.labels.get(date, date)
+
+    def as_dict(self) -> dict:
+        return dict(
+            total=self.total,
+            hotel=self.hotel,
+            dates={
+                date: dict(
+                    label=self.label(date), registrations=count, hotel=hotel
+                )
+                for date, (count, hotel) in self.dates.items()
+            },
+            organizations=[
+                dict(name=name, registrations=count)
+                for name, count in self.organizations
+            ],
+            reconciled_at=self.reconciled_at,
+        )
+
+    def __str__(self) -> str:
+        lines = [
+            f"Зарегистрировано: {self.total}",
+            f"Нужна гостиница: {self.hotel}",
+        ]
+        if self.dates:
+            lines.append("\nПо датам (всего / гостиница):")
+            lines.extend(
+                f"{self.label(date)}: {count} / {hotel}"
+                for date, (count, hotel) in self.dates.items()
+            )
+        if self.organizations:
+            lines.append("\nОрганизации:")
+            lines.extend(
+                f"{name}: {count}" for name, count in self.organizations
+            )
+        return "\n".join(lines)
+
+
+class RegistrationStats:
+    """
+    Registration counts kept in Redis and bumped on every registration, so
+    reading them costs the same for ten attendees as for a million.
+
+    The counters can drift: a registration whose transaction rolls back
+    after it was counted, a Redis outage, rows inserted behind the bot's
+    back. ``reconcile`` recounts ``tg_user`` and overwrites them, and the
+    background task does that every ``reconcile_interval`` seconds in
+    whichever process gets there first. With ``event`` set only that
+    event's registrations are counted, and dates are counted by their
+    catalog key rather than the label the user picked.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        session_factory: async_sessionmaker[AsyncSession],
+        reconcile_interval: float = 600,
+        top_organizations: int = 10,
+    ):
+        self.redis = redis
+        self.session_factory = session_factory
+        self.reconcile_interval = reconcile_interval
+        self.top_organizations = top_organizations
+        self.event: CatalogEvent | None = None
+        self._task: asyncio.Task | None = None
+
+    def _date_key(self, label: str | None) -> str:
+        """The catalog key of a ``tg_user.date`` value."""
+        date = self.event.date_by_label(label) if self.event else None
+        if date is not None:
+            return date.key
+        return label or "—"
+
+    async def record(
+        self,
+        date: str | None,
+        hotel_info: bool,
+        organization: str | None,
+        delta: int = 1,
+    ) -> None:
+        """
+        Count a registration, or take one back with ``delta=-1``. ``date``
+        is the label stored in ``tg_user``.
+        """
+        date = self._date_key(date)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hincrby(SUMMARY_KEY, "total", delta)
+        pipe.hincrby(SUMMARY_KEY, f"date:{date}", delta)
+        if hotel_info:
+            pipe.hincrby(SUMMARY_KEY, "hotel", delta)
+            pipe.hincrby(SUMMARY_KEY, f"hotel:{date}", delta)
+        pipe.zincrby(ORGANIZATIONS_KEY, delta, organization_key(organization))
+        if delta < 0:
+            pipe.zremrangebyscore(ORGANIZATIONS_KEY, "-inf", 0)
+        try:
+            await pipe.execute()
+        except RedisError:
+            # the registration itself must not fail over the counters
+            logger.warning("Registration stats not updated", exc_info=True)
+
+    async def summary(self, top: int | None = None) -> RegistrationSummary:
+        top = self.top_organizations if top is None else top
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(SUMMARY_KEY)
+        pipe.get(RECONCILED_KEY)
+        # ZREVRANGE 0 -1 would be every organization
+        if top > 0:
+            pipe.zrevrange(ORGANIZATIONS_KEY, 0, top - 1, withscores=True)
+        counts, reconciled_at, *ranked = await pipe.execute()
+        organizations = ranked[0] if ranked else []
+
+        summary = RegistrationSummary(
+            organizations=[
+                (name.decode(), int(score)) for name, score in organizations
+            ],
+            reconciled_at=float(reconciled_at) if reconciled_at else None,
+        )
+        dates: dict[str, list[int]] = {}
+        for key, value in counts.items():
+            kind, _, date = key.decode().partition(":")
+            if kind == "total":
+                summary.total = int(value)
+            elif kind == "hotel" and not date:
+                summary.hotel = int(value)
+            elif date:
+                index = 0 if kind == "date" else 1
+                dates.setdefault(date, [0, 0])[index] = int(value)
+        # in the order of the catalog, then the dates it doesn't know
+        order = [date.key for date in self.event.dates] if self.event else []
+        order += sorted(set(dates) - set(order))
+        summary.dates = {
+            date: tuple(dates[date]) for date in order if date in dates
+        }
+        if self.event is not None:
+            summary.labels = {
+                date.key: date.label(LABEL_LOCALE)
+                for date in self.event.dates
+            }
+        return summary
+
+    async def _count(self) -> tuple[dict[str, int], dict[str, int]]:
+        where = [] if self.event is None else [
+            User.event_id == self.event.id
+        ]
+        async with self.session_factory() as session:
+            by_date = await session.execute(
+                select(
+                    User.date,
+                    func.count(User.id),
+                    func.count(User.id).filter(User.hotel_info),
+                ).where(*where).group_by(User.date)
+            )
+            by_organization = await session.execute(
+                select(User.organization, func.count(User.id))
+                .where(*where)
+                .group_by(User.organization)
+            )
+            by_date = by_date.all()
+            by_organization = by_organization.all()
+
+        counts = {"total": 0, "hotel": 0}
+        for label, count, hotel in by_date:
+            # one date may have been stored under each of its labels
+            date = self._date_key(label)
+            counts["total"] += count
+            counts["hotel"] += hotel
+            counts[f"date:{date}"] = counts.get(f"date:{date}", 0) + count
+            if hotel:
+                counts[f"hotel:{date}"] = (
+                    counts.get(f"hotel:{date}", 0) + hotel
+                )
+        organizations: dict[str, int] = {}
+        for organization, count in by_organization:
+            key = organization_key(organization)
+            organizations[key] = organizations.get(key, 0) + count
+        return counts, organizations
+
+    async def reconcile(self, force: bool = False) -> bool:
+        """
+        Recount from ``tg_user`` and replace the counters. Returns False
+        if another process is reconciling or, unless ``force`` is set, did
+        so less than ``reconcile_interval`` seconds ago.
+
+        Registrations counted between the recount and the replacement are
+        lost until the next run.
+        """
+        lock = self.redis.lock(LOCK_KEY, timeout=300)
+        if not await lock.acquire(blocking=False):
+            return False
+        try:
+            reconciled_at = await self.redis.get(RECONCILED_KEY)
+            now = time.time()
+            if not force and reconciled_at and (
+                now - float(reconciled_at) < self.reconcile_interval
+            ):
+                return False
+
+            started = time.perf_counter()
+            counts, organizations = await self._count()
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.delete(SUMMARY_KEY, ORGANIZATIONS_KEY)
+            pipe.hset(SUMMARY_KEY, mapping=counts)
+            if organizations:
+                pipe.zadd(ORGANIZATIONS_KEY, organizations)
+            pipe.set(RECONCILED_KEY, now)
+            await pipe.execute()
+        finally:
+            # expired during a slow recount, maybe taken by another process
+            with contextlib.suppress(LockError):
+                await lock.release()
+
+        logger.info(
+            "Registration stats reconciled in %.1f ms: %d registrations",
+            (time.perf_counter() - started) * 1000, counts["total"],
+        )
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.reconcile()
+            except Exception:
+                logger.exception("Failed to reconcile registration stats")
+            await asyncio.sleep(self.reconcile_interval)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
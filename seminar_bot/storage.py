@@ -0,0 +1,284 @@
+import asyncio
+import json
+import logging
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Any, Awaitable, Dict, Optional, cast
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+from aiogram.types import TelegramObject
+from redis.asyncio import BlockingConnectionPool, Redis
+
+from seminar_bot.config import Config
+from seminar_bot.metrics import REDIS_SECONDS
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Merges a patch into the FSM data record and sets the FSM state in one
+# round trip. The payload goes through Redis' cjson/cmsgpack, which is fine
+# for the flat string/number values the bot keeps in FSM data. Records
+# still stored as JSON are read back transparently after switching to
+# msgpack.
+#
+# KEYS: state key, data key
+# ARGV: state ("" deletes it), encoded patch, state TTL, data TTL ("" = none)
+MERGE_DATA_SET_STATE = """
+local function decode(value)
+    if string.sub(value, 1, 1) == '{' then
+        return cjson.decode(value)
+    end
+    return %(decode)s(value)
+end
+local current = redis.call('GET', KEYS[2])
+local data = {}
+if current then
+    data = decode(current)
+end
+for k, v in pairs(decode(ARGV[2])) do
+    data[k] = v
+end
+if next(data) == nil then
+    redis.call('DEL', KEYS[2])
+elseif ARGV[4] ~= '' then
+    redis.call('SET', KEYS[2], %(encode)s(data), 'EX', ARGV[4])
+else
+    redis.call('SET', KEYS[2], %(encode)s(data))
+end
+if ARGV[1] == '' then
+    redis.call('DEL', KEYS[1])
+elseif ARGV[3] ~= '' then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+
+@dataclass(frozen=True)
+class Serializer:
+    dumps: Callable[[Dict[str, Any]], bytes]
+    loads: Callable[[bytes], Dict[str, Any]]
+    lua_encode: str
+    lua_decode: str
+
+
+def _json_dumps(data: Dict[str, Any]) -> bytes:
+    return json.dumps(data, ensure_ascii=False).encode()
+
+
+def _msgpack_loads(value: bytes) -> Dict[str, Any]:
+    # records written before switching serializers are still JSON
+    if value[:1] == b"{":
+        return json.loads(value)
+    return msgpack.unpackb(value)
+
+
+SERIALIZERS = {
+    "json": Serializer(
+        _json_dumps,
+        json.loads,
+        "cjson.encode",
+        "cjson.decode",
+    ),
+    "msgpack": Serializer(
+        lambda data: msgpack.packb(data),
+        _msgpack_loads,
+        "cmsgpack.pack",
+        "cmsgpack.unpack",
+    ),
+}
+
+
+@dataclass
+class RedisCallCounter:
+    calls: int = 0
+
+
+_redis_calls: ContextVar[Optional[RedisCallCounter]] = ContextVar(
+    "redis_calls", default=None
+)
+
+
+def _count_call(operation: str, started: float) -> None:
+    REDIS_SECONDS.observe(time.perf_counter() - started, operation)
+    counter = _redis_calls.get()
+    if counter is None:
+        counter = RedisCallCounter()
+        _redis_calls.set(counter)
+    counter.calls += 1
+
+
+def _ttl_arg(ttl: Any) -> str:
+    if ttl is None:
+        return ""
+    if hasattr(ttl, "total_seconds"):
+        ttl = ttl.total_seconds()
+    return str(int(ttl))
+
+
+class SeminarRedisStorage(RedisStorage):
+    """
+    RedisStorage that counts its round trips and can update data and state
+    atomically with a single script call.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        serializer: Serializer = SERIALIZERS["json"],
+        **kwargs: Any
+    ):
+        super().__init__(*args, **kwargs)
+        self.serializer = serializer
+        self._merge_script = self.redis.register_script(
+            MERGE_DATA_SET_STATE % {
+                "encode": serializer.lua_encode,
+                "decode": serializer.lua_decode,
+            }
+        )
+
+    async def set_state(
+        self,
+        key: StorageKey,
+        state: StateType = None
+    ) -> None:
+        started = time.perf_counter()
+        try:
+            await super().set_state(key, state)
+        finally:
+            _count_call("set_state", started)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        started = time.perf_counter()
+        try:
+            return await super().get_state(key)
+        finally:
+            _count_call("get_state", started)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        redis_key = self.key_builder.build(key, "data")
+        try:
+            if not data:
+                await self.redis.delete(redis_key)
+                return
+            await self.redis.set(
+                redis_key, self.serializer.dumps(data), ex=self.data_ttl
+            )
+        finally:
+            _count_call("set_data", started)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            value = await self.redis.get(self.key_builder.build(key, "data"))
+        finally:
+            _count_call("get_data", started)
+        if value is None:
+            return {}
+        return self.serializer.loads(value)
+
+    async def set_state_and_update_data(
+        self,
+        key: StorageKey,
+        state: StateType,
+        data: Dict[str, Any],
+    ) -> None:
+        if isinstance(state, State):
+            state = state.state
+        started = time.perf_counter()
+        try:
+            await self._merge_script(
+                keys=[
+                    self.key_builder.build(key, "state"),
+                    self.key_builder.build(key, "data"),
+                ],
+                args=[
+                    cast(str, state or ""),
+                    self.serializer.dumps(data),
+                    _ttl_arg(self.state_ttl),
+                    _ttl_arg(self.data_ttl),
+                ],
+            )
+        finally:
+            _count_call("set_state_and_update_data", started)
+
+
+def create_redis(config: Config) -> Redis:
+    # unix:///path/to/redis.sock URLs connect over a unix socket
+    pool = BlockingConnectionPool.from_url(
+        config.redis_url,
+        max_connections=config.redis_max_connections,
+        timeout=config.redis_pool_timeout,
+    )
+    return Redis(connection_pool=pool)
+
+
+async def prewarm_redis(redis: Redis, connections: int) -> None:
+    """Fill the pool with ``connections`` open connections."""
+    await asyncio.gather(*(redis.ping() for _ in range(connections)))
+
+
+def create_storage(config: Config) -> SeminarRedisStorage:
+    if config.fsm_serializer not in SERIALIZERS:
+        raise ValueError(
+            f"Unknown FSM serializer {config.fsm_serializer!r}, "
+            f"expected one of {', '.join(SERIALIZERS)}"
+        )
+    if config.fsm_serializer == "msgpack" and msgpack is None:
+        raise RuntimeError("msgpack serializer requires the msgpack package")
+    return SeminarRedisStorage(
+        redis=create_redis(config),
+        state_ttl=config.fsm_state_ttl or None,
+        data_ttl=config.fsm_data_ttl or None,
+        serializer=SERIALIZERS[config.fsm_serializer],
+    )
+
+
+@dataclass
+class RedisStats:
+    updates: int = 0
+    calls: int = 0
+
+
+class RedisCallsMiddleware(BaseMiddleware):
+    """
+    Reports how many FSM storage round trips each update needed.
+
+    The counter lives in a context variable that the storage creates on
+    its first call, so the FSM state lookup done before this middleware
+    runs is included.
+    """
+
+    def __init__(self):
+        self.stats = RedisStats()
+
+    async def __call__(
+        self,
+        handler: Callable[
+            [TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            counter = _redis_calls.get()
+            _redis_calls.set(None)
+            calls = counter.calls if counter else 0
+            self.stats.updates += 1
+            self.stats.calls += calls
+            logger.debug(
+                "Update used %d Redis calls (%.2f on average)",
+                calls, self.stats.calls / self.stats.updates,
+            )
@@ -0,0 +1,206 @@
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Mapping, NamedTuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, TelegramObject
+from aiogram.utils.i18n import gettext as _
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from seminar_bot.metrics import REGISTRY
+from seminar_bot.outbound import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Takes a token from a user's bucket for an action.
+#
+# KEYS: bucket hash, "slow down" notice key
+# ARGV: capacity, tokens per millisecond, now in ms, tokens already spent
+#       by the caller without asking, notice window in ms
+# Returns: 1 if allowed, tokens left (as a string), 1 if the user should
+# be told to slow down
+TAKE_TOKEN = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+tokens = tokens - tonumber(ARGV[4])
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1000)
+local notify = 0
+if allowed == 0 and redis.call('SET', KEYS[2], 1, 'NX', 'PX', ARGV[5]) then
+    notify = 1
+end
+return {allowed, tostring(tokens), notify}
+"""
+
+THROTTLED = REGISTRY.counter(
+    "seminar_bot_throttled_total",
+    "Messages dropped by the anti-flood limits, by action",
+    ("action",),
+)
+
+
+class Verdict(NamedTuple):
+    allowed: bool
+    notify: bool
+
+
+@dataclass
+class ThrottleStats:
+    local_allowed: int = 0
+    local_denied: int = 0
+    redis_calls: int = 0
+    redis_errors: int = 0
+
+
+class _LocalBucket:
+    def __init__(self, capacity: float, rate: float):
+        self.bucket = TokenBucket(rate, capacity)
+        # tokens taken here that Redis hasn't been told about yet
+        self.unsynced = 0
+        self.notice_until = 0.0
+
+
+class Throttle:
+    """
+    Per-user, per-action token buckets kept in Redis, so every process
+    handling the user's updates draws from the same one.
+
+    Each process mirrors the buckets of recent users. Redis only ever has
+    fewer tokens than the mirror, since other processes can only take
+    tokens, so a mirror with less than one token denies without asking.
+    A mirror more than half full lets the message through on its own and
+    passes the tokens it spent along with the next call to Redis. Idle
+    users therefore cost no round trip, and a user split over several
+    processes gets at most half a burst extra per process.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        limits: Mapping[str, tuple[int, float]],
+        notice_window: float = 10,
+        cache_size: int = 100_000,
+    ):
+        self.redis = redis
+        self.limits = limits
+        self.notice_window = notice_window
+        self.cache_size = cache_size
+        self.stats = ThrottleStats()
+        self._take = redis.register_script(TAKE_TOKEN)
+        self._local: OrderedDict[tuple[int, str], _LocalBucket] = (
+            OrderedDict()
+        )
+
+    def _limit(self, action: str) -> tuple[int, float]:
+        return self.limits.get(action) or self.limits["default"]
+
+    def _mirror(self, user_id: int, action: str) -> _LocalBucket:
+        key = (user_id, action)
+        local = self._local.get(key)
+        if local is None:
+            messages, seconds = self._limit(action)
+            local = _LocalBucket(messages, messages / seconds)
+            self._local[key] = local
+        self._local.move_to_end(key)
+        while len(self._local) > self.cache_size:
+            self._local.popitem(last=False)
+        return local
+
+    async def _notify_once(self, user_id: int, action: str) -> bool:
+        return bool(await self.redis.set(
+            f"throttle:{user_id}:{action}:notice", 1,
+            nx=True, px=int(self.notice_window * 1000),
+        ))
+
+    async def acquire(self, user_id: int, action: str) -> Verdict:
+        local = self._mirror(user_id, action)
+        bucket = local.bucket
+        now = time.monotonic()
+        bucket.wait_time(now)
+        if bucket.tokens - 1 >= bucket.capacity / 2:
+            bucket.take()
+            local.unsynced += 1
+            self.stats.local_allowed += 1
+            return Verdict(True, False)
+
+        try:
+            if bucket.tokens < 1:
+                self.stats.local_denied += 1
+                notify = False
+                if now >= local.notice_until:
+                    local.notice_until = now + self.notice_window
+                    notify = await self._notify_once(user_id, action)
+                return Verdict(False, notify)
+
+            self.stats.redis_calls += 1
+            allowed, tokens, notify = await self._take(
+                keys=[
+                    f"throttle:{user_id}:{action}",
+                    f"throttle:{user_id}:{action}:notice",
+                ],
+                args=[
+                    bucket.capacity,
+                    bucket.rate / 1000,
+                    int(time.time() * 1000),
+                    local.unsynced,
+                    int(self.notice_window * 1000),
+                ],
+            )
+        except RedisError:
+            # an unreachable Redis must not lock users out of the bot
+            self.stats.redis_errors += 1
+            logger.warning("Throttling skipped", exc_info=True)
+            return Verdict(True, False)
+
+        local.unsynced = 0
+        bucket.tokens = min(bucket.capacity, float(tokens))
+        if not allowed:
+            local.notice_until = now + self.notice_window
+        return Verdict(bool(allowed), bool(notify))
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Drops messages from users over their limit for the handler's action
+    and tells them to slow down at most once per notice window. The admin
+    chat is never throttled.
+    """
+
+    def __init__(self, throttle: Throttle, admin_chat_id: int):
+        self.throttle = throttle
+        self.admin_chat_id = admin_chat_id
+
+    async def __call__(
+        self,
+        handler: Callable[
+            [TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: dict[str, Any],
+    ) -> Any:
+        action = get_flag(data, "throttle", default="default")
+        user = data.get("event_from_user")
+        if not action or user is None or event.chat.id == self.admin_chat_id:
+            return await handler(event, data)
+
+        verdict = await self.throttle.acquire(user.id, action)
+        if verdict.allowed:
+            return await handler(event, data)
+        THROTTLED.inc(action)
+        if verdict.notify:
+            await event.answer(
+                _("Слишком много сообщений, пожалуйста, подождите немного")
+            )
@@ -0,0 +1,114 @@
+import logging
+from functools import partial
+from typing import Any
+
+from aiogram import Bot
+from aiogram.utils.i18n import I18n
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from seminar_bot.catalog import EventCatalog
+from seminar_bot.members import MembershipCache
+from seminar_bot.middlewares import LazySession
+from seminar_bot.outbound import OutboundScheduler, Priority, QueueFull
+from seminar_bot.registrations import RegistrationQueue, store_registration
+from seminar_bot.seats import SeatMap
+from seminar_bot.stats import RegistrationStats
+
+logger = logging.getLogger(__name__)
+
+
+class Waitlist:
+    """
+    Registers the users ``SeatMap.release`` seats off the waitlists and
+    lets them know once their registration is committed.
+    """
+
+    def __init__(
+        self,
+        seat_map: SeatMap,
+        catalog: EventCatalog,
+        session_factory: async_sessionmaker[AsyncSession],
+        bot: Bot,
+        outbound: OutboundScheduler,
+        i18n: I18n,
+        members: MembershipCache,
+        registrations: RegistrationQueue | None,
+        registration_stats: RegistrationStats,
+    ):
+        self.seat_map = seat_map
+        self.catalog = catalog
+        self.session_factory = session_factory
+        self.bot = bot
+        self.outbound = outbound
+        self.i18n = i18n
+        self.members = members
+        self.registrations = registrations
+        self.registration_stats = registration_stats
+
+    async def release(
+        self, date: str, hotel_info: bool = False, give_back: bool = True
+    ) -> int:
+        """
+        Give a seat on ``date`` back and register whoever it went to.
+        Returns the number of users registered off the waitlist.
+        """
+        seated = await self.seat_map.release(date, hotel_info, give_back)
+        admitted = 0
+        try:
+            while seated:
+                # stays in seated until registered, see below
+                payload = seated[0]
+                created = await self._admit(payload)
+                seated.pop(0)
+                if created:
+                    admitted += 1
+                else:
+                    # registered meanwhile, the seat goes to the next one
+                    seated.extend(await self.seat_map.release(
+                        date, payload["hotel_info"]
+                    ))
+        except Exception:
+            # the waitlist no longer has them, a failed registration or
+            # commit must not drop them: back to the head of the line, in
+            # their order, with their seats given back
+            for payload in reversed(seated):
+                await self.seat_map.requeue(date, payload)
+            raise
+        return admitted
+
+    async def _admit(self, payload: dict[str, Any]) -> bool:
+        date, locale = payload["date_key"], payload["locale"]
+        row = {
+            key: value for key, value in payload.items()
+            if key not in ("date_key", "locale")
+        }
+        session = LazySession(self.session_factory)
+        try:
+            created = await store_registration(
+                session, self.members, self.registrations,
+                self.registration_stats, row,
+            )
+            if created:
+                notify = partial(self._notify, row["tg_id"], date, locale)
+                if self.registrations is None:
+                    session.after_commit(notify)
+                else:
+                    await notify()
+            await session.close(commit=True)
+        finally:
+            await session.close(commit=False)
+        return created
+
+    async def _notify(self, tg_id: int, ref: str, locale: str) -> None:
+        date = self.catalog.dates.get(ref)
+        text = self.i18n.gettext(
+            "Освободилось место на семинаре {date}. Вы зарегистрированы!",
+            locale=locale,
+        ).format(date=date.label(locale) if date is not None else ref)
+        try:
+            self.outbound.submit(
+                tg_id, partial(self.bot.send_message, tg_id, text),
+                Priority.USER,
+            )
+        except QueueFull:
+            logger.warning("Dropped waitlist notice for user %s", tg_id)
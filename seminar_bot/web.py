@@ -1,24 +1,179 @@
-from configparser import ConfigParser
+import re
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, ClassVar
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from redis.asyncio import Redis
 from sqladmin import Admin, ModelView
-from sqlalchemy import create_engine
+from sqladmin.pagination import Pagination
+from sqlalchemy import Select, false, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import selectinload
+from starlette.datastructures import URL
+from starlette.requests import Request
 
-from seminar_bot.db import User
+from seminar_bot.catalog import EventCatalog, bump_version
+from seminar_bot.config import Config, load_config
+from seminar_bot.db import (
+    Event,
+    EventDate,
+    Speaker,
+    User,
+    create_engine,
+    current_event_id,
+    prewarm_engine,
+)
+from seminar_bot.export import FORMATS, iter_export, parse_columns
+from seminar_bot.search import search_statement
+from seminar_bot.stats import RegistrationStats
 
-app = FastAPI()
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument"
+            ".spreadsheetml.sheet",
+}
 
-with open('config.ini') as f:
-    config = ConfigParser()
-    config.read_file(f)
+# "<page>:<page size>:>42" continues after id 42, "...:<42" goes back from it
+CURSOR_REGEX = re.compile(r"^(\d+):(\d+):([<>])(-?\d+)$")
 
 
-engine = create_engine(config["bot"].get('db_uri'))
-admin = Admin(app, engine)
+@dataclass
+class KeysetPagination(Pagination):
+    first_id: Any = None
+    last_id: Any = None
 
+    def _add_page_control(self, base_url: URL, page: int) -> None:
+        # links to the neighbouring pages carry a cursor, so moving one page
+        # forward or back is an index seek instead of an OFFSET scan
+        base_url = base_url.remove_query_params("cursor")
+        if page == self.page + 1 and self.last_id is not None:
+            base_url = base_url.include_query_params(
+                cursor=f"{page}:{self.page_size}:>{self.last_id}"
+            )
+        elif page == self.page - 1 and self.first_id is not None:
+            base_url = base_url.include_query_params(
+                cursor=f"{page}:{self.page_size}:<{self.first_id}"
+            )
+        super()._add_page_control(base_url, page)
 
-class UserAdmin(ModelView, model=User):
+
+class KeysetModelView(ModelView):
+    """
+    ModelView that pages through the unfiltered list by primary key.
+
+    Searches, filters and custom sorting fall back to sqladmin's OFFSET
+    pagination. Row counts are cached for ``count_cache_ttl`` seconds per
+    combination of search and filter parameters.
+    """
+
+    count_cache_ttl: ClassVar[float] = 30
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._counts: dict[str, tuple[int, float]] = {}
+
+    async def count(self, request: Request, stmt: Any = None) -> int:
+        key = str(sorted(
+            item for item in request.query_params.multi_items()
+            if item[0] not in ("page", "pageSize", "cursor")
+        ))
+        now = time.monotonic()
+        cached = self._counts.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        count = await super().count(request, stmt)
+        if len(self._counts) > 1000:
+            self._counts.clear()
+        self._counts[key] = (count, now + self.count_cache_ttl)
+        return count
+
+    def _is_keyset(self, request: Request) -> bool:
+        params = request.query_params
+        if params.get("search") or params.get("sortBy"):
+            return False
+        return not any(
+            params.get(filter_.parameter_name)
+            for filter_ in self.get_filters()
+        )
+
+    async def list(self, request: Request) -> Pagination:
+        if not self._is_keyset(request):
+            return await super().list(request)
+
+        params = request.query_params
+        page = self.validate_page_number(params.get("page"), 1)
+        page_size = self.validate_page_number(
+            params.get("pageSize"), self.page_size
+        )
+        page_size = max(1, min(page_size, max(self.page_size_options)))
+        count = await self.count(request)
+        page = min(max(page, 1), Pagination.max_page(count, page_size))
+
+        stmt, descending = self._page_query(
+            request, page, page_size, count, params.get("cursor")
+        )
+        rows = await self._run_query(stmt)
+        if descending:
+            rows.reverse()
+        pk = self.pk_columns[0].name
+        return KeysetPagination(
+            rows=rows,
+            page=page,
+            page_size=page_size,
+            count=count,
+            first_id=getattr(rows[0], pk) if rows else None,
+            last_id=getattr(rows[-1], pk) if rows else None,
+        )
+
+    def _page_query(
+        self,
+        request: Request,
+        page: int,
+        page_size: int,
+        count: int,
+        cursor: str | None,
+    ) -> tuple[Select, bool]:
+        """The statement for one page and whether it yields rows backwards."""
+        pk = self.pk_columns[0]
+        stmt = self.list_query(request).order_by(None)
+        for relation in self._list_relations:
+            stmt = stmt.options(selectinload(relation))
+
+        match = CURSOR_REGEX.match(cursor or "")
+        if match and (int(match[1]), int(match[2])) == (page, page_size):
+            boundary = int(match[4])
+            if match[3] == ">":
+                stmt = stmt.where(pk > boundary).order_by(pk)
+                return stmt.limit(page_size), False
+            stmt = stmt.where(pk < boundary).order_by(pk.desc())
+            return stmt.limit(page_size), True
+
+        # jumps to an arbitrary page seek from whichever end is closer; the
+        # boundary lookup only walks the primary key index
+        offset = (page - 1) * page_size
+        from_end = count - offset - page_size
+        if from_end < offset:
+            if from_end <= 0:
+                stmt = stmt.order_by(pk.desc()).limit(count - offset)
+                return stmt, True
+            boundary = (
+                select(pk).order_by(pk.desc()).offset(from_end).limit(1)
+                .scalar_subquery()
+            )
+            stmt = stmt.where(pk <= boundary).order_by(pk.desc())
+            return stmt.limit(page_size), True
+        boundary = (
+            select(pk).order_by(pk).offset(offset).limit(1).scalar_subquery()
+        )
+        stmt = stmt.where(pk >= boundary).order_by(pk)
+        return stmt.limit(page_size), False
+
+
+class UserAdmin(KeysetModelView, model=User):
     column_list = [
         User.name,
         User.phone_number,
@@ -30,10 +185,143 @@ class UserAdmin(ModelView, model=User):
     can_create = False
     can_export = False
     column_searchable_list = [User.name, User.phone_number, User.organization]
+    search_dialect: ClassVar[str] = "postgresql"
+
+    def search_query(self, stmt: Select, term: str) -> Select:
+        # ranked trigram search instead of sqladmin's ILIKE on every column
+        ranked = search_statement(stmt, term.strip(), self.search_dialect)
+        return stmt.where(false()) if ranked is None else ranked
+
+
+class CatalogModelView(ModelView):
+    """Makes the bots reload the event catalog after every change."""
+
+    redis: ClassVar[Redis | None] = None
+
+    async def _changed(self) -> None:
+        if self.redis is not None:
+            await bump_version(self.redis)
+
+    async def after_model_change(
+        self, data: dict, model: Any, is_created: bool, request: Request
+    ) -> None:
+        await self._changed()
+
+    async def after_model_delete(self, model: Any, request: Request) -> None:
+        await self._changed()
+
+
+class EventAdmin(CatalogModelView, model=Event):
+    column_list = [Event.id, Event.slug, Event.title, Event.active]
+    form_excluded_columns = [Event.dates, Event.speakers, Event.created_at]
+
+
+class EventDateAdmin(CatalogModelView, model=EventDate):
+    column_list = [
+        EventDate.event,
+        EventDate.key,
+        EventDate.label,
+        EventDate.position,
+        EventDate.seats,
+        EventDate.rooms,
+    ]
+
+
+class SpeakerAdmin(CatalogModelView, model=Speaker):
+    column_list = [Speaker.event, Speaker.name, Speaker.position]
+
+
+def create_app(config: Config | None = None) -> FastAPI:
+    """
+    The admin panel. Nothing is read or connected before this is called:
+    ``uvicorn --factory seminar_bot.web:create_app`` builds it in the
+    server process, which then opens the DB pool before taking requests.
+    """
+    config = config or load_config()
+    engine = create_engine(config)
+    session_factory = async_sessionmaker(bind=engine)
+    # not storage.create_redis, which would pull in aiogram
+    redis = Redis.from_url(
+        config.redis_url, max_connections=config.redis_max_connections
+    )
+    registration_stats = RegistrationStats(
+        redis=redis,
+        session_factory=session_factory,
+        reconcile_interval=config.stats_reconcile_interval,
+        top_organizations=config.stats_top_organizations,
+    )
+    # only for the labels of the dates in the stats
+    catalog = EventCatalog(
+        redis=redis,
+        session_factory=session_factory,
+        slug=config.event_slug or None,
+    )
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        await prewarm_engine(engine, config.db_pool_size)
+        yield
+        await engine.dispose()
+        await redis.aclose()
+
+    app = FastAPI(lifespan=lifespan)
+    admin = Admin(app, engine)
+    UserAdmin.page_size = config.admin_page_size
+    UserAdmin.page_size_options = config.admin_page_size_options
+    UserAdmin.count_cache_ttl = config.admin_count_cache_ttl
+    UserAdmin.search_dialect = engine.dialect.name
+    admin.add_view(UserAdmin)
+    CatalogModelView.redis = redis
+    for view in (EventAdmin, EventDateAdmin, SpeakerAdmin):
+        admin.add_view(view)
+
+    @app.get("/export/tg_user.{fmt}")
+    async def export_users(
+        fmt: str,
+        columns: str | None = None,
+        event: str | None = None,
+        date: list[str] = Query(default=[]),
+        hotel_info: bool | None = None,
+    ) -> StreamingResponse:
+        if fmt not in FORMATS:
+            raise HTTPException(status_code=404)
+        try:
+            selected = parse_columns(columns)
+        except ValueError as ex:
+            raise HTTPException(status_code=400, detail=str(ex))
+        try:
+            async with session_factory() as session:
+                event_id = await current_event_id(
+                    session, event or config.event_slug
+                )
+        except LookupError as ex:
+            raise HTTPException(status_code=404, detail=str(ex))
+        return StreamingResponse(
+            iter_export(
+                session_factory, fmt, selected, event_id, date, hotel_info
+            ),
+            media_type=MEDIA_TYPES[fmt],
+            headers={
+                "Content-Disposition":
+                    f'attachment; filename="tg_user.{fmt}"',
+            },
+        )
 
+    @app.get("/stats/registrations")
+    async def registration_summary(
+        top: int | None = Query(default=None, ge=1, le=1000),
+    ) -> dict:
+        try:
+            await catalog.refresh()
+        except LookupError:
+            # no event to take labels from, show the date keys
+            pass
+        registration_stats.event = catalog.event
+        summary = await registration_stats.summary(top)
+        return summary.as_dict()
 
-admin.add_view(UserAdmin)
+    return app
 
 
 if __name__ == "__main__":
-    uvicorn.run(app)
+    uvicorn.run(create_app())
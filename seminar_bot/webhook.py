@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from typing import Callable, Any, Awaitable
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject
+from aiogram.webhook.aiohttp_server import (
+    SimpleRequestHandler,
+    setup_application,
+)
+from aiohttp import web
+
+from seminar_bot.config import Config
+from seminar_bot.metrics import setup_metrics_route
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(
+        self,
+        handler: Callable[
+            [TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        async with self.semaphore:
+            return await handler(event, data)
+
+
+def create_webhook_app(
+    dp: Dispatcher,
+    bot: Bot,
+    config: Config,
+    allowed_updates: list[str] | None = None,
+    handle_in_background: bool = True,
+) -> web.Application:
+    dp.update.outer_middleware(
+        ConcurrencyLimitMiddleware(config.webhook_concurrency)
+    )
+
+    async def on_startup(bot: Bot) -> None:
+        await bot.set_webhook(
+            url=config.webhook_url + config.webhook_path,
+            secret_token=config.webhook_secret or None,
+            max_connections=config.webhook_max_connections,
+            allowed_updates=(
+                allowed_updates or dp.resolve_used_update_types()
+            ),
+        )
+
+    if config.webhook_url:
+        dp.startup.register(on_startup)
+
+    app = web.Application()
+    # By default updates are acknowledged right away and processed in
+    # background tasks, so slow handlers never make Telegram resend an
+    # update.
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=handle_in_background,
+        secret_token=config.webhook_secret or None,
+    ).register(app, path=config.webhook_path)
+    setup_metrics_route(app, config.metrics_path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    config: Config,
+    **kwargs: Any
+) -> None:
+    app = create_webhook_app(dp, bot, config, **kwargs)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.webhook_host, config.webhook_port)
+    await site.start()
+    logger.info(
+        "Listening for updates on %s:%d%s",
+        config.webhook_host, config.webhook_port, config.webhook_path,
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
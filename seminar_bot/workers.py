@@ -0,0 +1,347 @@
+"""
+Spread update handling over several processes.
+
+With [workers] partitions set, ``python -m seminar_bot.main`` only
+receives updates (by polling or webhook) and appends them to one of
+``partitions`` Redis streams chosen by user id. Worker processes
+
+    python -m seminar_bot.workers --id worker-1
+
+split the partitions between themselves through leases in Redis and run
+the usual dispatcher on them. A partition is read by one worker at a time
+and its updates are handled one after another, so every user's updates
+keep their order and the FSM sees them as a single process would.
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+import random
+import socket
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject, Update
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from seminar_bot.config import Config, load_config
+from seminar_bot.main import create_application
+from seminar_bot.storage import create_redis
+from seminar_bot.webhook import run_webhook
+
+logger = logging.getLogger(__name__)
+
+GROUP = "workers"
+WORKERS_KEY = "updates:workers"
+
+RENEW_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def stream_key(partition: int) -> str:
+    return f"updates:{partition}"
+
+
+def lease_key(partition: int) -> str:
+    return f"updates:{partition}:lease"
+
+
+def partition_for(update: Update, partitions: int) -> int:
+    event = update.event
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id % partitions
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id % partitions
+    return update.update_id % partitions
+
+
+class UpdatePublisher(BaseMiddleware):
+    """
+    Outer update middleware of the receiving dispatcher: appends the
+    update to its partition's stream instead of handling it.
+    """
+
+    def __init__(self, redis: Redis, partitions: int, maxlen: int):
+        self.redis = redis
+        self.partitions = partitions
+        self.maxlen = maxlen
+
+    async def publish(self, update: Update) -> None:
+        await self.redis.xadd(
+            stream_key(partition_for(update, self.partitions)),
+            {"update": update.model_dump_json(exclude_unset=True)},
+            maxlen=self.maxlen,
+        )
+
+    async def __call__(
+        self,
+        handler: Callable[
+            [TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        await self.publish(event)
+
+
+class PartitionWorker:
+    """
+    Owns a fair share of the partitions and feeds their updates into
+    ``dp``.
+
+    Live workers announce themselves in a sorted set every third of the
+    lease TTL. Each round a worker renews its leases, gives up partitions
+    above ``ceil(partitions / live workers)`` and picks up free ones below
+    it, so partitions move to new workers and away from dead ones within
+    one lease TTL. A partition given up is released only after the update
+    being handled is acknowledged, its lease is renewed until then. A
+    consumer whose lease could not be renewed is cancelled at once, as
+    another worker may own the partition already.
+
+    Updates a previous owner read but did not acknowledge are claimed and
+    handled first, once they were idle for a lease TTL, so they can't be
+    taken from a consumer still handling them. New updates wait for them.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        dp: Dispatcher,
+        bot: Bot,
+        partitions: int,
+        worker_id: str,
+        lease_ttl_ms: int = 10_000,
+        batch_size: int = 100,
+        workflow_data: dict[str, Any] | None = None,
+    ):
+        self.redis = redis
+        self.dp = dp
+        self.bot = bot
+        self.partitions = partitions
+        self.worker_id = worker_id
+        self.lease_ttl_ms = lease_ttl_ms
+        self.batch_size = batch_size
+        self.workflow_data = workflow_data or {}
+        self.handled = 0
+        self._owned: dict[int, asyncio.Task] = {}
+        # partitions given up whose consumer finishes its batch
+        self._draining: dict[int, asyncio.Task] = {}
+        self._stopping = False
+        self._renew = redis.register_script(RENEW_LEASE)
+        self._release = redis.register_script(RELEASE_LEASE)
+
+    @property
+    def owned(self) -> list[int]:
+        return sorted(self._owned)
+
+    async def _ensure_group(self, stream: str) -> None:
+        try:
+            await self.redis.xgroup_create(
+                stream, GROUP, id="0", mkstream=True
+            )
+        except ResponseError as ex:
+            if "BUSYGROUP" not in str(ex):
+                raise
+
+    async def _handle(self, stream: str, entries: list) -> None:
+        for entry_id, fields in entries:
+            if fields is None:
+                # trimmed from the stream before anyone handled it
+                await self.redis.xack(stream, GROUP, entry_id)
+                continue
+            update = Update.model_validate_json(
+                fields[b"update"], context={"bot": self.bot}
+            )
+            try:
+                await self.dp.feed_update(
+                    self.bot, update, **self.workflow_data
+                )
+            except Exception:
+                logger.exception("Failed to handle update %s", entry_id)
+            # acknowledged one by one: a worker that dies mid-batch leaves
+            # at most one handled update to be handled again
+            await self.redis.xack(stream, GROUP, entry_id)
+            self.handled += 1
+
+    def _forget(self, partition: int, task: asyncio.Task) -> None:
+        # the partition may have been taken again by a new consumer
+        for consumers in (self._owned, self._draining):
+            if consumers.get(partition) is task:
+                del consumers[partition]
+
+    async def _claim(self, stream: str) -> None:
+        """Handle the updates other consumers read and didn't acknowledge."""
+        start = "0-0"
+        while True:
+            start, entries, *_ = await self.redis.xautoclaim(
+                stream, GROUP, self.worker_id,
+                min_idle_time=self.lease_ttl_ms, start_id=start,
+                count=self.batch_size,
+            )
+            await self._handle(stream, entries)
+            if start not in (b"0-0", "0-0"):
+                continue
+            pending = await self.redis.xpending(stream, GROUP)
+            if not pending["pending"]:
+                return
+            # read too recently to claim, wait until they are
+            await asyncio.sleep(self.lease_ttl_ms / 3000)
+
+    async def _consume(self, partition: int) -> None:
+        stream = stream_key(partition)
+        task = asyncio.current_task()
+        try:
+            await self._ensure_group(stream)
+            await self._claim(stream)
+            while self._owned.get(partition) is task and not self._stopping:
+                response = await self.redis.xreadgroup(
+                    GROUP, self.worker_id, {stream: ">"},
+                    count=self.batch_size, block=1000,
+                )
+                for _, entries in response:
+                    await self._handle(stream, entries)
+        except Exception:
+            logger.exception("Consumer of partition %d failed", partition)
+        finally:
+            self._forget(partition, task)
+            await self._release(
+                keys=[lease_key(partition)], args=[self.worker_id]
+            )
+
+    def _take(self, partition: int) -> None:
+        self._owned[partition] = asyncio.create_task(
+            self._consume(partition)
+        )
+
+    async def rebalance(self) -> None:
+        now = int(time.time() * 1000)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zadd(WORKERS_KEY, {self.worker_id: now})
+        pipe.zremrangebyscore(WORKERS_KEY, 0, now - self.lease_ttl_ms)
+        pipe.zcard(WORKERS_KEY)
+        *_, live = await pipe.execute()
+        target = math.ceil(self.partitions / max(live, 1))
+
+        consumers = [*self._owned.items(), *self._draining.items()]
+        for partition, task in consumers:
+            renewed = await self._renew(
+                keys=[lease_key(partition)],
+                args=[self.worker_id, self.lease_ttl_ms],
+            )
+            if not renewed:
+                logger.warning("Lost the lease on partition %d", partition)
+                self._forget(partition, task)
+                task.cancel()
+
+        # the consumer releases the lease once its current batch is done
+        for partition in self.owned[target:]:
+            self._draining[partition] = self._owned.pop(partition)
+
+        free = [
+            p for p in range(self.partitions)
+            if p not in self._owned and p not in self._draining
+        ]
+        random.shuffle(free)
+        for partition in free:
+            if len(self._owned) >= target:
+                break
+            acquired = await self.redis.set(
+                lease_key(partition), self.worker_id,
+                nx=True, px=self.lease_ttl_ms,
+            )
+            if acquired:
+                self._take(partition)
+
+    async def run(self) -> None:
+        logger.info("Worker %s started", self.worker_id)
+        try:
+            while not self._stopping:
+                try:
+                    await self.rebalance()
+                except Exception:
+                    logger.exception("Rebalancing failed")
+                await asyncio.sleep(self.lease_ttl_ms / 3000)
+        finally:
+            await self.stop()
+
+    async def stop(self) -> None:
+        self._stopping = True
+        tasks = [*self._owned.values(), *self._draining.values()]
+        self._owned.clear()
+        self._draining.clear()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.redis.zrem(WORKERS_KEY, self.worker_id)
+
+
+async def run_receiver(dp: Dispatcher, bot: Bot, config: Config) -> None:
+    """Receive updates for the routers of ``dp`` and publish them."""
+    receiver = Dispatcher()
+    receiver.update.outer_middleware(UpdatePublisher(
+        create_redis(config),
+        config.worker_partitions,
+        config.worker_stream_maxlen,
+    ))
+    allowed_updates = dp.resolve_used_update_types()
+    if config.mode == "webhook":
+        # publish before answering Telegram, so an acknowledged update is
+        # never lost
+        await run_webhook(
+            receiver, bot, config,
+            allowed_updates=allowed_updates,
+            handle_in_background=False,
+        )
+    else:
+        await bot.delete_webhook()
+        # one update at a time keeps them in order within a partition
+        await receiver.start_polling(
+            bot, handle_as_tasks=False, allowed_updates=allowed_updates
+        )
+
+
+async def run_worker(worker_id: str) -> None:
+    config = load_config()
+    dp, bot = await create_application(config)
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+    worker = PartitionWorker(
+        create_redis(config), dp, bot,
+        partitions=config.worker_partitions,
+        worker_id=worker_id,
+        lease_ttl_ms=config.worker_lease_ttl_ms,
+        batch_size=config.worker_batch_size,
+        workflow_data=workflow_data,
+    )
+    await dp.emit_startup(bot=bot, **workflow_data)
+    try:
+        await worker.run()
+    finally:
+        await dp.emit_shutdown(bot=bot, **workflow_data)
+        await bot.session.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--id", default=f"{socket.gethostname()}-{os.getpid()}",
+        help="unique name of this worker",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker(args.id))
+
+
+if __name__ == "__main__":
+    main()